@@ -69,6 +69,12 @@ class FairseqMMTask(LegacyFairseqTask):
         skip_remainder_batch=False,
         grouped_shuffling=False,
         update_epoch_batch_itr=False,
+        batching_strategy="greedy",
+        padding_buckets=8,
+        batches_dir=None,
+        buffer_backend="thread",
+        buffer_slot_bytes=16 * 1024 * 1024,
+        token_budgets=None,
     ):
         random.seed(epoch)
         if dataset.mmdataset.split == "train" and isinstance(self.mmtask, RetriTask):
@@ -93,6 +99,12 @@ class FairseqMMTask(LegacyFairseqTask):
             disable_iterator_cache,
             grouped_shuffling,
             update_epoch_batch_itr,
+            batching_strategy=batching_strategy,
+            padding_buckets=padding_buckets,
+            batches_dir=batches_dir,
+            buffer_backend=buffer_backend,
+            buffer_slot_bytes=buffer_slot_bytes,
+            token_budgets=token_budgets,
         )
 
     @property
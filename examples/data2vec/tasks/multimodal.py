@@ -126,6 +126,12 @@ class MultimodalPretrainingTask(FairseqTask):
         skip_remainder_batch=False,
         grouped_shuffling=False,
         update_epoch_batch_itr=False,
+        batching_strategy="greedy",
+        padding_buckets=8,
+        batches_dir=None,
+        buffer_backend="thread",
+        buffer_slot_bytes=16 * 1024 * 1024,
+        token_budgets=None,
     ):
 
         # initialize the dataset with the correct starting epoch
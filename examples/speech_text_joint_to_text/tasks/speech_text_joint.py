@@ -328,6 +328,12 @@ class SpeechTextJointToTextTask(SpeechToTextTask):
         skip_remainder_batch=False,
         grouped_shuffling=False,
         update_epoch_batch_itr=False,
+        batching_strategy="greedy",
+        padding_buckets=8,
+        batches_dir=None,
+        buffer_backend="thread",
+        buffer_slot_bytes=16 * 1024 * 1024,
+        token_budgets=None,
     ):
 
         if not isinstance(dataset, MultiModalityDataset):
@@ -347,6 +353,12 @@ class SpeechTextJointToTextTask(SpeechToTextTask):
                 disable_iterator_cache,
                 skip_remainder_batch=skip_remainder_batch,
                 update_epoch_batch_itr=update_epoch_batch_itr,
+                batching_strategy=batching_strategy,
+                padding_buckets=padding_buckets,
+                batches_dir=batches_dir,
+                buffer_backend=buffer_backend,
+                buffer_slot_bytes=buffer_slot_bytes,
+                token_budgets=token_budgets,
             )
 
         mult_ratio = [self.args.speech_sample_ratio, self.args.text_sample_ratio]
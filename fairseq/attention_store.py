@@ -0,0 +1,798 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Append-only storage for attention captured during generation.
+
+A store is a directory holding raw tensor data in ``data-NNNNN.bin`` shards
+and an ``index.jsonl`` file with one line per stored leaf value. Writes only
+ever append to the last shard and to the index, so the cost of a capture is
+proportional to the size of the captured tensors, and a reader can load a
+single record or field without reading the rest of the store.
+
+Records are keyed by a hash of the source tokens (see :func:`token_key`), or
+by the ids of the generated sentences (see :func:`id_key`) when a source can
+occur more than once.
+Each record maps field names to values, which can be nested lists and dicts
+of tensors, like the encoder outputs. :func:`AttentionStore.put` sets a field
+and :func:`AttentionStore.append` appends to a list field, e.g. one decoder
+attention tensor per step.
+
+:class:`GenerationCapture` writes the attention of a generated batch with one
+record per sentence. The :class:`CaptureConfig` of the store selects how the
+attention weights are reduced on the device before they are copied out.
+"""
+
+import atexit
+import functools
+import hashlib
+import itertools
+import json
+import logging
+import math
+import os
+import queue
+import shutil
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Union
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.jsonl"
+# index lines kept in memory by the writer before it flushes the data
+_MAX_PENDING_INDEX_LINES = 4096
+
+# environment variable naming the store of get_default_store(), as
+# "<directory>,<name>" relative to the working directory
+STORE_ENV = "PKL_LOC"
+# environment variable with the CaptureConfig of get_default_store(), as
+# comma-separated "name=value" pairs, e.g. "topk=8,dtype=int8"
+CAPTURE_ENV = "PKL_CAPTURE"
+
+# reductions of the heads of the encoder attention, see AttentionProbe
+HEAD_REDUCTIONS = ("none", "mean_heads", "max_heads")
+DTYPES = ("float32", "float16", "int8")
+
+
+@dataclass
+class CaptureConfig:
+    """How captured attention weights are reduced before they are stored.
+
+    Args:
+        reduce_heads (str): ``"none"``, ``"mean_heads"`` or ``"max_heads"``
+            reduction of the heads of the encoder attention
+        topk (int): only keep the *topk* largest weights of each query,
+            0 keeps all of them
+        dtype (str): ``"float32"``, ``"float16"`` or ``"int8"``, which
+            stores the weights, that are in [0, 1], in steps of 1/255
+        trim_padding (bool): store one record per sentence without the padded
+            positions, instead of one record per batch
+    """
+
+    reduce_heads: str = "none"
+    topk: int = 0
+    dtype: str = "float32"
+    trim_padding: bool = True
+
+    def __post_init__(self):
+        if self.reduce_heads not in HEAD_REDUCTIONS:
+            raise ValueError(
+                f"unknown head reduction {self.reduce_heads}, choose from {HEAD_REDUCTIONS}"
+            )
+        if self.dtype not in DTYPES:
+            raise ValueError(f"unknown dtype {self.dtype}, choose from {DTYPES}")
+        if self.topk < 0:
+            raise ValueError(f"topk must be >= 0, got {self.topk}")
+
+    @classmethod
+    def from_string(cls, spec: str) -> "CaptureConfig":
+        """Parse comma-separated ``name=value`` pairs, e.g. ``"topk=8"``."""
+        kwargs = {}
+        for pair in filter(None, spec.split(",")):
+            name, value = pair.split("=", 1)
+            name = name.strip()
+            if name == "topk":
+                kwargs[name] = int(value)
+            elif name == "trim_padding":
+                kwargs[name] = value.strip().lower() in ("1", "true", "yes")
+            elif name in ("reduce_heads", "dtype"):
+                kwargs[name] = value.strip()
+            else:
+                raise ValueError(f"unknown capture option {name}")
+        return cls(**kwargs)
+
+
+class CompressedAttention(NamedTuple):
+    """Attention weights of shape *size* as stored: the *topk* largest
+    weights of each query and their *indices* in the last dimension if
+    *indices* is set, and quantized in steps of *scale* if it is set."""
+
+    values: torch.Tensor
+    indices: Optional[torch.Tensor]
+    size: List[int]
+    scale: Optional[float]
+
+
+def compress_attention(
+    attn: torch.Tensor, config: CaptureConfig
+) -> Union[torch.Tensor, CompressedAttention]:
+    """Reduce *attn* on its device as configured by *config*."""
+    attn = attn.detach()
+    if config.topk == 0 and config.dtype == "float32":
+        return attn
+    size = list(attn.shape)
+    indices = None
+    if 0 < config.topk < attn.size(-1):
+        attn, indices = attn.topk(config.topk, dim=-1)
+        indices = indices.to(torch.int16 if size[-1] <= 2**15 else torch.int32)
+    scale = None
+    if config.dtype == "float16":
+        attn = attn.half()
+    elif config.dtype == "int8":
+        scale = 1.0 / 255
+        attn = attn.float().mul(255).round_().clamp_(0, 255).to(torch.uint8)
+    else:
+        attn = attn.float()
+    return CompressedAttention(attn, indices, size, scale)
+
+
+def token_key(tokens: Union[torch.Tensor, List[int]]) -> str:
+    """Key of the record of the (flattened) source *tokens*."""
+    if isinstance(tokens, torch.Tensor):
+        tokens = tokens.detach().cpu().numpy()
+    data = np.ascontiguousarray(tokens, dtype=np.int64).reshape(-1)
+    return hashlib.blake2b(data.tobytes(), digest_size=16).hexdigest()
+
+
+def id_key(sentence_id: int) -> str:
+    """Key of the record of the sentence with id *sentence_id*, see
+    :attr:`AttentionStore.id_offset`."""
+    return f"id-{sentence_id}"
+
+
+def _tensors(value) -> Iterator[torch.Tensor]:
+    """Yield the tensors in *value*."""
+    if isinstance(value, torch.Tensor):
+        yield value
+    elif isinstance(value, CompressedAttention):
+        yield value.values
+        if value.indices is not None:
+            yield value.indices
+    elif isinstance(value, dict):
+        for v in value.values():
+            yield from _tensors(v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            yield from _tensors(v)
+
+
+def _aligned_nbytes(tensor: torch.Tensor) -> int:
+    return -(-tensor.numel() * tensor.element_size() // 8) * 8
+
+
+class _PinnedBuffer:
+    """A pinned host buffer that the tensors of a submitted value are copied
+    into one after the other."""
+
+    def __init__(self, nbytes: int):
+        self.data = torch.empty(nbytes, dtype=torch.uint8, pin_memory=True)
+        self.offset = 0
+
+    def take(self, tensor: torch.Tensor) -> torch.Tensor:
+        """Return a view of the buffer for a copy of *tensor*."""
+        start, self.offset = self.offset, self.offset + _aligned_nbytes(tensor)
+        nbytes = tensor.numel() * tensor.element_size()
+        return self.data[start : start + nbytes].view(tensor.dtype).view(tensor.shape)
+
+
+def _to_host(value, devices: List[torch.device], buffer: Optional[_PinnedBuffer]):
+    """Copy the tensors in *value* to the CPU, so that they can be written in
+    the background while the caller keeps going.
+
+    Copies from the GPU are asynchronous, into *buffer*, and the devices they
+    come from are added to *devices*.
+    """
+    if isinstance(value, torch.Tensor):
+        value = value.detach()
+        if value.is_cuda:
+            devices.append(value.device)
+            return buffer.take(value).copy_(value, non_blocking=True)
+        return value.to("cpu", copy=True)
+    if isinstance(value, CompressedAttention):
+        return value._replace(
+            values=_to_host(value.values, devices, buffer),
+            indices=_to_host(value.indices, devices, buffer),
+        )
+    if isinstance(value, dict):
+        return {k: _to_host(v, devices, buffer) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_host(v, devices, buffer) for v in value]
+    return value
+
+
+def _flatten(value, path=()):
+    """Yield the ``(path, leaf)`` pairs of nested lists and dicts. Empty
+    containers are leaves, so that they survive the round trip."""
+    if isinstance(value, CompressedAttention):
+        yield path, value
+    elif isinstance(value, dict) and value:
+        for k, v in value.items():
+            yield from _flatten(v, path + (k,))
+    elif isinstance(value, (list, tuple)) and value:
+        for i, v in enumerate(value):
+            yield from _flatten(v, path + (i,))
+    else:
+        yield path, value
+
+
+def _unflatten(leaves):
+    """Rebuild the value of a field from its ``(path, leaf)`` pairs."""
+    root = {}
+    for path, leaf in leaves:
+        if not path:
+            return leaf
+        node = root
+        for k in path[:-1]:
+            node = node.setdefault(k, {})
+        node[path[-1]] = leaf
+
+    def to_lists(node):
+        if not isinstance(node, dict) or not node:
+            return node
+        if all(isinstance(k, int) for k in node):
+            return [to_lists(node[i]) for i in range(len(node))]
+        return {k: to_lists(v) for k, v in node.items()}
+
+    return to_lists(root)
+
+
+class AttentionStore:
+    """Appends records to the store at *root* from a background writer thread.
+
+    Use :func:`open` to share a single writer per directory within a process.
+
+    Generated sentences are stored in the record of their source tokens. When
+    :attr:`id_offset` is set, they are stored in the record of their id in the
+    generated dataset plus :attr:`id_offset` instead (see :func:`id_key`), so
+    that repeated sources get a record each.
+
+    Args:
+        root (str): directory of the store
+        truncate (bool): remove the existing records
+        max_shard_bytes (int): start a new data shard past this size
+        capture (CaptureConfig, optional): how the generator reduces the
+            attention it captures into this store
+    """
+
+    _open_stores: Dict[str, "AttentionStore"] = {}
+
+    def __init__(
+        self,
+        root: str,
+        truncate: bool = False,
+        max_shard_bytes=1 << 30,
+        capture: Optional[CaptureConfig] = None,
+    ):
+        self.root = os.path.abspath(root)
+        self.max_shard_bytes = max_shard_bytes
+        self.capture = capture if capture is not None else CaptureConfig()
+        self.id_offset: Optional[int] = None
+        if truncate and os.path.exists(self.root):
+            shutil.rmtree(self.root)
+        os.makedirs(self.root, exist_ok=True)
+
+        self._keys = set()
+        self._item = 0
+        shard = 0
+        index_file = os.path.join(self.root, INDEX_FILE)
+        if os.path.exists(index_file):
+            _truncate_partial_line(index_file)
+            for entry in _read_index(index_file):
+                if "tokens" in entry:
+                    self._keys.add(entry["key"])
+                else:
+                    self._item = max(self._item, entry["item"] + 1)
+                shard = max(shard, entry.get("shard", 0))
+        self._index = open(index_file, "a", encoding="utf-8")
+        self._shard = shard
+        self._data = open(self._shard_path(shard), "ab")
+        # index lines waiting for the data they point to to be flushed
+        self._index_lines: List[str] = []
+
+        self._queue = queue.Queue()
+        self._error = None
+        # pinned buffers that the writer is done with, reused by _submit_split
+        self._free_buffers: List[_PinnedBuffer] = []
+        self._buffers_lock = threading.Lock()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    @classmethod
+    def open(
+        cls,
+        root: str,
+        truncate: bool = False,
+        capture: Optional[CaptureConfig] = None,
+    ) -> "AttentionStore":
+        """Return the store at *root*, shared by all callers in the process."""
+        root = os.path.abspath(root)
+        store = cls._open_stores.get(root)
+        if store is not None and truncate:
+            store.close()
+            store = None
+        if store is None:
+            store = cls._open_stores[root] = cls(
+                root, truncate=truncate, capture=capture
+            )
+        elif capture is not None:
+            store.capture = capture
+        return store
+
+    def _shard_path(self, shard: int) -> str:
+        return os.path.join(self.root, f"data-{shard:05d}.bin")
+
+    def put(self, tokens, field: str, value: Any):
+        """Set *field* of the record of *tokens* to *value*."""
+        self._submit(tokens, field, value, append=False)
+
+    def append(self, tokens, field: str, value: Any):
+        """Append *value* to the list *field* of the record of *tokens*."""
+        self._submit(tokens, field, value, append=True)
+
+    def _submit(self, tokens, field, value, append):
+        if isinstance(tokens, str):
+            key, token_list = tokens, None
+        else:
+            key = token_key(tokens)
+            token_list = (
+                tokens.detach().cpu().reshape(-1).tolist()
+                if isinstance(tokens, torch.Tensor)
+                else list(tokens)
+            )
+        self._submit_keyed(key, token_list, field, value, append)
+
+    def _submit_keyed(self, key, token_list, field, value, append):
+        self._submit_split(
+            value, lambda value: [(key, token_list, field, value, append)]
+        )
+
+    def _submit_split(self, value, split):
+        """Copy *value* to the host and queue the ``(key, tokens, field,
+        value, append)`` writes that ``split(value)`` returns on the writer
+        thread. The tensors of *value* on the GPU are copied at once into a
+        pinned buffer that is reused once they are written."""
+        if self._error is not None:
+            raise RuntimeError(f"writing to {self.root} failed") from self._error
+        nbytes = sum(_aligned_nbytes(t) for t in _tensors(value) if t.is_cuda)
+        buffer = self._get_buffer(nbytes) if nbytes > 0 else None
+        devices = []
+        value = _to_host(value, devices, buffer)
+        # the writer waits for the copies from the GPU to complete
+        events = []
+        for device in set(devices):
+            event = torch.cuda.Event()
+            event.record(torch.cuda.current_stream(device))
+            events.append(event)
+        self._queue.put((value, split, buffer, events))
+
+    def _get_buffer(self, nbytes: int) -> _PinnedBuffer:
+        with self._buffers_lock:
+            for i, buffer in enumerate(self._free_buffers):
+                if buffer.data.numel() >= nbytes:
+                    return self._free_buffers.pop(i)
+        return _PinnedBuffer(1 << max(math.ceil(math.log2(nbytes)), 16))
+
+    def _release_buffer(self, buffer: _PinnedBuffer):
+        buffer.offset = 0
+        with self._buffers_lock:
+            self._free_buffers.append(buffer)
+
+    def flush(self):
+        """Wait until everything submitted so far is written."""
+        self._queue.join()
+        if self._error is not None:
+            raise RuntimeError(f"writing to {self.root} failed") from self._error
+
+    def close(self):
+        if self._writer is None:
+            return
+        self.flush()
+        self._queue.put(None)
+        self._writer.join()
+        self._writer = None
+        self._data.close()
+        self._index.close()
+        if AttentionStore._open_stores.get(self.root) is self:
+            del AttentionStore._open_stores[self.root]
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    if self._error is None:
+                        self._flush_files()
+                    return
+                if self._error is None:
+                    value, split, buffer, events = item
+                    for event in events:
+                        event.synchronize()
+                    for write in split(value):
+                        self._write(*write)
+                    if buffer is not None:
+                        self._release_buffer(buffer)
+                    if (
+                        self._queue.empty()
+                        or len(self._index_lines) >= _MAX_PENDING_INDEX_LINES
+                    ):
+                        self._flush_files()
+            except Exception as e:
+                logger.exception(f"failed to write attention to {self.root}")
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _write(self, key, tokens, field, value, append):
+        lines = []
+        if key not in self._keys:
+            self._keys.add(key)
+            lines.append({"key": key, "tokens": tokens})
+        item, self._item = self._item, self._item + 1
+        for path, leaf in _flatten(value):
+            entry = {"key": key, "field": field, "item": item, "path": list(path)}
+            if append:
+                entry["append"] = True
+            if isinstance(leaf, torch.Tensor):
+                entry.update(self._write_array(leaf))
+            elif isinstance(leaf, CompressedAttention):
+                entry.update(self._write_array(leaf.values), size=leaf.size)
+                if leaf.scale is not None:
+                    entry["scale"] = leaf.scale
+                if leaf.indices is not None:
+                    entry["indices"] = self._write_array(leaf.indices)
+            else:
+                entry["value"] = leaf
+            lines.append(entry)
+        self._index_lines.extend(json.dumps(line) + "\n" for line in lines)
+
+    def _flush_files(self):
+        # the data reaches the file before the index lines that point to it,
+        # so that a crash never leaves index lines without their data
+        self._data.flush()
+        if self._index_lines:
+            self._index.write("".join(self._index_lines))
+            self._index_lines = []
+        self._index.flush()
+
+    def _write_array(self, tensor: torch.Tensor) -> dict:
+        if tensor.dtype == torch.bfloat16:
+            tensor = tensor.float()
+        array = np.ascontiguousarray(tensor.numpy())
+        if self._data.tell() + array.nbytes > self.max_shard_bytes > 0:
+            self._data.close()
+            self._shard += 1
+            self._data = open(self._shard_path(self._shard), "ab")
+        location = {
+            "shard": self._shard,
+            "offset": self._data.tell(),
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+        }
+        self._data.write(array.tobytes())
+        return location
+
+
+# batch and time dimensions of the encoder outputs, see TransformerEncoderBase
+_ENCODER_OUT_DIMS = {
+    "encoder_out": (1, 0),
+    "encoder_padding_mask": (0, 1),
+    "encoder_embedding": (0, 1),
+    "encoder_states": (1, 0),
+    "fc_results": (1, 0),
+    "src_tokens": (0, 1),
+    "src_lengths": (0, None),
+}
+
+
+class GenerationCapture:
+    """Captures the attention of the generation of a batch of sentences into
+    *store*, reduced as configured by ``store.capture``.
+
+    With ``trim_padding``, each sentence gets its own record keyed by its
+    source tokens without padding, and its attention is cut to the source
+    positions. Otherwise the batch is stored as a single record.
+
+    Args:
+        store (AttentionStore): where to write the attention
+        src_tokens (LongTensor): source tokens of shape `(batch, src_len)`
+        pad (int): padding index
+        beam_size (int): number of hypotheses per sentence
+        ids (LongTensor, optional): ids of the sentences, which key their
+            records if ``store.id_offset`` is set
+    """
+
+    def __init__(
+        self,
+        store: AttentionStore,
+        src_tokens: torch.Tensor,
+        pad,
+        beam_size,
+        ids: Optional[torch.Tensor] = None,
+    ):
+        self.store = store
+        self.config = store.capture
+        self.beam_size = beam_size
+        if self.config.trim_padding:
+            keep = src_tokens.ne(pad)
+            self._positions = [row.nonzero().squeeze(1) for row in keep]
+            # for the writer thread, which splits the decoder steps
+            self._host_positions = [p.cpu() for p in self._positions]
+            # padding of the sentences that are still generated
+            self._active_pad = ~keep
+            token_lists = [
+                row[row.ne(pad)].tolist() for row in src_tokens.detach().cpu()
+            ]
+        else:
+            self._positions = None
+            token_lists = [src_tokens.detach().cpu().reshape(-1).tolist()]
+        if (
+            self._positions is not None
+            and ids is not None
+            and store.id_offset is not None
+        ):
+            keys = [id_key(store.id_offset + i) for i in ids.tolist()]
+        else:
+            keys = [token_key(tokens) for tokens in token_lists]
+        self._records = list(zip(keys, token_lists))
+        # position in the batch of the sentences that are still generated
+        self._active = list(range(len(self._records)))
+
+    def select(self, batch_idxs: torch.Tensor):
+        """Keep the sentences at *batch_idxs* of the current batch."""
+        if self._positions is not None:
+            self._active = [self._active[i] for i in batch_idxs.tolist()]
+            self._active_pad = self._active_pad.index_select(0, batch_idxs)
+
+    def encoder(self, encoder_outs, encoder_attn: List[List[torch.Tensor]]):
+        """Store the encoder outputs of each model with the weights captured
+        by its attention probe, of shape `(heads, batch, src_len, src_len)`
+        or `(batch, src_len, src_len)` if the heads were reduced."""
+        for i, (key, tokens) in enumerate(self._records):
+            value = []
+            for out, attn in zip(encoder_outs, encoder_attn):
+                out = {
+                    name: [self._trim(t, i, *_ENCODER_OUT_DIMS[name]) for t in ts]
+                    if name in _ENCODER_OUT_DIMS
+                    else ts
+                    for name, ts in out.items()
+                }
+                out["encoder_attn"] = [
+                    compress_attention(
+                        self._trim(a, i, a.dim() - 3, a.dim() - 2, a.dim() - 1),
+                        self.config,
+                    )
+                    for a in attn
+                ]
+                value.append(out)
+            self.store._submit_keyed(key, tokens, "encoder_outs", value, False)
+            # the steps of a sentence that is generated again replace the old ones
+            self.store._submit_keyed(key, tokens, "decoder_attn", [], False)
+
+    def decoder_step(self, attn: Optional[torch.Tensor]):
+        """Append the attention of a decoder step, of shape
+        `(batch * beam_size, src_len)`, to the sentences being generated.
+
+        The step is reduced and copied to the host as a whole, and split into
+        the sentences on the writer thread."""
+        if self._positions is None:
+            key, tokens = self._records[0]
+            if attn is not None:
+                attn = compress_attention(attn, self.config)
+            self.store._submit_keyed(key, tokens, "decoder_attn", attn, True)
+            return
+        if attn is None:
+            for i in self._active:
+                key, tokens = self._records[i]
+                self.store._submit_keyed(key, tokens, "decoder_attn", None, True)
+            return
+        attn = attn.detach()
+        if 0 < self.config.topk < attn.size(-1):
+            # the padding of a sentence is never among its top k weights
+            pad = self._active_pad.repeat_interleave(self.beam_size, dim=0)
+            attn = attn.masked_fill(pad, -1)
+        self.store._submit_split(
+            compress_attention(attn, self.config),
+            functools.partial(self._split_step, list(self._active)),
+        )
+
+    def _split_step(self, active: List[int], step):
+        """Return the writes of the decoder *step* of the sentences at
+        positions *active* of the batch."""
+        writes = []
+        for row, i in enumerate(active):
+            rows = slice(row * self.beam_size, (row + 1) * self.beam_size)
+            key, tokens = self._records[i]
+            writes.append(
+                (key, tokens, "decoder_attn", self._trim_step(step, rows, i), True)
+            )
+        return writes
+
+    def _trim_step(self, step, rows, i):
+        """The *rows* of the decoder *step* of the sentence at position *i* of
+        the batch, without its padding, as :func:`compress_attention` would
+        have reduced the sentence alone."""
+        if isinstance(step, torch.Tensor):
+            return self._trim(step[rows], i, None, 1)
+        positions = self._host_positions[i]
+        length = step.size[-1]
+        values = step.values[rows]
+        size = [values.size(0), positions.numel()]
+        if step.indices is None:
+            return step._replace(values=self._trim(values, i, None, 1), size=size)
+        indices = step.indices[rows].long()
+        if self.config.topk < positions.numel():
+            # the positions of the top k weights in the sentence without padding
+            trimmed = torch.full((length,), -1, dtype=torch.long)
+            trimmed[positions] = torch.arange(positions.numel())
+            indices = trimmed[indices].to(
+                torch.int16 if positions.numel() <= 2**15 else torch.int32
+            )
+            return step._replace(values=values, indices=indices, size=size)
+        # the sentence has no more than k positions, which are all kept
+        values = values.new_zeros(values.size(0), length).scatter_(1, indices, values)
+        return step._replace(
+            values=self._trim(values, i, None, 1), indices=None, size=size
+        )
+
+    def _trim(self, tensor, i, batch_dim, *time_dims):
+        """Cut the sentence at position *i* of the batch out of *tensor*."""
+        if tensor is None or self._positions is None:
+            return tensor
+        if batch_dim is not None:
+            tensor = tensor.narrow(batch_dim, i, 1)
+        positions = self._positions[i]
+        if positions.device != tensor.device:
+            positions = self._host_positions[i]
+        for dim in time_dims:
+            if dim is not None and positions.numel() < tensor.size(dim):
+                tensor = tensor.index_select(dim, positions)
+        return tensor
+
+
+def get_default_store() -> Optional[AttentionStore]:
+    """The store named by the ``PKL_LOC`` environment variable, if it is set.
+
+    ``PKL_CAPTURE`` overrides the capture config of the store, see
+    :func:`CaptureConfig.from_string`.
+    """
+    location = os.environ.get(STORE_ENV)
+    if not location:
+        return None
+    directory, name = location.split(",")
+    capture = os.environ.get(CAPTURE_ENV)
+    return AttentionStore.open(
+        os.path.join(os.getcwd(), directory, name),
+        capture=CaptureConfig.from_string(capture) if capture else None,
+    )
+
+
+@atexit.register
+def _close_stores():
+    for store in list(AttentionStore._open_stores.values()):
+        store.close()
+
+
+def _truncate_partial_line(index_file: str):
+    """Drop the last line of *index_file* if a crash left it incomplete."""
+    with open(index_file, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        f.seek(max(size - (1 << 20), 0))
+        tail = f.read()
+        f.truncate(size - len(tail) + tail.rfind(b"\n") + 1)
+
+
+def _read_index(index_file: str) -> Iterator[dict]:
+    with open(index_file, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.endswith("\n"):
+                # a line without newline is a partial write
+                yield json.loads(line)
+
+
+class AttentionStoreReader:
+    """Reads the records of the store at *root*, loading tensor data lazily.
+
+    ``reader[tokens_or_key]`` returns the whole record as a dict of fields,
+    in the layout of the original pickle, and :func:`get` a single field.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._tokens: Dict[str, List[int]] = {}
+        self._entries: Dict[str, Dict[str, List[dict]]] = {}
+        self._shards: Dict[int, np.memmap] = {}
+        for entry in _read_index(os.path.join(root, INDEX_FILE)):
+            if "tokens" in entry:
+                self._tokens[entry["key"]] = entry["tokens"]
+                self._entries.setdefault(entry["key"], {})
+            else:
+                fields = self._entries.setdefault(entry["key"], {})
+                fields.setdefault(entry["field"], []).append(entry)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, tokens):
+        return self._key(tokens) in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def keys(self):
+        return self._entries.keys()
+
+    def tokens(self, key: str) -> Optional[List[int]]:
+        return self._tokens.get(key)
+
+    def fields(self, tokens) -> List[str]:
+        return list(self._entries[self._key(tokens)])
+
+    def __getitem__(self, tokens) -> Dict[str, Any]:
+        key = self._key(tokens)
+        return {field: self.get(key, field) for field in self._entries[key]}
+
+    def get(self, tokens, field: str) -> Any:
+        entries = self._entries[self._key(tokens)][field]
+        value = None
+        appended = False
+        # entries of the same put() or append() call share their item id
+        for _, item in itertools.groupby(entries, key=lambda e: e["item"]):
+            item = list(item)
+            leaves = ((tuple(e["path"]), self._load(e)) for e in item)
+            if item[0].get("append", False):
+                if not appended:
+                    # a copy, as a put() value can be shared with the index
+                    value = list(value) if isinstance(value, list) else []
+                    appended = True
+                value.append(_unflatten(leaves))
+            else:
+                value = _unflatten(leaves)
+                appended = False
+        return value
+
+    def _key(self, tokens) -> str:
+        return tokens if isinstance(tokens, str) else token_key(tokens)
+
+    def _load(self, entry):
+        if "value" in entry:
+            return entry["value"]
+        tensor = self._load_array(entry)
+        # compressed attention is returned dense, see compress_attention()
+        if "scale" in entry:
+            tensor = tensor.float().mul_(entry["scale"])
+        if "indices" in entry:
+            indices = self._load_array(entry["indices"]).long()
+            tensor = tensor.new_zeros(entry["size"]).scatter_(-1, indices, tensor)
+        return tensor
+
+    def _load_array(self, location):
+        shard = self._shards.get(location["shard"])
+        if shard is None:
+            path = os.path.join(self.root, f"data-{location['shard']:05d}.bin")
+            shard = self._shards[location["shard"]] = np.memmap(path, mode="r")
+        dtype = np.dtype(location["dtype"])
+        count = int(np.prod(location["shape"], dtype=np.int64))
+        array = np.frombuffer(
+            shard, dtype=dtype, count=count, offset=location["offset"]
+        ).reshape(location["shape"])
+        return torch.from_numpy(array.copy())
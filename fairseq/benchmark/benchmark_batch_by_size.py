@@ -0,0 +1,114 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Time the batching strategies of :func:`fairseq.data.data_utils.batch_by_size`
+on a synthetic dataset, e.g.::
+
+    python -m fairseq.benchmark.benchmark_batch_by_size --num-indices 100000000
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from fairseq.data import data_utils
+
+try:
+    from fairseq.data import data_utils_fast
+except ImportError:
+    data_utils_fast = None
+
+STRATEGIES = ["cython_fn", "cython_vec", "numpy_vec", "cython_fixed", "numpy_fixed"]
+
+
+def _fixed_shapes(max_tokens, max_len):
+    lengths = 2 ** np.arange(3, int(np.log2(max_len)) + 2)
+    return np.array([[max(max_tokens // n, 1), n] for n in lengths], dtype=np.int64)
+
+
+def _make_strategy(name, indices, sizes, num_tokens_vec, args):
+    num_tokens_fn = sizes.item
+    fixed_shapes_sorted = _fixed_shapes(args.max_tokens, args.max_len)
+
+    if name.startswith("cython_") and data_utils_fast is None:
+        return None
+    if name == "cython_fn":
+        return lambda: data_utils_fast.batch_by_size_fn(
+            indices, num_tokens_fn, args.max_tokens, args.max_sentences, args.bsz_mult
+        )
+    if name == "cython_vec":
+        return lambda: data_utils_fast.batch_by_size_vec(
+            indices, num_tokens_vec, args.max_tokens, args.max_sentences, args.bsz_mult
+        )
+    if name == "numpy_vec":
+        return lambda: data_utils.batch_by_size_vec_numpy(
+            indices, num_tokens_vec, args.max_tokens, args.max_sentences, args.bsz_mult
+        )
+    if name == "cython_fixed":
+        return lambda: data_utils_fast.batch_fixed_shapes_fast(
+            indices, num_tokens_fn, fixed_shapes_sorted
+        )
+    if name == "numpy_fixed":
+        return lambda: data_utils.batch_fixed_shapes_numpy(
+            indices, num_tokens_vec, fixed_shapes_sorted
+        )
+    raise ValueError(f"unknown strategy: {name}")
+
+
+def benchmark_batch_by_size(args):
+    rng = np.random.RandomState(args.seed)
+    sizes = rng.randint(1, args.max_len + 1, size=args.num_indices).astype(np.int64)
+    if args.order == "sorted":
+        indices = np.argsort(sizes, kind="mergesort").astype(np.int64)
+    else:
+        indices = rng.permutation(args.num_indices).astype(np.int64)
+    num_tokens_vec = sizes[indices]
+
+    print(
+        f"| {args.num_indices} indices ({args.order}), max_tokens={args.max_tokens}, "
+        f"max_sentences={args.max_sentences}, bsz_mult={args.bsz_mult}"
+    )
+    baseline = None
+    for name in args.strategies:
+        fn = _make_strategy(name, indices, sizes, num_tokens_vec, args)
+        if fn is None:
+            print(f"| {name:>12}: skipped, Cython components are not built")
+            continue
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            batches = fn()
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        if name == "cython_vec":
+            baseline = best
+        relative = f" ({best / baseline:.2f}x cython_vec)" if baseline else ""
+        print(
+            f"| {name:>12}: {best:8.3f}s for {len(batches)} batches, "
+            f"{1e9 * best / args.num_indices:.1f}ns per index{relative}"
+        )
+        del batches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--num-indices", type=int, default=100000000)
+    parser.add_argument("--max-len", type=int, default=512)
+    parser.add_argument("--max-tokens", type=int, default=4096)
+    parser.add_argument("--max-sentences", type=int, default=-1)
+    parser.add_argument("--bsz-mult", type=int, default=8)
+    parser.add_argument("--order", choices=["random", "sorted"], default="sorted")
+    parser.add_argument(
+        "--strategies", nargs="+", choices=STRATEGIES, default=STRATEGIES
+    )
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1)
+    benchmark_batch_by_size(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -3,18 +3,20 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import itertools
 import logging
 import os
 import typing as tp
 from abc import ABC, abstractmethod
-from collections import Counter
+from collections import Counter, defaultdict, deque
 from dataclasses import dataclass
 from multiprocessing import Pool
 
+import numpy as np
 import torch
 
 from fairseq.data import Dictionary, indexed_dataset
-from fairseq.file_chunker_utils import Chunker, find_offsets
+from fairseq.file_chunker_utils import Chunker, find_offsets, is_stream
 from fairseq.file_io import PathManager
 from fairseq.tokenizer import tokenize_line
 
@@ -64,7 +66,9 @@ class BinarizeSummary:
 
 class Binarizer(ABC):
     """
-    a binarizer describes how to take a string and build a tensor out of it
+    a binarizer describes how to take a string and build a tensor out of it.
+    Binarizers can also implement binarize_lines(lines, summary) to binarize
+    a batch of lines at once
     """
 
     @abstractmethod
@@ -76,10 +80,85 @@ class Binarizer(ABC):
         ...
 
 
+# number of lines binarized at once
+_LINES_PER_BATCH = 10000
+
+
 def _worker_prefix(output_prefix: str, worker_id: int):
     return f"{output_prefix}.pt{worker_id}"
 
 
+def _remove_dataset_files(prefix: str):
+    try:
+        os.remove(indexed_dataset.data_file_path(prefix))
+        os.remove(indexed_dataset.index_file_path(prefix))
+    except Exception as e:
+        logger.error(f"couldn't remove {prefix}.*", exc_info=e)
+
+
+def _merge_and_finalize(final_ds, output_prefix: str, num_workers: int):
+    """
+    append the finalized outputs of workers 1..num_workers-1 to the builder
+    of worker 0, remove them and finalize the builder
+    """
+    if num_workers > 1:
+        worker_output_prefixes = [
+            _worker_prefix(output_prefix, worker_id)
+            for worker_id in range(1, num_workers)
+        ]
+        # merge the worker outputs
+        if hasattr(final_ds, "merge_files_"):
+            final_ds.merge_files_(worker_output_prefixes)
+        else:
+            for worker_output_prefix in worker_output_prefixes:
+                final_ds.merge_file_(worker_output_prefix)
+        for worker_output_prefix in worker_output_prefixes:
+            _remove_dataset_files(worker_output_prefix)
+
+    #  now we can close the file
+    idx_file = indexed_dataset.index_file_path(output_prefix)
+    final_ds.finalize(idx_file)
+
+
+def _add_items(ds, tokens, offsets):
+    if hasattr(ds, "add_items"):
+        ds.add_items(tokens, offsets)
+        return
+    for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+        ds.add_item(torch.from_numpy(tokens[start:end]))
+
+
+def _binarize_batch(
+    binarizer: Binarizer, lines: tp.List[str], summary: BinarizeSummary
+) -> tp.Tuple[np.ndarray, np.ndarray]:
+    if hasattr(binarizer, "binarize_lines"):
+        return binarizer.binarize_lines(lines, summary)
+    return _concat_items(
+        [binarizer.binarize_line(line, summary).numpy() for line in lines]
+    )
+
+
+def _concat_items(items: tp.List[np.ndarray]) -> tp.Tuple[np.ndarray, np.ndarray]:
+    offsets = np.zeros(len(items) + 1, dtype=np.int64)
+    np.cumsum([len(item) for item in items], out=offsets[1:])
+    return np.concatenate(items or [np.zeros(0, np.int32)]), offsets
+
+
+# the binarizer of a stream_dataset() worker, set once per process
+_stream_binarizer = None
+
+
+def _init_stream_worker(binarizer: Binarizer):
+    global _stream_binarizer
+    _stream_binarizer = binarizer
+
+
+def _binarize_stream_batch(lines: tp.List[str]):
+    summary = BinarizeSummary()
+    tokens, offsets = _binarize_batch(_stream_binarizer, lines, summary)
+    return tokens, offsets, summary
+
+
 class FileBinarizer:
     """
     An file binarizer can take a file, tokenize it, and binarize each line to a tensor
@@ -95,6 +174,15 @@ class FileBinarizer:
         vocab_size=None,
         num_workers=1,
     ) -> BinarizeSummary:
+        if num_workers > 1 and is_stream(input_file):
+            return cls.stream_dataset(
+                input_file,
+                dataset_impl,
+                binarizer,
+                output_prefix,
+                vocab_size=vocab_size,
+                num_workers=num_workers,
+            )
         final_summary = BinarizeSummary()
 
         offsets = find_offsets(input_file, num_workers)
@@ -148,25 +236,55 @@ class FileBinarizer:
         )
         final_summary.merge(summ)
 
-        if num_workers > 1:
-            for worker_id in range(1, num_workers):
-                # merge the worker outputs
-                worker_output_prefix = _worker_prefix(
-                    output_prefix,
-                    worker_id,
-                )
-                final_ds.merge_file_(worker_output_prefix)
-                try:
-                    os.remove(indexed_dataset.data_file_path(worker_output_prefix))
-                    os.remove(indexed_dataset.index_file_path(worker_output_prefix))
-                except Exception as e:
-                    logger.error(
-                        f"couldn't remove {worker_output_prefix}.*", exc_info=e
-                    )
-
-        #  now we can close the file
-        idx_file = indexed_dataset.index_file_path(output_prefix)
-        final_ds.finalize(idx_file)
+        _merge_and_finalize(final_ds, output_prefix, num_workers)
+        return final_summary
+
+    @classmethod
+    def stream_dataset(
+        cls,
+        input_file: str,
+        dataset_impl: str,
+        binarizer: Binarizer,
+        output_prefix: str,
+        vocab_size=None,
+        num_workers=1,
+    ) -> BinarizeSummary:
+        """
+        binarize a file that is read sequentially, such as stdin ("-") or a
+        compressed file: the main process reads batches of lines and fans them
+        out to the workers, and writes the results in order into a single
+        dataset builder. At most 2 batches per worker are in flight.
+        """
+        final_summary = BinarizeSummary()
+        ds = indexed_dataset.make_builder(
+            indexed_dataset.data_file_path(output_prefix),
+            impl=dataset_impl,
+            vocab_size=vocab_size,
+        )
+
+        def write(result):
+            tokens, offsets, summ = result
+            _add_items(ds, tokens, offsets)
+            final_summary.merge(summ)
+
+        with Chunker(input_file, 0, -1) as line_iterator, Pool(
+            processes=num_workers,
+            initializer=_init_stream_worker,
+            initargs=(binarizer,),
+        ) as pool:
+            lines_itr = iter(line_iterator)
+            in_flight = deque()
+            while True:
+                lines = list(itertools.islice(lines_itr, _LINES_PER_BATCH))
+                if not lines:
+                    break
+                in_flight.append(pool.apply_async(_binarize_stream_batch, (lines,)))
+                if len(in_flight) >= 2 * num_workers:
+                    write(in_flight.popleft().get())
+            while in_flight:
+                write(in_flight.popleft().get())
+
+        ds.finalize(indexed_dataset.index_file_path(output_prefix))
         return final_summary
 
     @staticmethod
@@ -195,8 +313,17 @@ class FileBinarizer:
         with Chunker(
             PathManager.get_local_path(filename), offset_start, offset_end
         ) as line_iterator:
-            for line in line_iterator:
-                ds.add_item(binarizer.binarize_line(line, summary))
+            if not hasattr(binarizer, "binarize_lines"):
+                for line in line_iterator:
+                    ds.add_item(binarizer.binarize_line(line, summary))
+                return ds, summary
+            lines_itr = iter(line_iterator)
+            while True:
+                lines = list(itertools.islice(lines_itr, _LINES_PER_BATCH))
+                if not lines:
+                    break
+                tokens, offsets = binarizer.binarize_lines(lines, summary)
+                _add_items(ds, tokens, offsets)
 
         return ds, summary
 
@@ -285,6 +412,230 @@ class VocabularyDatasetBinarizer(Binarizer):
         summary.num_tok += len(ids)
         return ids
 
+    def binarize_lines(
+        self,
+        lines: tp.List[str],
+        summary: BinarizeSummary,
+    ) -> tp.Tuple[np.ndarray, np.ndarray]:
+        """
+        binarize a batch of lines at once, returns the concatenated ids and the
+        offsets of each line into them
+        """
+        if (
+            self.already_numberized
+            or type(self.dict).encode_line is not Dictionary.encode_line
+        ):
+            # subclasses of Dictionary may encode lines differently
+            return _concat_items(
+                [self.binarize_line(line, summary).numpy() for line in lines]
+            )
+        if summary.replaced is None:
+            summary.replaced = Counter()
+
+        tokens, offsets = self.dict.encode_lines(
+            lines,
+            line_tokenizer=self.tokenize,
+            add_if_not_exist=False,
+            append_eos=self.append_eos,
+            reverse_order=self.reverse_order,
+            replaced=summary.replaced,
+        )
+        summary.num_seq += len(lines)
+        summary.num_tok += len(tokens)
+        return tokens, offsets
+
+
+@dataclass
+class InterimChunk:
+    """
+    A chunk of a text file that was tokenized before the final dictionary is
+    known: its lines are stored as indices into *words* in an int32 mmap
+    dataset at *prefix*, and *counts* holds the number of occurrences of each
+    word, including the eos symbol appended to each line
+    """
+
+    prefix: str
+    words: tp.List[str]
+    counts: np.ndarray
+    num_seq: int
+
+    def add_counts_to(self, dict: Dictionary):
+        """
+        add the word counts of the chunk to *dict*, like
+        Dictionary.add_file_to_dictionary does
+        """
+        for w, c in sorted(zip(self.words, self.counts.tolist())):
+            dict.add_symbol(w, c)
+
+
+class InterimBinarizer:
+    """
+    Binarizes a text file that the dictionary is built from while reading it
+    only once: tokenize() assigns worker-local ids and collects the word
+    counts, and remap() rewrites them to the ids of the finalized dictionary.
+    """
+
+    @staticmethod
+    def tokenize(
+        input_file: str,
+        interim_prefix: str,
+        eos_word: str,
+        tokenize: tp.Callable[[str], tp.List[str]] = tokenize_line,
+        num_workers: int = 1,
+    ) -> tp.List[InterimChunk]:
+        offsets = find_offsets(input_file, num_workers)
+        args = [
+            (
+                input_file,
+                start,
+                end,
+                _worker_prefix(interim_prefix, worker_id),
+                eos_word,
+                tokenize,
+            )
+            for worker_id, (start, end) in enumerate(zip(offsets, offsets[1:]))
+        ]
+        if len(args) == 1:
+            return [InterimBinarizer._tokenize_chunk(*args[0])]
+        with Pool(processes=num_workers) as pool:
+            return pool.starmap(InterimBinarizer._tokenize_chunk, args)
+
+    @staticmethod
+    def _tokenize_chunk(
+        filename: str,
+        offset_start: int,
+        offset_end: int,
+        prefix: str,
+        eos_word: str,
+        tokenize: tp.Callable[[str], tp.List[str]],
+    ) -> InterimChunk:
+        if tokenize is tokenize_line:
+            tokenize = str.split
+        # assigns the next id to unseen words without leaving C code
+        indices = defaultdict(itertools.count().__next__)
+        counts = np.zeros(0, dtype=np.int64)
+        ds = indexed_dataset.MMapIndexedDatasetBuilder(
+            indexed_dataset.data_file_path(prefix), dtype=np.int32
+        )
+        num_seq = 0
+        with Chunker(
+            PathManager.get_local_path(filename), offset_start, offset_end
+        ) as line_iterator:
+            lines_itr = iter(line_iterator)
+            while True:
+                lines = list(itertools.islice(lines_itr, _LINES_PER_BATCH))
+                if not lines:
+                    break
+                words = [tokenize(line) + [eos_word] for line in lines]
+                offsets = np.zeros(len(words) + 1, dtype=np.int64)
+                np.cumsum(list(map(len, words)), out=offsets[1:])
+                tokens = np.fromiter(
+                    map(indices.__getitem__, itertools.chain.from_iterable(words)),
+                    dtype=np.int32,
+                    count=offsets[-1],
+                )
+                batch_counts = np.bincount(tokens, minlength=len(indices))
+                batch_counts[: len(counts)] += counts
+                counts = batch_counts
+                ds.add_items(tokens, offsets)
+                num_seq += len(lines)
+        ds.finalize(indexed_dataset.index_file_path(prefix))
+        return InterimChunk(
+            prefix=prefix, words=list(indices), counts=counts, num_seq=num_seq
+        )
+
+    @classmethod
+    def remap(
+        cls,
+        chunks: tp.List[InterimChunk],
+        dict: Dictionary,
+        output_prefix: str,
+        dataset_impl: str,
+    ) -> BinarizeSummary:
+        """
+        write the chunks with the ids of *dict* to a dataset at *output_prefix*
+        and remove the interim files
+        """
+        final_summary = BinarizeSummary()
+        (first_chunk, *more_chunks) = chunks
+        if more_chunks:
+            with Pool(processes=len(more_chunks)) as pool:
+                summaries = pool.starmap(
+                    cls._remap_chunk_and_finalize,
+                    [
+                        (
+                            chunk,
+                            dict,
+                            _worker_prefix(output_prefix, worker_id),
+                            dataset_impl,
+                        )
+                        for worker_id, chunk in enumerate(more_chunks, start=1)
+                    ],
+                )
+            for summ in summaries:
+                final_summary.merge(summ)
+
+        # do not close the bin file as we need to merge the worker results in
+        final_ds, summ = cls._remap_chunk(
+            first_chunk, dict, output_prefix, dataset_impl
+        )
+        final_summary.merge(summ)
+        _merge_and_finalize(final_ds, output_prefix, len(chunks))
+        return final_summary
+
+    @staticmethod
+    def _remap_chunk(
+        chunk: InterimChunk,
+        dict: Dictionary,
+        output_prefix: str,
+        dataset_impl: str,
+    ) -> tp.Tuple[tp.Any, BinarizeSummary]:  # (dataset builder, BinarizeSummary)
+        ds = indexed_dataset.make_builder(
+            indexed_dataset.data_file_path(output_prefix),
+            impl=dataset_impl,
+            vocab_size=len(dict),
+        )
+        mapping = np.fromiter(
+            map(dict.indices.get, chunk.words, itertools.repeat(dict.unk())),
+            dtype=np.int32,
+            count=len(chunk.words),
+        )
+        summary = BinarizeSummary(num_seq=chunk.num_seq, replaced=Counter())
+        for i in np.flatnonzero(mapping == dict.unk()).tolist():
+            if chunk.words[i] != dict.unk_word:
+                summary.replaced[chunk.words[i]] += int(chunk.counts[i])
+
+        index = indexed_dataset.MMapIndexedDataset.Index(
+            indexed_dataset.index_file_path(chunk.prefix), warmup=False
+        )
+        offsets = np.zeros(len(index) + 1, dtype=np.int64)
+        np.cumsum(index.sizes, out=offsets[1:])
+        del index
+        summary.num_tok = int(offsets[-1])
+        if summary.num_tok > 0:
+            interim = np.memmap(
+                indexed_dataset.data_file_path(chunk.prefix), dtype=np.int32, mode="r"
+            )
+            for start in range(0, chunk.num_seq, _LINES_PER_BATCH):
+                batch = offsets[start : start + _LINES_PER_BATCH + 1]
+                tokens = mapping[interim[batch[0] : batch[-1]]]
+                _add_items(ds, tokens, batch - batch[0])
+            del interim
+        _remove_dataset_files(chunk.prefix)
+        return ds, summary
+
+    @classmethod
+    def _remap_chunk_and_finalize(
+        cls,
+        chunk: InterimChunk,
+        dict: Dictionary,
+        output_prefix: str,
+        dataset_impl: str,
+    ) -> BinarizeSummary:
+        ds, summ = cls._remap_chunk(chunk, dict, output_prefix, dataset_impl)
+        ds.finalize(indexed_dataset.index_file_path(output_prefix))
+        return summ
+
 
 class AlignmentDatasetBinarizer(Binarizer):
     """
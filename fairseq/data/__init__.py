@@ -39,6 +39,7 @@ from .noising import NoisingDataset
 from .numel_dataset import NumelDataset
 from .num_samples_dataset import NumSamplesDataset
 from .offset_tokens_dataset import OffsetTokensDataset
+from .packed_sequence_dataset import PackedSegmentIdsDataset, PackedSequenceDataset
 from .padding_mask_dataset import (
     LeftPaddingMaskDataset,
     PaddingMaskDataset,
@@ -54,6 +55,7 @@ from .roll_dataset import RollDataset
 from .round_robin_zip_datasets import RoundRobinZipDatasets
 from .sort_dataset import SortDataset
 from .speech_dlm_dataset import SpeechDLMDataset
+from .streaming_dataset import StreamingFileCache, StreamingIndexedDataset
 from .strip_token_dataset import StripTokenDataset
 from .subsample_dataset import SubsampleDataset
 from .token_block_dataset import TokenBlockDataset
@@ -71,6 +73,7 @@ from .iterators import (
     GroupedIterator,
     ShardedIterator,
 )
+from .token_budgets import TokenBudgets
 
 __all__ = [
     "AddTargetDataset",
@@ -111,6 +114,8 @@ __all__ = [
     "NumelDataset",
     "NumSamplesDataset",
     "OffsetTokensDataset",
+    "PackedSegmentIdsDataset",
+    "PackedSequenceDataset",
     "PadDataset",
     "PrependDataset",
     "PrependTokenDataset",
@@ -126,9 +131,12 @@ __all__ = [
     "ShardedIterator",
     "SortDataset",
     "SpeechDLMDataset",
+    "StreamingFileCache",
+    "StreamingIndexedDataset",
     "StripTokenDataset",
     "SubsampleDataset",
     "TokenBlockDataset",
+    "TokenBudgets",
     "TransformEosDataset",
     "TransformEosLangPairDataset",
     "TransformEosConcatLangPairDataset",
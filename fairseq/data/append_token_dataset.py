@@ -34,6 +34,12 @@ class AppendTokenDataset(BaseWrapperDataset):
             n += 1
         return n
 
+    def num_tokens_vec(self, indices):
+        n = self.dataset.num_tokens_vec(indices)
+        if self.token is not None:
+            n = n + 1
+        return n
+
     def size(self, index):
         n = self.dataset.size(index)
         if self.token is not None:
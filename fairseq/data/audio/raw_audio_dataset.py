@@ -187,6 +187,12 @@ class RawAudioDataset(FairseqDataset):
     def num_tokens(self, index):
         return self.size(index)
 
+    def num_tokens_vec(self, indices):
+        sizes = np.asarray(self.sizes)[indices]
+        if self.pad:
+            return sizes
+        return np.minimum(sizes, self.max_sample_size)
+
     def size(self, index):
         """Return an example's size as a float or tuple. This value is used when
         filtering a dataset with ``--max-positions``."""
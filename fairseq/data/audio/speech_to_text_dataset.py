@@ -364,6 +364,9 @@ class SpeechToTextDataset(FairseqDataset):
     def num_tokens(self, index):
         return self.n_frames[index]
 
+    def num_tokens_vec(self, indices):
+        return np.asarray(self.n_frames)[indices]
+
     def size(self, index):
         return self.n_frames[index], self.tgt_lens[index]
 
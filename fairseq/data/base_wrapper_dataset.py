@@ -32,6 +32,9 @@ class BaseWrapperDataset(FairseqDataset):
     def num_tokens(self, index):
         return self.dataset.num_tokens(index)
 
+    def num_tokens_vec(self, indices):
+        return self.dataset.num_tokens_vec(indices)
+
     def size(self, index):
         return self.dataset.size(index)
 
@@ -74,5 +74,8 @@ class BucketPadLengthDataset(BaseWrapperDataset):
     def num_tokens(self, index):
         return self._bucketed_sizes[index]
 
+    def num_tokens_vec(self, indices):
+        return self._bucketed_sizes[indices]
+
     def size(self, index):
         return self._bucketed_sizes[index]
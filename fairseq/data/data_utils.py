@@ -12,7 +12,7 @@ import itertools
 import logging
 import re
 import warnings
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 
 import math
 import numpy as np
@@ -71,8 +71,23 @@ def collate_tokens(
     return res
 
 
+def get_many_items(dataset, indices):
+    """Return the items of *dataset* at *indices*, read at once with
+    :func:`MMapIndexedDataset.get_many` if *dataset* has it."""
+    if not hasattr(dataset, "get_many"):
+        return [dataset[i] for i in indices]
+    tokens, offsets = dataset.get_many(indices)
+    return list(torch.split(tokens, (offsets[1:] - offsets[:-1]).tolist()))
+
+
 def load_indexed_dataset(
-    path, dictionary=None, dataset_impl=None, combine=False, default="cached"
+    path,
+    dictionary=None,
+    dataset_impl=None,
+    combine=False,
+    default="cached",
+    native_dtype=False,
+    mmap_warmup="full",
 ):
     """A helper function for loading indexed datasets.
 
@@ -86,6 +101,12 @@ def load_indexed_dataset(
             datasets. For example, if *path* is 'data-bin/train', then we will
             combine 'data-bin/train', 'data-bin/train1', ... and return a
             single ConcatDataset instance.
+        native_dtype (bool, optional): keep items of 'mmap' datasets in their
+            stored dtype as zero-copy views instead of upcasting them to int64
+            (see :class:`~fairseq.data.indexed_dataset.MMapIndexedDataset`).
+        mmap_warmup (str, optional): how 'mmap' datasets are brought into the
+            page cache when opened (see
+            :class:`~fairseq.data.indexed_dataset.MMapIndexedDataset`).
     """
     import fairseq.data.indexed_dataset as indexed_dataset
     from fairseq.data.concat_dataset import ConcatDataset
@@ -109,6 +130,8 @@ def load_indexed_dataset(
             impl=dataset_impl_k or default,
             fix_lua_indexing=True,
             dictionary=dictionary,
+            native_dtype=native_dtype,
+            mmap_warmup=mmap_warmup,
         )
         if dataset is None:
             break
@@ -280,6 +303,9 @@ def filter_paired_dataset_indices_by_size(src_sizes, tgt_sizes, indices, max_siz
     return indices, ignored.tolist()
 
 
+_warned_no_data_utils_fast = False
+
+
 def batch_by_size(
     indices,
     num_tokens_fn,
@@ -315,11 +341,17 @@ def batch_by_size(
             batch_by_size_vec,
             batch_fixed_shapes_fast,
         )
+
+        has_fast = True
     except ImportError:
-        raise ImportError(
-            "Please build Cython components with: "
-            "`python setup.py build_ext --inplace`"
-        )
+        global _warned_no_data_utils_fast
+        if not _warned_no_data_utils_fast:
+            logger.warning(
+                "Cython components are not built, batching with the NumPy "
+                "implementation. Build them with `python setup.py build_ext --inplace`"
+            )
+            _warned_no_data_utils_fast = True
+        has_fast = False
     except ValueError:
         raise ValueError(
             "Please build (or rebuild) Cython components with `python setup.py build_ext --inplace`."
@@ -336,8 +368,21 @@ def batch_by_size(
     if num_tokens_vec is not None and not isinstance(num_tokens_vec, np.ndarray):
         num_tokens_vec = np.fromiter(num_tokens_vec, dtype=np.int64, count=-1)
 
+    if num_tokens_vec is None and not has_fast:
+        num_tokens_vec = np.fromiter(
+            map(num_tokens_fn, indices), dtype=np.int64, count=len(indices)
+        )
+
     if fixed_shapes is None:
-        if num_tokens_vec is None:
+        if not has_fast:
+            b = batch_by_size_vec_numpy(
+                indices,
+                num_tokens_vec,
+                max_tokens,
+                max_sentences,
+                bsz_mult,
+            )
+        elif num_tokens_vec is None:
             b = batch_by_size_fn(
                 indices,
                 num_tokens_fn,
@@ -368,9 +413,150 @@ def batch_by_size(
             ]
         )
         fixed_shapes_sorted = fixed_shapes[sort_order]
+        if not has_fast:
+            return batch_fixed_shapes_numpy(
+                indices, num_tokens_vec, fixed_shapes_sorted
+            )
         return batch_fixed_shapes_fast(indices, num_tokens_fn, fixed_shapes_sorted)
 
 
+def _max_batch_lengths(caps, chunk_size=4194304):
+    """
+    For every start position ``s``, return the largest ``n`` such that
+    ``caps[s:s+n]`` are all at least ``n``, i.e. the longest batch starting at
+    ``s`` when the sample at position ``i`` allows batches of at most
+    ``caps[i]`` samples.
+
+    ``n`` is the minimum of two terms: the distance to the first position that
+    cannot fit the samples before it, found with a running max, and the
+    smallest cap up to that position, found with a sparse table that is built
+    one level at a time.
+    """
+    n = len(caps)
+    dtype = np.int32 if 2 * n < np.iinfo(np.int32).max else np.int64
+    lengths = np.empty(n, dtype=dtype)
+    if n == 0:
+        return lengths
+    caps = np.clip(caps, 0, n).astype(dtype, copy=False)
+    max_cap = int(caps.max())
+    for start in range(0, n, chunk_size):
+        stop = min(n, start + chunk_size)
+        # a batch starting before stop cannot reach beyond stop + max_cap
+        window = caps[start : min(n, stop + max_cap + 1)]
+        pos = np.arange(len(window), dtype=dtype)
+        first_bad = np.maximum.accumulate(pos - window)
+        np.clip(first_bad, -1, len(window) - 1, out=first_bad)
+        # first position whose running max exceeds s, as a counting sort
+        counts = np.bincount(first_bad + 1, minlength=len(window) + 1)
+        end = np.cumsum(counts[1 : stop - start + 1], dtype=dtype)
+        end += counts[0]
+        pos = pos[: stop - start]
+        span = end - pos
+
+        # min(window[pos:end]) from two overlapping power of two ranges
+        level = (np.frexp(span)[1] - 1).astype(np.int8)
+        order = np.argsort(level, kind="stable")
+        level_bounds = np.searchsorted(level[order], np.arange(level.max() + 2))
+        span_min = np.empty(len(pos), dtype=dtype)
+        level_min = window
+        for k in range(len(level_bounds) - 1):
+            sel = order[level_bounds[k] : level_bounds[k + 1]]
+            if len(sel) > 0:
+                span_min[sel] = np.minimum(
+                    level_min[sel], level_min[end[sel] - (1 << k)]
+                )
+            if len(level_min) > (1 << k):
+                level_min = np.minimum(level_min[: -(1 << k)], level_min[(1 << k) :])
+        np.minimum(span_min, span, out=lengths[start:stop])
+    return lengths
+
+
+def batch_by_size_vec_numpy(
+    indices, num_tokens_vec, max_tokens, max_sentences, bsz_mult
+):
+    """
+    NumPy implementation of :func:`fairseq.data.data_utils_fast.batch_by_size_vec`,
+    returning the same batches. Used when the Cython components are not built.
+
+    *max_tokens* may also be an array with the budget of each index, in which
+    case a batch is bounded by the smallest budget of its indices.
+    """
+    n = len(indices)
+    if n == 0:
+        return []
+    num_tokens_vec = np.asarray(num_tokens_vec, dtype=np.int64)
+    assert np.all(
+        (max_tokens <= 0) | (num_tokens_vec <= max_tokens)
+    ), f"Sentences lengths should not exceed max_tokens={max_tokens}"
+
+    # the largest batch each sample can be part of
+    caps = np.full(n, n, dtype=np.int64)
+    np.floor_divide(
+        max_tokens,
+        num_tokens_vec,
+        out=caps,
+        where=(num_tokens_vec > 0) & (max_tokens > 0),
+    )
+    if max_sentences > 0:
+        np.minimum(caps, max_sentences, out=caps)
+
+    batch_ends = _max_batch_lengths(caps)
+    if bsz_mult > 1:
+        batch_ends = np.where(
+            batch_ends > bsz_mult, batch_ends - batch_ends % bsz_mult, batch_ends
+        )
+    batch_ends += np.arange(n, dtype=batch_ends.dtype)
+
+    batches = []
+    batch_end = batch_ends.item
+    pos = 0
+    while pos < n:
+        end = batch_end(pos)
+        batches.append(indices[pos:end])
+        pos = end
+    return batches
+
+
+def batch_fixed_shapes_numpy(indices, num_tokens_vec, fixed_shapes_sorted):
+    """
+    NumPy implementation of
+    :func:`fairseq.data.data_utils_fast.batch_fixed_shapes_fast`, returning the
+    same batches. Used when the Cython components are not built.
+    """
+    n = len(indices)
+    if n == 0:
+        return []
+    num_tokens_vec = np.asarray(num_tokens_vec, dtype=np.int64)
+
+    # the largest batch size of any shape that fits each sample
+    shapes = fixed_shapes_sorted[np.argsort(fixed_shapes_sorted[:, 1], kind="stable")]
+    max_bsz = np.maximum.accumulate(shapes[::-1, 0])[::-1]
+    shape_idx = np.searchsorted(shapes[:, 1], num_tokens_vec)
+    caps = np.where(
+        shape_idx < len(shapes), max_bsz[np.minimum(shape_idx, len(shapes) - 1)], 0
+    )
+
+    # the first batch is limited by all of its samples
+    head = np.minimum.accumulate(caps[: min(n, max(int(caps.max()), 0) + 1)])
+    first_len = int(np.sum(head >= np.arange(1, len(head) + 1)))
+
+    # like the Cython version, later batches ignore the length of the sample
+    # that started them
+    batch_ends = np.empty(n, dtype=np.int64)
+    batch_ends[:-1] = _max_batch_lengths(np.maximum(caps[1:] - 1, 0))
+    batch_ends[-1] = 0
+    batch_ends += np.arange(1, n + 1)
+
+    batches = [indices[:first_len].tolist()]
+    batch_end = batch_ends.item
+    pos = first_len
+    while pos < n:
+        end = batch_end(pos)
+        batches.append(indices[pos:end].tolist())
+        pos = end
+    return batches
+
+
 def post_process(sentence: str, symbol: str):
     if symbol == "sentencepiece":
         sentence = sentence.replace(" ", "").replace("\u2581", " ").strip()
@@ -396,6 +582,40 @@ def post_process(sentence: str, symbol: str):
     return sentence
 
 
+# the replacements of post_process() that can run on several lines at once
+_POST_PROCESS_REPLACEMENTS = {
+    "sentencepiece": [(" ", ""), ("\u2581", " ")],
+    "wordpiece": [(" ", ""), ("_", " ")],
+    "letter": [(" ", ""), ("|", " ")],
+    "_EOW": [(" ", ""), ("_EOW", " ")],
+}
+
+
+def post_process_batch(sentences: List[str], symbol: str) -> List[str]:
+    """Apply :func:`post_process` to a batch of single-line sentences,
+    replacing symbols in a single pass over their concatenation."""
+    if symbol is None or symbol == "none" or len(sentences) == 0:
+        return list(sentences)
+    if symbol not in _POST_PROCESS_REPLACEMENTS and symbol not in {
+        "subword_nmt",
+        "@@ ",
+        "@@",
+    }:
+        return [post_process(sentence, symbol) for sentence in sentences]
+    if any("\n" in sentence for sentence in sentences):
+        return [post_process(sentence, symbol) for sentence in sentences]
+
+    if symbol in _POST_PROCESS_REPLACEMENTS:
+        text = "\n".join(sentences)
+        for old, new in _POST_PROCESS_REPLACEMENTS[symbol]:
+            text = text.replace(old, new)
+        return [sentence.strip() for sentence in text.split("\n")]
+    if symbol == "subword_nmt":
+        symbol = "@@ "
+    text = "\n".join(sentence + " " for sentence in sentences).replace(symbol, "")
+    return [sentence.rstrip() for sentence in text.split("\n")]
+
+
 def compute_mask_indices(
     shape: Tuple[int, int],
     padding_mask: Optional[torch.Tensor],
@@ -894,6 +1114,142 @@ def get_bucketed_sizes(orig_sizes, buckets):
     return sizes
 
 
+def get_padding_optimal_buckets(sizes, num_buckets, max_candidates=2048):
+    """
+    Return the upper bounds of at most *num_buckets* buckets over *sizes* that
+    minimize the padding needed to bring every size up to its bucket's upper
+    bound. Unlike :func:`get_buckets`, which uses percentiles, the bounds are
+    found with dynamic programming over the distinct sizes (merged into at
+    most *max_candidates* groups for datasets with many distinct sizes).
+    """
+    values, counts = np.unique(np.asarray(sizes, dtype=np.int64), return_counts=True)
+    if len(values) <= num_buckets:
+        return values
+    totals = values * counts
+    if len(values) > max_candidates:
+        starts = np.unique(
+            np.arange(len(values)) * max_candidates // len(values), return_index=True
+        )[1]
+        values = values[np.append(starts[1:] - 1, len(values) - 1)]
+        counts = np.add.reduceat(counts, starts)
+        totals = np.add.reduceat(totals, starts)
+    num_candidates = len(values)
+    cum_counts = np.concatenate([[0], np.cumsum(counts)])
+    cum_totals = np.concatenate([[0], np.cumsum(totals)])
+
+    # cost[i, j]: padding of a bucket holding candidates i..j
+    first, last = np.triu_indices(num_candidates)
+    cost = np.full((num_candidates, num_candidates), np.iinfo(np.int64).max // 4)
+    cost[first, last] = values[last] * (cum_counts[last + 1] - cum_counts[first]) - (
+        cum_totals[last + 1] - cum_totals[first]
+    )
+
+    # best[j]: least padding of candidates 0..j with the buckets used so far
+    best = cost[0]
+    splits = []
+    for _ in range(num_buckets - 1):
+        total = best[:-1, None] + cost[1:]
+        split = np.argmin(total, axis=0)
+        best = np.minimum(cost[0], total[split, np.arange(num_candidates)])
+        splits.append(np.where(cost[0] <= best, -1, split))
+
+    bounds = [num_candidates - 1]
+    for split in reversed(splits):
+        prev = split[bounds[-1]]
+        if prev < 0:
+            break
+        bounds.append(prev)
+    return values[bounds[::-1]]
+
+
+def batch_by_size_min_padding(
+    indices,
+    num_tokens_vec,
+    max_tokens=None,
+    max_sentences=None,
+    required_batch_size_multiple=1,
+    sizes=None,
+    num_buckets=8,
+):
+    """
+    Yield mini-batches of indices like :func:`batch_by_size`, but arranged to
+    waste fewer tokens on padding.
+
+    Samples are assigned to one of *num_buckets* buckets along each column of
+    *sizes* (e.g. source and target lengths), using the padding-optimal bounds
+    of :func:`get_padding_optimal_buckets`. Samples sharing all buckets are
+    sorted by length and batched greedily, so that no batch mixes buckets.
+
+    Args:
+        indices (List[int]): ordered list of dataset indices
+        num_tokens_vec (List[int]): number of tokens for each index in indices
+        max_tokens (int, optional): max number of tokens in each batch
+            (default: None).
+        max_sentences (int, optional): max number of sentences in each
+            batch (default: None).
+        required_batch_size_multiple (int, optional): require batch size to
+            be less than N or a multiple of N (default: 1).
+        sizes (np.ndarray, optional): per-index sizes that are padded
+            separately, with shape ``(len(indices),)`` or
+            ``(len(indices), num_columns)`` (default: *num_tokens_vec*).
+        num_buckets (int, optional): number of buckets per column
+            (default: 8).
+    """
+    try:
+        from fairseq.data.data_utils_fast import batch_by_size_vec
+    except ImportError:
+        batch_by_size_vec = batch_by_size_vec_numpy
+
+    max_tokens = int(max_tokens) if max_tokens is not None else -1
+    max_sentences = max_sentences if max_sentences is not None else -1
+    indices = np.asarray(indices, dtype=np.int64)
+    num_tokens_vec = np.asarray(num_tokens_vec, dtype=np.int64)
+    if len(indices) == 0:
+        return []
+    sizes = num_tokens_vec if sizes is None else np.asarray(sizes)
+    sizes = sizes.reshape(len(indices), -1)
+
+    bucket_ids = [
+        np.searchsorted(get_padding_optimal_buckets(column, num_buckets), column)
+        for column in sizes.T
+    ]
+    group = np.ravel_multi_index(bucket_ids, [num_buckets] * len(bucket_ids))
+    order = np.lexsort(list(sizes.T[::-1]) + [num_tokens_vec, group])
+    indices, num_tokens_vec, group = indices[order], num_tokens_vec[order], group[order]
+
+    batches = []
+    bounds = np.concatenate([[0], np.flatnonzero(np.diff(group)) + 1, [len(group)]])
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        batches.extend(
+            batch_by_size_vec(
+                indices[start:end],
+                num_tokens_vec[start:end],
+                max_tokens,
+                max_sentences,
+                required_batch_size_multiple,
+            )
+        )
+    return batches
+
+
+def padding_efficiency(batches, sizes):
+    """
+    Return the ratio of real tokens to padded tokens of *batches*, for each
+    column of *sizes* (indexed by dataset index), when every sample is padded
+    to the longest sample of its batch.
+    """
+    batches = [batch for batch in batches if len(batch) > 0]
+    if len(batches) == 0:
+        return np.ones(1)
+    flat = np.concatenate(batches).astype(np.int64)
+    batch_sizes = np.array([len(batch) for batch in batches])
+    sizes = np.asarray(sizes)
+    sizes = sizes.reshape(len(sizes), -1)[flat]
+    starts = np.concatenate([[0], np.cumsum(batch_sizes)[:-1]])
+    padded = (np.maximum.reduceat(sizes, starts, axis=0) * batch_sizes[:, None]).sum(0)
+    return sizes.sum(0) / np.maximum(padded, 1)
+
+
 def _find_extra_valid_paths(dataset_path: str) -> set:
     paths = utils.split_paths(dataset_path)
     all_valid_paths = set()
@@ -415,6 +415,11 @@ class DenoisingDataset(FairseqDataset):
         enforce ``--max-tokens`` during batching."""
         return self.sizes[index]
 
+    def num_tokens_vec(self, indices):
+        """Return the number of tokens for a set of positions defined by indices.
+        This value is used to enforce ``--max-tokens`` during batching."""
+        return self.sizes[indices]
+
     def size(self, index):
         """Return an example's size as a float or tuple. This value is used when
         filtering a dataset with ``--max-positions``."""
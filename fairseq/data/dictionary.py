@@ -3,10 +3,12 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import itertools
 import os
 from collections import Counter
 from multiprocessing import Pool
 
+import numpy as np
 import torch
 from fairseq import utils
 from fairseq.data import data_utils
@@ -14,10 +16,16 @@ from fairseq.file_chunker_utils import Chunker, find_offsets
 from fairseq.file_io import PathManager
 from fairseq.tokenizer import tokenize_line
 
+# number of lines counted between memory checks when building a dictionary
+_LINES_PER_BATCH = 10000
+
 
 class Dictionary:
     """A mapping from symbols to consecutive integers"""
 
+    # set by freeze()
+    frozen = False
+
     def __init__(
         self,
         *,  # begin keyword-only arguments
@@ -83,39 +91,90 @@ class Dictionary:
         """
         if torch.is_tensor(tensor) and tensor.dim() == 2:
             return "\n".join(
-                self.string(
-                    t,
+                self.strings(
+                    tensor,
                     bpe_symbol,
                     escape_unk,
                     extra_symbols_to_ignore,
                     include_eos=include_eos,
                 )
-                for t in tensor
             )
+        return self.strings(
+            [tensor],
+            bpe_symbol,
+            escape_unk,
+            extra_symbols_to_ignore,
+            unk_string=unk_string,
+            include_eos=include_eos,
+            separator=separator,
+        )[0]
+
+    def strings(
+        self,
+        tensors,
+        bpe_symbol=None,
+        escape_unk=False,
+        extra_symbols_to_ignore=None,
+        unk_string=None,
+        include_eos=False,
+        separator=" ",
+    ):
+        """Convert a batch of token indices to strings, like :func:`string`.
+
+        Args:
+            tensors: a 2-D tensor with a sentence per row, or a list of 1-D
+                tensors (or lists) of token indices
+        """
+        if torch.is_tensor(tensors):
+            assert tensors.dim() == 2
+            tokens = tensors.cpu().numpy()
+            offsets = np.arange(tokens.shape[0] + 1) * tokens.shape[1]
+            tokens = tokens.reshape(-1)
+        else:
+            rows = [torch.as_tensor(t).view(-1) for t in tensors]
+            offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+            np.cumsum([len(t) for t in rows], out=offsets[1:])
+            tokens = torch.cat(rows).cpu().numpy() if rows else np.zeros(0)
+        tokens = tokens.astype(np.int64, copy=False)
 
         extra_symbols_to_ignore = set(extra_symbols_to_ignore or [])
         if not include_eos:
             extra_symbols_to_ignore.add(self.eos())
-
-        def token_string(i):
-            if i == self.unk():
-                if unk_string is not None:
-                    return unk_string
-                else:
-                    return self.unk_string(escape_unk)
-            else:
-                return self[i]
-
         if hasattr(self, "bos_index"):
             extra_symbols_to_ignore.add(self.bos())
-
-        sent = separator.join(
-            token_string(i)
-            for i in tensor
-            if utils.item(i) not in extra_symbols_to_ignore
+        keep = ~np.isin(tokens, list(extra_symbols_to_ignore))
+        tokens = tokens[keep]
+        kept_offsets = np.zeros(len(keep) + 1, dtype=np.int64)
+        np.cumsum(keep, out=kept_offsets[1:])
+        offsets = kept_offsets[offsets]
+
+        # indices beyond the dictionary are unknown words, like __getitem__
+        words = self._symbol_array()[np.minimum(tokens, len(self.symbols))]
+        words[tokens == self.unk()] = (
+            unk_string if unk_string is not None else self.unk_string(escape_unk)
+        )
+        words = words.tolist()
+        return data_utils.post_process_batch(
+            [
+                separator.join(words[start:end])
+                for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())
+            ],
+            bpe_symbol,
         )
 
-        return data_utils.post_process(sent, bpe_symbol)
+    def _symbol_array(self):
+        """The symbols as an array of objects, followed by the unknown word."""
+        cached = getattr(self, "_symbol_array_cache", None)
+        if (
+            cached is None
+            or cached[0] is not self.symbols
+            or len(cached[1]) != len(self.symbols) + 1
+        ):
+            array = np.empty(len(self.symbols) + 1, dtype=object)
+            array[:-1] = self.symbols
+            array[-1] = self.unk_word
+            cached = self._symbol_array_cache = (self.symbols, array)
+        return cached[1]
 
     def unk_string(self, escape=False):
         """Return unknown string, optionally escaped as: <<unk>>"""
@@ -124,8 +183,17 @@ class Dictionary:
         else:
             return self.unk_word
 
+    def freeze(self):
+        """Make the dictionary read-only: adding symbols raises an error, as
+        does encoding with ``add_if_not_exist=True``. A frozen dictionary can be
+        shared by the workers encoding a corpus."""
+        self.frozen = True
+        return self
+
     def add_symbol(self, word, n=1, overwrite=False):
         """Adds a word to the dictionary"""
+        if self.frozen:
+            raise RuntimeError(f"cannot add {word!r} to a frozen dictionary")
         if word in self.indices and not overwrite:
             idx = self.indices[word]
             self.count[idx] = self.count[idx] + n
@@ -139,6 +207,8 @@ class Dictionary:
 
     def update(self, new_dict):
         """Updates counts from new dictionary."""
+        if self.frozen:
+            raise RuntimeError("cannot update a frozen dictionary")
         for word in new_dict.symbols:
             idx2 = new_dict.indices[word]
             if word in self.indices:
@@ -303,6 +373,18 @@ class Dictionary:
         t[-1] = self.eos()
         return t
 
+    def _encode_words(self, words, add_if_not_exist):
+        if add_if_not_exist:
+            if self.frozen:
+                raise RuntimeError(
+                    "cannot add words to a frozen dictionary, "
+                    "encode with add_if_not_exist=False"
+                )
+            ids = map(self.add_symbol, words)
+        else:
+            ids = map(self.indices.get, words, itertools.repeat(self.unk_index))
+        return np.fromiter(ids, dtype=np.int32, count=len(words))
+
     def encode_line(
         self,
         line,
@@ -317,19 +399,62 @@ class Dictionary:
             words = list(reversed(words))
         nwords = len(words)
         ids = torch.IntTensor(nwords + 1 if append_eos else nwords)
-
-        for i, word in enumerate(words):
-            if add_if_not_exist:
-                idx = self.add_symbol(word)
-            else:
-                idx = self.index(word)
-            if consumer is not None:
+        ids.numpy()[:nwords] = self._encode_words(words, add_if_not_exist)
+        if consumer is not None:
+            for word, idx in zip(words, ids.tolist()):
                 consumer(word, idx)
-            ids[i] = idx
         if append_eos:
             ids[nwords] = self.eos_index
         return ids
 
+    def encode_lines(
+        self,
+        lines,
+        line_tokenizer=tokenize_line,
+        add_if_not_exist=True,
+        append_eos=True,
+        reverse_order=False,
+        replaced=None,
+    ):
+        """Encode a batch of lines at once, like :func:`encode_line`.
+
+        Args:
+            lines (List[str]): lines to encode
+            replaced (Counter, optional): counts the words that are replaced
+                by ``<unk>``
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: the int32 ids of all lines,
+            concatenated, and the ``len(lines) + 1`` offsets of each line into
+            them, e.g. for
+            :func:`~fairseq.data.indexed_dataset.MMapIndexedDatasetBuilder.add_items`.
+        """
+        if line_tokenizer is tokenize_line:
+            # str.split() already splits on runs of whitespace and strips
+            words = [line.split() for line in lines]
+        else:
+            words = [line_tokenizer(line) for line in lines]
+        if reverse_order:
+            words = [w[::-1] for w in words]
+        lengths = np.fromiter(map(len, words), dtype=np.int64, count=len(words))
+        flat_words = list(itertools.chain.from_iterable(words))
+        ids = self._encode_words(flat_words, add_if_not_exist)
+        if replaced is not None:
+            for i in np.flatnonzero(ids == self.unk_index).tolist():
+                if flat_words[i] != self.unk_word:
+                    replaced[flat_words[i]] += 1
+
+        offsets = np.zeros(len(lines) + 1, dtype=np.int64)
+        if not append_eos:
+            np.cumsum(lengths, out=offsets[1:])
+            return ids, offsets
+        np.cumsum(lengths + 1, out=offsets[1:])
+        tokens = np.full(offsets[-1], self.eos_index, dtype=np.int32)
+        is_word = np.ones(offsets[-1], dtype=bool)
+        is_word[offsets[1:] - 1] = False
+        tokens[is_word] = ids
+        return tokens, offsets
+
     @staticmethod
     def _add_file_to_dictionary_single_worker(
         filename,
@@ -337,50 +462,75 @@ class Dictionary:
         eos_word,
         start_offset,
         end_offset,
+        max_symbols=None,
     ):
+        if tokenize is tokenize_line:
+            tokenize = str.split
         counter = Counter()
         with Chunker(filename, start_offset, end_offset) as line_iterator:
-            for line in line_iterator:
-                for word in tokenize(line):
-                    counter.update([word])
-                counter.update([eos_word])
+            lines_itr = iter(line_iterator)
+            while True:
+                lines = list(itertools.islice(lines_itr, _LINES_PER_BATCH))
+                if not lines:
+                    break
+                counter.update(itertools.chain.from_iterable(map(tokenize, lines)))
+                counter[eos_word] += len(lines)
+                Dictionary._prune_counter(counter, max_symbols)
         return counter
 
     @staticmethod
-    def add_file_to_dictionary(filename, dict, tokenize, num_workers):
-        def merge_result(counter):
-            for w, c in sorted(counter.items()):
-                dict.add_symbol(w, c)
+    def _prune_counter(counter, max_symbols):
+        """Keep the *max_symbols* // 2 most frequent words once *counter*
+        grows past *max_symbols* entries. Pruned words lose the counts seen
+        so far, so the counts of rare words become lower bounds."""
+        if max_symbols is None or len(counter) <= max_symbols:
+            return counter
+        keep = counter.most_common(max(max_symbols // 2, 1))
+        counter.clear()
+        counter.update(dict(keep))
+        return counter
 
+    @staticmethod
+    def _merge_counters(counters, max_symbols=None):
+        merged = counters[0]
+        for counter in counters[1:]:
+            merged.update(counter)
+            Dictionary._prune_counter(merged, max_symbols)
+        return merged
+
+    @staticmethod
+    def add_file_to_dictionary(filename, dict, tokenize, num_workers, max_symbols=None):
+        """Count the words of *filename* and add them to *dict*.
+
+        Each worker counts a chunk of the file, and the parent sums the
+        per-chunk counters, in chunk order, as they come back, before a single
+        pass of :func:`add_symbol`. Each counter is thus sent once. If
+        *max_symbols* is set, counters larger than that are pruned to their
+        most frequent words, which bounds memory on huge vocabularies and the
+        size of the counters sent by the workers, at the cost of undercounting
+        rare words.
+        """
         local_file = PathManager.get_local_path(filename)
         offsets = find_offsets(local_file, num_workers)
-        if num_workers > 1:
-            chunks = zip(offsets, offsets[1:])
-            pool = Pool(processes=num_workers)
-            results = []
-            for (start_offset, end_offset) in chunks:
-                results.append(
+        chunks = list(zip(offsets, offsets[1:]))
+        if len(chunks) > 1:
+            with Pool(processes=num_workers) as pool:
+                results = [
                     pool.apply_async(
                         Dictionary._add_file_to_dictionary_single_worker,
-                        (
-                            local_file,
-                            tokenize,
-                            dict.eos_word,
-                            start_offset,
-                            end_offset,
-                        ),
+                        (local_file, tokenize, dict.eos_word, start, end, max_symbols),
                     )
-                )
-            pool.close()
-            pool.join()
-            for r in results:
-                merge_result(r.get())
+                    for start, end in chunks
+                ]
+                counter = Counter()
+                for result in results:
+                    Dictionary._merge_counters([counter, result.get()], max_symbols)
         else:
-            merge_result(
-                Dictionary._add_file_to_dictionary_single_worker(
-                    local_file, tokenize, dict.eos_word, offsets[0], offsets[1]
-                )
+            counter = Dictionary._add_file_to_dictionary_single_worker(
+                local_file, tokenize, dict.eos_word, *chunks[0], max_symbols
             )
+        for w, c in sorted(counter.items()):
+            dict.add_symbol(w, c)
 
 
 class TruncatedDictionary(object):
@@ -4,6 +4,8 @@
 # LICENSE file in the root directory of this source tree.
 
 from dataclasses import dataclass, field
+from multiprocessing import Pool
+from typing import List
 
 from fairseq import file_utils
 from fairseq.data.encoders import register_bpe
@@ -36,6 +38,16 @@ class GPT2BPE(object):
     def encode(self, x: str) -> str:
         return " ".join(map(str, self.bpe.encode(x)))
 
+    def encode_batch(self, xs: List[str], num_workers: int = 1) -> List[str]:
+        """Encode several strings, in a pool of *num_workers* processes if
+        greater than 1 (the encoder is CPU-bound, so threads would not help)."""
+        if num_workers <= 1:
+            return [self.encode(x) for x in xs]
+        with Pool(num_workers, initializer=_init_worker, initargs=(self.bpe,)) as pool:
+            return pool.map(
+                _encode_in_worker, xs, chunksize=max(len(xs) // (4 * num_workers), 1)
+            )
+
     def decode(self, x: str) -> str:
         return self.bpe.decode(
             [int(tok) if tok not in {"<unk>", "<mask>"} else tok for tok in x.split()]
@@ -43,3 +55,16 @@ class GPT2BPE(object):
 
     def is_beginning_of_word(self, x: str) -> bool:
         return self.decode(x).startswith(" ")
+
+
+# the encoder of an encode_batch() worker, set once per process
+_worker_bpe = None
+
+
+def _init_worker(bpe):
+    global _worker_bpe
+    _worker_bpe = bpe
+
+
+def _encode_in_worker(x: str) -> str:
+    return " ".join(map(str, _worker_bpe.encode(x)))
@@ -5,6 +5,7 @@ Original source: https://github.com/openai/gpt-2/blob/master/src/encoder.py
 Original license: MIT
 """
 
+import heapq
 import json
 from functools import lru_cache
 
@@ -49,14 +50,20 @@ def get_pairs(word):
 
 
 class Encoder:
-    def __init__(self, encoder, bpe_merges, errors="replace"):
+    def __init__(self, encoder, bpe_merges, errors="replace", cache_size=2**16):
         self.encoder = encoder
         self.decoder = {v: k for k, v in self.encoder.items()}
         self.errors = errors  # how to handle errors in decoding
         self.byte_encoder = bytes_to_unicode()
         self.byte_decoder = {v: k for k, v in self.byte_encoder.items()}
+        # maps the latin-1 decoding of utf-8 bytes to their unicode strings
+        self.byte_table = str.maketrans(
+            {chr(b): c for b, c in self.byte_encoder.items()}
+        )
         self.bpe_ranks = dict(zip(bpe_merges, range(len(bpe_merges))))
-        self.cache = {}
+        # the ids of the most recently used words are memoized, see cache_info()
+        self.cache_size = cache_size
+        self._encode_word = lru_cache(maxsize=cache_size)(self._encode_word_uncached)
 
         try:
             import regex as re
@@ -70,54 +77,67 @@ class Encoder:
             r"""'s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+"""
         )
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # the regex module is imported again and the cache is rebuilt, empty,
+        # when unpickled
+        del state["re"]
+        del state["_encode_word"]
+        return state
+
+    def __setstate__(self, state):
+        import regex
+
+        self.__dict__.update(state)
+        self.re = regex
+        self._encode_word = lru_cache(maxsize=self.cache_size)(
+            self._encode_word_uncached
+        )
+
+    def cache_info(self):
+        """Hits, misses and size of the word cache of :func:`encode`."""
+        return self._encode_word.cache_info()
+
     def bpe(self, token):
-        if token in self.cache:
-            return self.cache[token]
-        word = tuple(token)
-        pairs = get_pairs(word)
-
-        if not pairs:
-            return token
-
-        while True:
-            bigram = min(pairs, key=lambda pair: self.bpe_ranks.get(pair, float("inf")))
-            if bigram not in self.bpe_ranks:
-                break
-            first, second = bigram
-            new_word = []
-            i = 0
-            while i < len(word):
-                try:
-                    j = word.index(first, i)
-                    new_word.extend(word[i:j])
-                    i = j
-                except:
-                    new_word.extend(word[i:])
-                    break
-
-                if word[i] == first and i < len(word) - 1 and word[i + 1] == second:
-                    new_word.append(first + second)
-                    i += 2
-                else:
-                    new_word.append(word[i])
-                    i += 1
-            new_word = tuple(new_word)
-            word = new_word
-            if len(word) == 1:
-                break
-            else:
-                pairs = get_pairs(word)
-        word = " ".join(word)
-        self.cache[token] = word
-        return word
+        # symbols form a linked list, the live pairs are kept in a heap by
+        # (rank, position), so each merge costs O(log n) instead of a rescan
+        word = list(token)
+        n = len(word)
+        next_pos = list(range(1, n + 1))
+        prev_pos = list(range(-1, n - 1))
+        get_rank = self.bpe_ranks.get
+        heap = []
+        for i in range(n - 1):
+            rank = get_rank((word[i], word[i + 1]))
+            if rank is not None:
+                heap.append((rank, i, word[i], word[i + 1]))
+        heapq.heapify(heap)
+        while heap:
+            _, i, first, second = heapq.heappop(heap)
+            j = next_pos[i]
+            # skip the pairs that earlier merges changed
+            if word[i] != first or j >= n or word[j] != second:
+                continue
+            word[i] = first + second
+            word[j] = None
+            next_pos[i] = next_pos[j]
+            if next_pos[i] < n:
+                prev_pos[next_pos[i]] = i
+            for a, b in ((prev_pos[i], i), (i, next_pos[i])):
+                if a >= 0 and b < n:
+                    rank = get_rank((word[a], word[b]))
+                    if rank is not None:
+                        heapq.heappush(heap, (rank, a, word[a], word[b]))
+        return " ".join(w for w in word if w is not None)
+
+    def _encode_word_uncached(self, token):
+        token = token.encode("utf-8").decode("latin-1").translate(self.byte_table)
+        return tuple(map(self.encoder.__getitem__, self.bpe(token).split(" ")))
 
     def encode(self, text):
         bpe_tokens = []
         for token in self.re.findall(self.pat, text):
-            token = "".join(self.byte_encoder[b] for b in token.encode("utf-8"))
-            bpe_tokens.extend(
-                self.encoder[bpe_token] for bpe_token in self.bpe(token).split(" ")
-            )
+            bpe_tokens.extend(self._encode_word(token))
         return bpe_tokens
 
     def decode(self, tokens):
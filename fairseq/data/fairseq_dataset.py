@@ -152,6 +152,63 @@ class FairseqDataset(torch.utils.data.Dataset, EpochListening):
             fixed_shapes=fixed_shapes,
         )
 
+    def batch_by_size_min_padding(
+        self,
+        indices,
+        max_tokens=None,
+        max_sentences=None,
+        required_batch_size_multiple=1,
+        num_buckets=8,
+    ):
+        """
+        Like :func:`batch_by_size`, but group and order *indices* so that
+        batches need less padding, see
+        :func:`fairseq.data.data_utils.batch_by_size_min_padding`. Datasets
+        with their own batching or with fixed batch shapes keep using
+        :func:`batch_by_size`.
+        """
+        from fairseq.data import data_utils
+
+        if (
+            type(self).batch_by_size is not FairseqDataset.batch_by_size
+            or self.get_batch_shapes() is not None
+        ):
+            logger.warning(
+                f"{type(self).__name__} does not support padding-aware batching, "
+                "using the default batching"
+            )
+            return self.batch_by_size(
+                indices,
+                max_tokens=max_tokens,
+                max_sentences=max_sentences,
+                required_batch_size_multiple=required_batch_size_multiple,
+            )
+
+        try:
+            num_tokens_vec = self.num_tokens_vec(indices).astype("int64")
+        except NotImplementedError:
+            num_tokens_vec = np.fromiter(
+                map(self.num_tokens, indices), dtype=np.int64, count=len(indices)
+            )
+        try:
+            sizes = self.sizes
+        except (AttributeError, NotImplementedError):
+            sizes = None
+        if isinstance(sizes, (list, tuple)):
+            sizes = np.stack(sizes, axis=1)
+        if sizes is not None:
+            sizes = np.asarray(sizes)[indices]
+
+        return data_utils.batch_by_size_min_padding(
+            indices,
+            num_tokens_vec,
+            max_tokens=max_tokens,
+            max_sentences=max_sentences,
+            required_batch_size_multiple=required_batch_size_multiple,
+            sizes=sizes,
+            num_buckets=num_buckets,
+        )
+
     def filter_indices_by_size(self, indices, max_sizes):
         """
         Filter a list of sample indices. Remove those that are longer than
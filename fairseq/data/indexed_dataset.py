@@ -3,13 +3,20 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import logging
+import mmap
+import os
 import shutil
 import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
 
 import numpy as np
 import torch
-from fairseq.dataclass.constants import DATASET_IMPL_CHOICES
+from fairseq.dataclass.constants import DATASET_IMPL_CHOICES, MMAP_WARMUP_CHOICES
 from fairseq.data.fasta_dataset import FastaDataset
 from fairseq.file_io import PathManager
 from fairseq.data.huffman import HuffmanMMapIndexedDataset, HuffmanMMapIndex
@@ -18,6 +25,8 @@ from . import FairseqDataset
 
 from typing import Union
 
+logger = logging.getLogger(__name__)
+
 
 def best_fitting_int_dtype(
     max_int_to_represent,
@@ -51,6 +60,8 @@ def infer_dataset_impl(path):
                 return "mmap"
             elif magic == HuffmanMMapIndex._HDR_MAGIC[:8]:
                 return "huffman"
+            elif magic == CompressedIndexedDataset.Index._HDR_MAGIC[:8]:
+                return "compressed"
             else:
                 return None
     elif FastaDataset.exists(path):
@@ -64,6 +75,10 @@ def make_builder(out_file, impl, vocab_size=None):
         return MMapIndexedDatasetBuilder(
             out_file, dtype=best_fitting_int_dtype(vocab_size)
         )
+    elif impl == "compressed":
+        return CompressedIndexedDatasetBuilder(
+            out_file, dtype=best_fitting_int_dtype(vocab_size)
+        )
     elif impl == "fasta":
         raise NotImplementedError
     elif impl == "huffman":
@@ -74,7 +89,14 @@ def make_builder(out_file, impl, vocab_size=None):
         return IndexedDatasetBuilder(out_file)
 
 
-def make_dataset(path, impl, fix_lua_indexing=False, dictionary=None):
+def make_dataset(
+    path,
+    impl,
+    fix_lua_indexing=False,
+    dictionary=None,
+    native_dtype=False,
+    mmap_warmup="full",
+):
     if impl == "raw" and IndexedRawTextDataset.exists(path):
         assert dictionary is not None
         return IndexedRawTextDataset(path, dictionary)
@@ -83,7 +105,9 @@ def make_dataset(path, impl, fix_lua_indexing=False, dictionary=None):
     elif impl == "cached" and IndexedDataset.exists(path):
         return IndexedCachedDataset(path, fix_lua_indexing=fix_lua_indexing)
     elif impl == "mmap" and MMapIndexedDataset.exists(path):
-        return MMapIndexedDataset(path)
+        return MMapIndexedDataset(path, native_dtype=native_dtype, warmup=mmap_warmup)
+    elif impl == "compressed" and CompressedIndexedDataset.exists(path):
+        return CompressedIndexedDataset(path, native_dtype=native_dtype)
     elif impl == "fasta" and FastaDataset.exists(path):
         from fairseq.data.fasta_dataset import EncodedFastaDataset
 
@@ -100,6 +124,8 @@ def dataset_exists(path, impl):
         return MMapIndexedDataset.exists(path)
     elif impl == "huffman":
         return HuffmanMMapIndexedDataset.exists(path)
+    elif impl == "compressed":
+        return CompressedIndexedDataset.exists(path)
     else:
         return IndexedDataset.exists(path)
 
@@ -202,6 +228,9 @@ class IndexedDataset(FairseqDataset):
     def num_tokens(self, index):
         return self.sizes[index]
 
+    def num_tokens_vec(self, indices):
+        return self.sizes[indices]
+
     def size(self, index):
         return self.sizes[index]
 
@@ -312,6 +341,9 @@ class IndexedRawTextDataset(FairseqDataset):
     def num_tokens(self, index):
         return self.sizes[index]
 
+    def num_tokens_vec(self, indices):
+        return self.sizes[indices]
+
     def size(self, index):
         return self.sizes[index]
 
@@ -352,20 +384,12 @@ class IndexedDatasetBuilder:
         assert index.dtype == self.dtype
 
         begin = self.data_offsets[-1]
-        for offset in index.data_offsets[1:]:
-            self.data_offsets.append(begin + offset)
-        self.sizes.extend(index.sizes)
+        self.data_offsets.extend((begin + index.data_offsets[1:]).tolist())
+        self.sizes.extend(index.sizes.tolist())
         begin = self.dim_offsets[-1]
-        for dim_offset in index.dim_offsets[1:]:
-            self.dim_offsets.append(begin + dim_offset)
+        self.dim_offsets.extend((begin + index.dim_offsets[1:]).tolist())
 
-        with open(data_file_path(another_file), "rb") as f:
-            while True:
-                data = f.read(1024)
-                if data:
-                    self.out_file.write(data)
-                else:
-                    break
+        _copy_files_parallel([data_file_path(another_file)], self.out_file)
 
     def finalize(self, index_file):
         self.out_file.close()
@@ -388,6 +412,109 @@ def _warmup_mmap_file(path):
             pass
 
 
+def _copy_fd_range(
+    src_fd, dst_fd, src_offset, dst_offset, num_bytes, chunk_size=16 * 1024 * 1024
+):
+    """Copy *num_bytes* bytes between two file descriptors at explicit offsets,
+    inside the kernel with ``copy_file_range`` where available. Offsets are
+    positional, so several ranges of the same files can be copied in
+    parallel."""
+    use_copy_file_range = hasattr(os, "copy_file_range")
+    while num_bytes > 0:
+        copied = 0
+        if use_copy_file_range:
+            try:
+                copied = os.copy_file_range(
+                    src_fd, dst_fd, num_bytes, src_offset, dst_offset
+                )
+            except OSError:
+                # e.g. EXDEV across filesystems on older kernels
+                use_copy_file_range = False
+        if copied == 0:
+            data = os.pread(src_fd, min(num_bytes, chunk_size), src_offset)
+            if not data:
+                raise EOFError("source file is shorter than expected")
+            copied = os.pwrite(dst_fd, data, dst_offset)
+        num_bytes -= copied
+        src_offset += copied
+        dst_offset += copied
+
+
+def _copy_bytes(src, dst, num_bytes, chunk_size=16 * 1024 * 1024):
+    """Copy the next *num_bytes* bytes of file object *src* to the end of
+    file object *dst*."""
+    if hasattr(os, "pwrite"):
+        dst.flush()
+        dst_offset = dst.seek(0, os.SEEK_END)
+        src_offset = src.tell()
+        _copy_fd_range(src.fileno(), dst.fileno(), src_offset, dst_offset, num_bytes)
+        src.seek(src_offset + num_bytes)
+        dst.seek(dst_offset + num_bytes)
+        return
+    while num_bytes > 0:
+        data = src.read(min(num_bytes, chunk_size))
+        if not data:
+            raise EOFError(f"{src.name} is shorter than expected")
+        dst.write(data)
+        num_bytes -= len(data)
+
+
+def _copy_files_parallel(src_paths, dst, num_workers=8):
+    """Append the files *src_paths*, in order, to the end of file object
+    *dst*, copying them concurrently into preallocated ranges."""
+    if not hasattr(os, "pwrite"):
+        for src_path in src_paths:
+            with open(src_path, "rb") as src:
+                shutil.copyfileobj(src, dst)
+        return
+
+    dst.flush()
+    begin = dst.seek(0, os.SEEK_END)
+    src_sizes = [os.path.getsize(src_path) for src_path in src_paths]
+    dst_offsets = begin + np.cumsum([0] + src_sizes[:-1], dtype=np.int64)
+    end = begin + sum(src_sizes)
+    os.ftruncate(dst.fileno(), end)
+
+    def copy(src_path, src_size, dst_offset):
+        with open(src_path, "rb") as src:
+            _copy_fd_range(src.fileno(), dst.fileno(), 0, dst_offset, src_size)
+
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(num_workers, len(src_paths)))
+    ) as pool:
+        futures = [
+            pool.submit(copy, src_path, src_size, int(dst_offset))
+            for src_path, src_size, dst_offset in zip(src_paths, src_sizes, dst_offsets)
+        ]
+        for future in futures:
+            future.result()
+    dst.seek(end)
+
+
+def _timed_warmup_mmap_file(path):
+    start = time.perf_counter()
+    _warmup_mmap_file(path)
+    logger.debug(f"warmed up {path} in {time.perf_counter() - start:.2f}s")
+
+
+def _madvise_willneed(mmap_obj, starts, ends, max_gap=1024 * 1024):
+    """Ask the kernel to asynchronously read ahead the byte ranges
+    ``[starts[i], ends[i])`` of *mmap_obj*, merging ranges that are less than
+    *max_gap* bytes apart into a single request."""
+    if len(starts) == 0 or not hasattr(mmap_obj, "madvise"):
+        return
+    order = np.argsort(starts, kind="stable")
+    starts = starts[order] // mmap.PAGESIZE * mmap.PAGESIZE
+    ends = np.maximum.accumulate(ends[order])
+    new_range = np.ones(len(starts), dtype=bool)
+    new_range[1:] = starts[1:] > ends[:-1] + max_gap
+    range_starts = starts[new_range]
+    range_ends = ends[np.append(np.flatnonzero(new_range)[1:] - 1, len(ends) - 1)]
+    for start, end in zip(range_starts.tolist(), range_ends.tolist()):
+        if end > start:
+            mmap_obj.madvise(mmap.MADV_WILLNEED, start, end - start)
+
+
 class MMapIndexedDataset(torch.utils.data.Dataset):
     class Index:
         _HDR_MAGIC = b"MMIDIDX\x00\x00"
@@ -407,13 +534,11 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
                 @staticmethod
                 def _get_pointers(sizes):
                     dtype_size = dtype().itemsize
-                    address = 0
-                    pointers = []
-
-                    for size in sizes:
-                        pointers.append(address)
-                        address += size * dtype_size
-
+                    pointers = np.zeros(len(sizes), dtype=np.int64)
+                    np.cumsum(
+                        np.asarray(sizes[:-1], dtype=np.int64) * dtype_size,
+                        out=pointers[1:],
+                    )
                     return pointers
 
                 def write(self, sizes):
@@ -425,7 +550,6 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
                     self._file.write(sizes.tobytes(order="C"))
                     del sizes
 
-                    pointers = np.array(pointers, dtype=np.int64)
                     self._file.write(pointers.tobytes(order="C"))
                     del pointers
 
@@ -434,7 +558,7 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
 
             return _Writer()
 
-        def __init__(self, path):
+        def __init__(self, path, warmup=True):
             with open(path, "rb") as stream:
                 magic_test = stream.read(9)
                 assert self._HDR_MAGIC == magic_test, (
@@ -451,7 +575,8 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
                 self._len = struct.unpack("<Q", stream.read(8))[0]
                 offset = stream.tell()
 
-            _warmup_mmap_file(path)
+            if warmup:
+                _warmup_mmap_file(path)
 
             self._bin_buffer_mmap = np.memmap(path, mode="r", order="C")
             self._bin_buffer = memoryview(self._bin_buffer_mmap)
@@ -477,6 +602,10 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
         def sizes(self):
             return self._sizes
 
+        @property
+        def pointers(self):
+            return self._pointers
+
         @lru_cache(maxsize=8)
         def __getitem__(self, i):
             return self._pointers[i], self._sizes[i]
@@ -484,28 +613,77 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
         def __len__(self):
             return self._len
 
-    def __init__(self, path):
+    def __init__(self, path, native_dtype=False, warmup="full"):
+        """
+        Args:
+            path (str): dataset prefix, without the ``.idx``/``.bin`` suffix
+            native_dtype (bool, optional): return items as zero-copy views in
+                the stored dtype (e.g. uint16) instead of int64 copies. Items
+                must then be treated as read-only and widened to int64 by the
+                consumer, typically once the batch is on the training device
+                (default: False).
+            warmup (str, optional): how to bring the files into the page cache
+                when the dataset is opened or unpickled in a worker. One of
+                'full' (read both files), 'index' (read only the ``.idx``),
+                'background' (read the ``.idx``, then the ``.bin`` in a daemon
+                thread), 'madvise' (read the ``.idx``, then let :func:`prefetch`
+                issue ``madvise(MADV_WILLNEED)`` for the ranges of the upcoming
+                batches) or 'none' (default: 'full').
+        """
         super().__init__()
 
         self._path = None
         self._index = None
         self._bin_buffer = None
+        self._native_dtype = False
+        self._warmup = "full"
 
-        self._do_init(path)
+        self._do_init(path, native_dtype, warmup)
 
     def __getstate__(self):
-        return self._path
+        return self._path, self._native_dtype, self._warmup
 
     def __setstate__(self, state):
-        self._do_init(state)
-
-    def _do_init(self, path):
+        if isinstance(state, str):
+            # pickled by an older version, which only stored the path
+            state = (state,)
+        self._do_init(*state)
+
+    def _do_init(self, path, native_dtype=False, warmup="full"):
+        if str(warmup) not in {choice.value for choice in MMAP_WARMUP_CHOICES}:
+            raise ValueError(f"unknown mmap warmup mode: {warmup}")
         self._path = path
-        self._index = self.Index(index_file_path(self._path))
+        self._native_dtype = native_dtype
+        self._warmup = str(warmup)
+
+        start = time.perf_counter()
+        self._index = self.Index(
+            index_file_path(self._path), warmup=self._warmup != "none"
+        )
+
+        if native_dtype and not hasattr(torch, np.dtype(self._index.dtype).name):
+            raise ValueError(
+                f"native_dtype requires torch support for {self._index.dtype}, "
+                f"which is not available in torch {torch.__version__}"
+            )
 
-        _warmup_mmap_file(data_file_path(self._path))
+        if self._warmup == "full":
+            _warmup_mmap_file(data_file_path(self._path))
+        elif self._warmup == "background":
+            threading.Thread(
+                target=_timed_warmup_mmap_file,
+                args=(data_file_path(self._path),),
+                daemon=True,
+            ).start()
+        logger.debug(
+            f"opened {self._path} with {self._warmup} warmup "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
+
+        # native dtype items are views into the buffer, so map it copy-on-write
+        # to give torch writable memory without ever touching the file
         self._bin_buffer_mmap = np.memmap(
-            data_file_path(self._path), mode="r", order="C"
+            data_file_path(self._path), mode="c" if native_dtype else "r", order="C"
         )
         self._bin_buffer = memoryview(self._bin_buffer_mmap)
 
@@ -523,18 +701,54 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
         np_array = np.frombuffer(
             self._bin_buffer, dtype=self._index.dtype, count=size, offset=ptr
         )
-        if self._index.dtype != np.int64:
+        if self._index.dtype != np.int64 and not self._native_dtype:
             np_array = np_array.astype(np.int64)
 
         return torch.from_numpy(np_array)
 
+    def get_many(self, indices):
+        """Read several items with a single gather over the data buffer.
+
+        Returns a flat 1D tensor with the tokens of all requested items
+        concatenated in order, and a tensor of ``len(indices) + 1`` offsets
+        such that item ``j`` is ``tokens[offsets[j]:offsets[j + 1]]``.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        sizes = self._index.sizes[indices].astype(np.int64)
+        starts = self._index.pointers[indices] // self._index.dtype().itemsize
+
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        positions = np.arange(offsets[-1], dtype=np.int64)
+        positions += np.repeat(starts - offsets[:-1], sizes)
+
+        data = np.frombuffer(self._bin_buffer, dtype=self._index.dtype)
+        tokens = data[positions]
+        if self._index.dtype != np.int64 and not self._native_dtype:
+            tokens = tokens.astype(np.int64)
+
+        return torch.from_numpy(tokens), torch.from_numpy(offsets)
+
+    def __getitems__(self, indices):
+        tokens, offsets = self.get_many(indices)
+        sizes = (offsets[1:] - offsets[:-1]).tolist()
+        return list(torch.split(tokens, sizes))
+
     @property
     def sizes(self):
         return self._index.sizes
 
     @property
     def supports_prefetch(self):
-        return False
+        return self._warmup == "madvise"
+
+    def prefetch(self, indices):
+        """Start asynchronous readahead of the data for *indices*."""
+        indices = np.asarray(indices, dtype=np.int64)
+        starts = self._index.pointers[indices]
+        sizes = self._index.sizes[indices].astype(np.int64)
+        ends = starts + sizes * self._index.dtype().itemsize
+        _madvise_willneed(self._bin_buffer_mmap._mmap, starts, ends)
 
     @staticmethod
     def exists(path):
@@ -567,26 +781,415 @@ class MMapIndexedDatasetBuilder:
         self._data_file = open(out_file, "wb")
         self._dtype = dtype
         self._sizes = []
+        # sizes of merged files and of items added before each merge
+        self._size_chunks = []
 
     def add_item(self, tensor):
         np_array = np.array(tensor.numpy(), dtype=self._dtype)
         self._data_file.write(np_array.tobytes(order="C"))
         self._sizes.append(np_array.size)
 
+    def add_items(self, tokens, offsets):
+        """Add the items ``tokens[offsets[i]:offsets[i + 1]]`` at once, e.g.
+        from :func:`~fairseq.data.Dictionary.encode_lines`."""
+        np_array = np.asarray(tokens, dtype=self._dtype)
+        self._data_file.write(np_array[offsets[0] : offsets[-1]].tobytes(order="C"))
+        self._sizes.extend(np.diff(offsets).tolist())
+
     def merge_file_(self, another_file):
+        self.merge_files_([another_file])
+
+    def merge_files_(self, other_files, num_workers=8):
+        """Append several finalized datasets at once. Their indices are
+        concatenated with NumPy and their data files are copied concurrently,
+        inside the kernel where possible."""
         # Concatenate index
-        index = MMapIndexedDataset.Index(index_file_path(another_file))
+        self._size_chunks.append(np.array(self._sizes, dtype=np.int32))
+        self._sizes = []
+        for another_file in other_files:
+            index = MMapIndexedDataset.Index(
+                index_file_path(another_file), warmup=False
+            )
+            assert index.dtype == self._dtype
+            self._size_chunks.append(np.array(index.sizes, dtype=np.int32))
+            del index
+
+        # Concatenate data
+        _copy_files_parallel(
+            [data_file_path(f) for f in other_files],
+            self._data_file,
+            num_workers=num_workers,
+        )
+
+    def finalize(self, index_file):
+        self._data_file.close()
+
+        sizes = np.concatenate(
+            self._size_chunks + [np.array(self._sizes, dtype=np.int32)]
+        )
+        with MMapIndexedDataset.Index.writer(index_file, self._dtype) as index:
+            index.write(sizes)
+
+
+_code_to_block_codec = {
+    1: "zlib",
+    2: "zstd",
+}
+
+
+def _block_codec_header_code(codec) -> int:
+    for k, v in _code_to_block_codec.items():
+        if v == codec:
+            return k
+    raise ValueError(codec)
+
+
+def _default_block_codec():
+    try:
+        import zstandard  # noqa: F401
+
+        return "zstd"
+    except ImportError:
+        return "zlib"
+
+
+def _get_block_codec(codec):
+    """Return the ``(compress, decompress)`` functions for *codec*."""
+    if codec == "zlib":
+        return zlib.compress, zlib.decompress
+    elif codec == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(
+                "Please install zstandard to read or write zstd compressed "
+                "datasets: pip install zstandard"
+            )
+        return (
+            zstandard.ZstdCompressor().compress,
+            zstandard.ZstdDecompressor().decompress,
+        )
+    raise ValueError(codec)
+
+
+class CompressedIndexedDataset(torch.utils.data.Dataset):
+    """
+    An indexed dataset whose token stream is stored as independently
+    compressed fixed-size blocks.
+
+    All items are concatenated into one stream in the stored dtype, which is
+    cut into blocks of ``block_size`` uncompressed bytes. An item is read by
+    decompressing only the blocks it overlaps; the most recently decompressed
+    blocks are kept in a small LRU cache.
+    """
+
+    class Index:
+        _HDR_MAGIC = b"CMPIDX\x00\x00\x00"
+        _VERSION = 1
+
+        @classmethod
+        def writer(cls, path, dtype, codec, block_size):
+            class _Writer:
+                def __enter__(self):
+                    self._file = open(path, "wb")
+
+                    self._file.write(cls._HDR_MAGIC)
+                    self._file.write(struct.pack("<Q", cls._VERSION))
+                    self._file.write(struct.pack("<B", _dtype_header_code(dtype)))
+                    self._file.write(struct.pack("<B", _block_codec_header_code(codec)))
+                    self._file.write(struct.pack("<Q", block_size))
+
+                    return self
+
+                def write(self, sizes, block_offsets):
+                    sizes = np.array(sizes, dtype=np.int32)
+                    self._file.write(struct.pack("<Q", len(sizes)))
+                    self._file.write(struct.pack("<Q", len(block_offsets) - 1))
+
+                    self._file.write(sizes.tobytes(order="C"))
+
+                    offsets = np.zeros(len(sizes), dtype=np.int64)
+                    np.cumsum(sizes[:-1], out=offsets[1:])
+                    self._file.write(offsets.tobytes(order="C"))
+                    del sizes, offsets
+
+                    block_offsets = np.array(block_offsets, dtype=np.int64)
+                    self._file.write(block_offsets.tobytes(order="C"))
+                    del block_offsets
+
+                def __exit__(self, exc_type, exc_val, exc_tb):
+                    self._file.close()
+
+            return _Writer()
+
+        def __init__(self, path):
+            with open(path, "rb") as stream:
+                magic_test = stream.read(9)
+                assert self._HDR_MAGIC == magic_test, (
+                    "Index file doesn't match expected format. "
+                    "Make sure that --dataset-impl is configured properly."
+                )
+                (version,) = struct.unpack("<Q", stream.read(8))
+                assert (
+                    self._VERSION == version
+                ), f"Unexpected file version{version} != code version {self._VERSION}"
+
+                (dtype_code,) = struct.unpack("<B", stream.read(1))
+                self._dtype = _code_to_dtype[dtype_code]
+                (codec_code,) = struct.unpack("<B", stream.read(1))
+                self._codec = _code_to_block_codec[codec_code]
+                (self._block_size,) = struct.unpack("<Q", stream.read(8))
+
+                self._len, num_blocks = struct.unpack("<QQ", stream.read(16))
+                offset = stream.tell()
+
+            self._bin_buffer_mmap = np.memmap(path, mode="r", order="C")
+            self._bin_buffer = memoryview(self._bin_buffer_mmap)
+            self._sizes = np.frombuffer(
+                self._bin_buffer, dtype=np.int32, count=self._len, offset=offset
+            )
+            offset += self._sizes.nbytes
+            self._offsets = np.frombuffer(
+                self._bin_buffer, dtype=np.int64, count=self._len, offset=offset
+            )
+            offset += self._offsets.nbytes
+            self._block_offsets = np.frombuffer(
+                self._bin_buffer, dtype=np.int64, count=num_blocks + 1, offset=offset
+            )
+
+        def __del__(self):
+            self._bin_buffer_mmap._mmap.close()
+            del self._bin_buffer_mmap
+
+        @property
+        def dtype(self):
+            return self._dtype
+
+        @property
+        def codec(self):
+            return self._codec
+
+        @property
+        def block_size(self):
+            return self._block_size
+
+        @property
+        def sizes(self):
+            return self._sizes
+
+        @property
+        def offsets(self):
+            """start of each item in the uncompressed stream, in elements"""
+            return self._offsets
+
+        @property
+        def block_offsets(self):
+            """start of each compressed block in the data file, in bytes"""
+            return self._block_offsets
+
+        def __len__(self):
+            return self._len
+
+    def __init__(self, path, native_dtype=False, cache_blocks=64):
+        """
+        Args:
+            path (str): dataset prefix, without the ``.idx``/``.bin`` suffix
+            native_dtype (bool, optional): return items in the stored dtype
+                instead of int64 (default: False).
+            cache_blocks (int, optional): number of decompressed blocks to keep
+                in the LRU cache (default: 64).
+        """
+        super().__init__()
+
+        self._path = None
+        self._index = None
+        self._bin_buffer = None
+        self._native_dtype = False
+        self._cache_blocks = cache_blocks
+
+        self._do_init(path, native_dtype, cache_blocks)
+
+    def __getstate__(self):
+        return self._path, self._native_dtype, self._cache_blocks
+
+    def __setstate__(self, state):
+        self._do_init(*state)
+
+    def _do_init(self, path, native_dtype=False, cache_blocks=64):
+        self._path = path
+        self._native_dtype = native_dtype
+        self._cache_blocks = cache_blocks
+        self._index = self.Index(index_file_path(self._path))
+        _, self._decompress = _get_block_codec(self._index.codec)
+        # per instance, so that the cache does not outlive the dataset
+        self._read_block = lru_cache(maxsize=cache_blocks)(self._decompress_block)
+
+        self._bin_buffer_mmap = np.memmap(
+            data_file_path(self._path), mode="r", order="C"
+        )
+        self._bin_buffer = memoryview(self._bin_buffer_mmap)
+
+    def __del__(self):
+        self._bin_buffer_mmap._mmap.close()
+        del self._bin_buffer_mmap
+        del self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def _decompress_block(self, block):
+        start, end = self._index.block_offsets[block : block + 2]
+        return self._decompress(self._bin_buffer[start:end])
+
+    def _read_bytes(self, start, end):
+        block_size = self._index.block_size
+        first_block, last_block = start // block_size, (end - 1) // block_size
+        if first_block == last_block:
+            block_start = first_block * block_size
+            return self._read_block(first_block)[
+                start - block_start : end - block_start
+            ]
+        data = b"".join(
+            self._read_block(block) for block in range(first_block, last_block + 1)
+        )
+        return data[start - first_block * block_size : end - first_block * block_size]
+
+    @lru_cache(maxsize=8)
+    def __getitem__(self, i):
+        itemsize = self._index.dtype().itemsize
+        size = int(self._index.sizes[i])
+        start = int(self._index.offsets[i]) * itemsize
+        if size == 0:
+            np_array = np.empty(0, dtype=self._index.dtype)
+        else:
+            np_array = np.frombuffer(
+                self._read_bytes(start, start + size * itemsize),
+                dtype=self._index.dtype,
+            ).copy()
+        if self._index.dtype != np.int64 and not self._native_dtype:
+            np_array = np_array.astype(np.int64)
+
+        return torch.from_numpy(np_array)
+
+    def get_many(self, indices):
+        """Same as :func:`MMapIndexedDataset.get_many`."""
+        items = [self[int(i)] for i in indices]
+        sizes = torch.LongTensor([0] + [len(item) for item in items])
+        if len(items) == 0:
+            dtype = self._index.dtype if self._native_dtype else np.int64
+            return torch.from_numpy(np.empty(0, dtype=dtype)), sizes
+        return torch.cat(items), torch.cumsum(sizes, dim=0)
+
+    def cache_info(self):
+        """Hit/miss statistics of the decompressed block cache."""
+        return self._read_block.cache_info()
+
+    @property
+    def sizes(self):
+        return self._index.sizes
+
+    @property
+    def supports_prefetch(self):
+        return False
+
+    @staticmethod
+    def exists(path):
+        return PathManager.exists(index_file_path(path)) and PathManager.exists(
+            data_file_path(path)
+        )
+
+    @property
+    def can_reuse_epoch_itr_across_epochs(self):
+        return True
+
+
+class CompressedIndexedDatasetBuilder:
+    """
+    Builder for :class:`CompressedIndexedDataset`. Same interface as
+    :class:`MMapIndexedDatasetBuilder`.
+    """
+
+    def __init__(self, out_file, dtype=np.int64, codec=None, block_size=64 * 1024):
+        assert block_size % np.dtype(dtype).itemsize == 0
+        self._data_file = open(out_file, "wb")
+        self._dtype = dtype
+        self._codec = codec or _default_block_codec()
+        self._compress, self._decompress = _get_block_codec(self._codec)
+        self._block_size = block_size
+        self._sizes = []
+        self._block_offsets = [0]
+        self._pending = []
+        self._pending_bytes = 0
+
+    def _write_block(self, data):
+        self._block_offsets.append(
+            self._block_offsets[-1] + self._data_file.write(self._compress(data))
+        )
+
+    def _add_bytes(self, data, flush=False):
+        self._pending.append(data)
+        self._pending_bytes += len(data)
+        if self._pending_bytes < self._block_size and not flush:
+            return
+
+        buffer = b"".join(self._pending)
+        num_full_blocks = len(buffer) // self._block_size
+        for k in range(num_full_blocks):
+            self._write_block(buffer[k * self._block_size : (k + 1) * self._block_size])
+        rest = buffer[num_full_blocks * self._block_size :]
+        if flush and len(rest) > 0:
+            self._write_block(rest)
+            rest = b""
+        self._pending = [rest]
+        self._pending_bytes = len(rest)
+
+    def add_item(self, tensor):
+        np_array = np.array(tensor.numpy(), dtype=self._dtype)
+        self._add_bytes(np_array.tobytes(order="C"))
+        self._sizes.append(np_array.size)
+
+    def add_items(self, tokens, offsets):
+        np_array = np.asarray(tokens, dtype=self._dtype)
+        self._add_bytes(np_array[offsets[0] : offsets[-1]].tobytes(order="C"))
+        self._sizes.extend(np.diff(offsets).tolist())
+
+    def merge_file_(self, another_file):
+        index = CompressedIndexedDataset.Index(index_file_path(another_file))
         assert index.dtype == self._dtype
 
-        for size in index.sizes:
-            self._sizes.append(size)
+        self._sizes.extend(index.sizes.tolist())
 
-        # Concatenate data
+        block_offsets = index.block_offsets
+        num_blocks = len(block_offsets) - 1
         with open(data_file_path(another_file), "rb") as f:
-            shutil.copyfileobj(f, self._data_file)
+            if self._pending_bytes == 0 and (
+                index.codec == self._codec and index.block_size == self._block_size
+            ):
+                # we are at a block boundary: copy the compressed full blocks
+                # as is and only recompress the trailing partial block
+                stream_bytes = int(index.sizes.sum(dtype=np.int64)) * (
+                    np.dtype(self._dtype).itemsize
+                )
+                num_full_blocks = stream_bytes // self._block_size
+                begin = self._block_offsets[-1]
+                for offset in block_offsets[1 : num_full_blocks + 1]:
+                    self._block_offsets.append(begin + int(offset))
+                _copy_bytes(f, self._data_file, int(block_offsets[num_full_blocks]))
+                first_block = num_full_blocks
+            else:
+                first_block = 0
+
+            _, decompress = _get_block_codec(index.codec)
+            for block in range(first_block, num_blocks):
+                start, end = block_offsets[block : block + 2]
+                f.seek(int(start))
+                self._add_bytes(decompress(f.read(int(end - start))))
 
     def finalize(self, index_file):
+        self._add_bytes(b"", flush=True)
         self._data_file.close()
 
-        with MMapIndexedDataset.Index.writer(index_file, self._dtype) as index:
-            index.write(self._sizes)
+        with CompressedIndexedDataset.Index.writer(
+            index_file, self._dtype, self._codec, self._block_size
+        ) as index:
+            index.write(self._sizes, self._block_offsets)
@@ -3,19 +3,27 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import collections
+import glob
+import hashlib
 import itertools
+import json
 import logging
 import math
 import operator
 import os
 import queue
 import time
+import traceback
+import weakref
 from threading import Thread
 from typing import Iterator, List
 
 import numpy as np
 import torch
 from fairseq.data import data_utils
+from fairseq.data.indexed_dataset import best_fitting_int_dtype
+from fairseq.logging import metrics
 
 
 logger = logging.getLogger(__name__)
@@ -131,9 +139,14 @@ class EpochBatchIterating(object):
 class StreamingEpochBatchIterator(EpochBatchIterating):
     """A steaming-style iterator over a :class:`torch.utils.data.IterableDataset`.
 
+    Resuming in the middle of an epoch requires the dataset to implement
+    ``set_batch_offset(n)`` to skip the first *n* batches of the epoch (see
+    :class:`~fairseq.data.StreamingIndexedDataset`), otherwise the epoch
+    restarts.
+
     Args:
         dataset (~torch.utils.data.Dataset): dataset from which to load the data
-        max_sentences: batch size
+        max_sentences: batch size, ``None`` if the dataset yields batches
         collate_fn (callable): merges a list of samples to form a mini-batch
         num_workers (int, optional): how many subprocesses to use for data
             loading. 0 means the data will be loaded in the main process
@@ -171,6 +184,7 @@ class StreamingEpochBatchIterator(EpochBatchIterating):
         self.timeout = timeout
 
         self._current_epoch_iterator = None
+        self._resume_offset = 0
 
     @property
     def next_epoch_idx(self):
@@ -186,7 +200,10 @@ class StreamingEpochBatchIterator(EpochBatchIterating):
         self.epoch = self.next_epoch_idx
         if set_dataset_epoch and hasattr(self.dataset, "set_epoch"):
             self.dataset.set_epoch(self.epoch)
-        self._current_epoch_iterator = self._get_iterator_for_epoch(self.epoch, shuffle)
+        self._current_epoch_iterator = self._get_iterator_for_epoch(
+            self.epoch, shuffle, offset=self._resume_offset
+        )
+        self._resume_offset = 0
         return self._current_epoch_iterator
 
     def end_of_epoch(self) -> bool:
@@ -199,14 +216,31 @@ class StreamingEpochBatchIterator(EpochBatchIterating):
         return 0
 
     def state_dict(self):
+        if self._current_epoch_iterator is not None and self.end_of_epoch():
+            return {"epoch": self.epoch + 1, "iterations_in_epoch": 0}
         return {
             "epoch": self.epoch,
+            "iterations_in_epoch": self.iterations_in_epoch,
         }
 
     def load_state_dict(self, state_dict):
         self.epoch = state_dict["epoch"]
+        self._current_epoch_iterator = None
+        self._resume_offset = state_dict.get("iterations_in_epoch", 0)
 
     def _get_iterator_for_epoch(self, epoch, shuffle, offset=0):
+        if offset > 0:
+            if hasattr(self.dataset, "set_batch_offset"):
+                self.dataset.set_batch_offset(offset)
+            else:
+                logger.warning(
+                    f"{self.dataset.__class__.__name__} cannot skip batches, "
+                    f"restarting epoch {epoch} from its first batch"
+                )
+                offset = 0
+        elif hasattr(self.dataset, "set_batch_offset"):
+            self.dataset.set_batch_offset(0)
+
         if self.num_workers > 0:
             os.environ["PYTHONWARNINGS"] = "ignore:semaphore_tracker:UserWarning"
 
@@ -233,6 +267,65 @@ class StreamingEpochBatchIterator(EpochBatchIterating):
         return itr
 
 
+class PersistedBatches:
+    """A read-only list of batches backed by a single integer array: the
+    number of batches, the ``num_batches + 1`` offsets of each batch and the
+    concatenated sample indices. Loaded with :func:`load` the array is
+    memory-mapped, and slicing is O(1).
+    """
+
+    def __init__(self, offsets, indices):
+        self.offsets = offsets
+        self.indices = indices
+
+    @classmethod
+    def load(cls, path):
+        array = np.load(path, mmap_mode="r")
+        num_batches = int(array[0])
+        return cls(array[1 : num_batches + 2], array[num_batches + 2 :])
+
+    @staticmethod
+    def save(batches, path):
+        """Atomically write *batches* (a list of index arrays) to the ``.npy``
+        file *path*."""
+        lengths = np.fromiter((len(b) for b in batches), np.int64, len(batches))
+        offsets = np.zeros(len(batches) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        indices = (
+            np.concatenate([np.asarray(b, dtype=np.int64) for b in batches])
+            if offsets[-1] > 0
+            else np.zeros(0, dtype=np.int64)
+        )
+        max_value = max(offsets[-1], indices.max() if len(indices) > 0 else 0)
+        array = np.concatenate([[len(batches)], offsets, indices]).astype(
+            best_fitting_int_dtype(max_value)
+        )
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            assert step == 1, "only contiguous slices are supported"
+            stop = max(start, stop)
+            return PersistedBatches(self.offsets[start : stop + 1], self.indices)
+        if index < 0:
+            index += len(self)
+        return np.array(
+            self.indices[self.offsets[index] : self.offsets[index + 1]],
+            dtype=np.int64,
+        )
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
 class FrozenBatchSampler:
     def __init__(
         self,
@@ -303,6 +396,19 @@ class EpochBatchIterator(EpochBatchIterating):
         grouped_shuffling (bool, optional): enable shuffling batches in groups
             of num_shards. Ensures that each GPU receives similar length sequences when
             batches are sorted by length.
+        batches_dir (str, optional): if set, each epoch's batches for this shard
+            are saved to a ``.npy`` file in this directory, and referenced by
+            :func:`state_dict`. Resuming mid-epoch memory-maps them instead of
+            rebuilding and reshuffling the batches (default: ``None``).
+        buffer_backend (str, optional): ``"thread"`` to preload *buffer_size*
+            batches with a :class:`BufferedIterator`, or ``"process"`` to load
+            them in a separate process with a :class:`ProcessBufferedIterator`
+            (default: ``"thread"``).
+        buffer_slot_bytes (int, optional): size of the shared memory slots of
+            the ``"process"`` backend (default: 16MB).
+        token_budgets (~fairseq.data.TokenBudgets, optional): if set, the
+            batches of *batch_sampler* are regrouped following the per-length
+            bucket token budgets of each epoch (default: ``None``).
     """
 
     def __init__(
@@ -322,6 +428,10 @@ class EpochBatchIterator(EpochBatchIterating):
         grouped_shuffling=False,
         reuse_dataloader=False,
         persistent_workers=True,
+        batches_dir=None,
+        buffer_backend="thread",
+        buffer_slot_bytes=16 * 1024 * 1024,
+        token_budgets=None,
     ):
         assert isinstance(dataset, torch.utils.data.Dataset)
         self.dataset = dataset
@@ -338,6 +448,8 @@ class EpochBatchIterator(EpochBatchIterating):
         # This upper limit here is to prevent people from abusing this feature
         # in a shared computing environment.
         self.buffer_size = min(buffer_size, 20)
+        self.buffer_backend = buffer_backend
+        self.buffer_slot_bytes = buffer_slot_bytes
         self.timeout = timeout
         self.disable_shuffling = disable_shuffling
         self.skip_remainder_batch = skip_remainder_batch
@@ -352,12 +464,51 @@ class EpochBatchIterator(EpochBatchIterating):
         self.dataloader = None
         self.reuse_dataloader = reuse_dataloader
 
+        self.batches_dir = batches_dir
+        self._batches_key = None
+        self._resumed_batches = None
+
+        self.token_budgets = token_budgets
+        self._budgeted_batches = None
+        self._budgeted_key = None
+
     @property
     def frozen_batches(self):
         if self._frozen_batches is None:
             self._frozen_batches = tuple(self.batch_sampler(self.dataset, self.epoch))
+        if self.token_budgets is not None:
+            return self._apply_token_budgets(self._frozen_batches)
         return self._frozen_batches
 
+    def _num_tokens_vec(self, indices):
+        try:
+            return self.dataset.num_tokens_vec(indices).astype(np.int64)
+        except (AttributeError, NotImplementedError):
+            return np.fromiter(
+                map(self.dataset.num_tokens, indices),
+                dtype=np.int64,
+                count=len(indices),
+            )
+
+    def _apply_token_budgets(self, batches):
+        if len(batches) == 0:
+            return batches
+        if self.token_budgets.bounds is None:
+            self.token_budgets.init_buckets(
+                self._num_tokens_vec(np.arange(len(self.dataset)))
+            )
+        budgets = self.token_budgets.budgets_for_epoch(self.epoch)
+        key = (id(batches), self.epoch, budgets.tobytes())
+        if self._budgeted_key != key:
+            indices = np.concatenate([np.asarray(b, dtype=np.int64) for b in batches])
+            self._budgeted_batches = tuple(
+                self.token_budgets.batch(
+                    batches, self._num_tokens_vec(indices), self.epoch
+                )
+            )
+            self._budgeted_key = key
+        return self._budgeted_batches
+
     @property
     def first_batch(self):
         if len(self.frozen_batches) == 0:
@@ -446,19 +597,27 @@ class EpochBatchIterator(EpochBatchIterating):
         else:
             epoch = self.epoch
             iter_in_epoch = self.iterations_in_epoch
-        return {
+        state = {
             "version": 2,
             "epoch": epoch,
             "iterations_in_epoch": iter_in_epoch,
             "shuffle": self.shuffle,
         }
+        if iter_in_epoch > 0 and self._batches_key is not None:
+            state["batches_key"] = self._batches_key
+        if self.token_budgets is not None:
+            state["token_budgets"] = self.token_budgets.state_dict()
+        return state
 
     def load_state_dict(self, state_dict):
         """Copies the state of the iterator from the given *state_dict*."""
         self.epoch = state_dict["epoch"]
         itr_pos = state_dict.get("iterations_in_epoch", 0)
         version = state_dict.get("version", 1)
+        if self.token_budgets is not None and "token_budgets" in state_dict:
+            self.token_budgets.load_state_dict(state_dict["token_budgets"])
         if itr_pos > 0:
+            self._maybe_load_epoch_batches(state_dict.get("batches_key"))
             # fast-forward epoch iterator
             self._next_epoch_itr = self._get_iterator_for_epoch(
                 self.epoch,
@@ -486,7 +645,7 @@ class EpochBatchIterator(EpochBatchIterating):
             itr = self.dataloader
         else:
             self.epoch_batch_sampler = FrozenBatchSampler(
-                self.ordered_batches,
+                self._epoch_batches,
                 epoch,
                 fix_batches_to_gpus,
                 shuffle,
@@ -499,22 +658,34 @@ class EpochBatchIterator(EpochBatchIterating):
             if self.num_workers > 0:
                 os.environ["PYTHONWARNINGS"] = "ignore:semaphore_tracker:UserWarning"
 
-            # Create data loader
-            itr = torch.utils.data.DataLoader(
-                self.dataset,
-                collate_fn=self.collate_fn,
-                batch_sampler=self.epoch_batch_sampler,
-                num_workers=self.num_workers,
-                timeout=self.timeout,
-                pin_memory=True,
-                persistent_workers=self.persistent_workers,
-            )
-
-            if self.reuse_dataloader:
-                self.dataloader = itr
+            if self.buffer_size > 0 and self.buffer_backend == "process":
+                # loads, collates and buffers the batches in its own process
+                itr = ProcessBufferedIterator(
+                    self.buffer_size,
+                    self.dataset,
+                    self.collate_fn,
+                    self.epoch_batch_sampler,
+                    num_workers=self.num_workers,
+                    timeout=self.timeout,
+                    slot_bytes=self.buffer_slot_bytes,
+                )
+            else:
+                # Create data loader
+                itr = torch.utils.data.DataLoader(
+                    self.dataset,
+                    collate_fn=self.collate_fn,
+                    batch_sampler=self.epoch_batch_sampler,
+                    num_workers=self.num_workers,
+                    timeout=self.timeout,
+                    pin_memory=True,
+                    persistent_workers=self.persistent_workers,
+                )
+
+                if self.reuse_dataloader:
+                    self.dataloader = itr
 
         # Wrap with a BufferedIterator if needed
-        if self.buffer_size > 0:
+        if self.buffer_size > 0 and not isinstance(itr, ProcessBufferedIterator):
             itr = BufferedIterator(self.buffer_size, itr)
 
         # Wrap with CountingIterator
@@ -530,6 +701,67 @@ class EpochBatchIterator(EpochBatchIterating):
 
         return itr
 
+    def _batches_path(self, key):
+        return os.path.join(
+            self.batches_dir,
+            f"epoch_batches.{key}.shard{self.shard_id}-of-{self.num_shards}.npy",
+        )
+
+    def _maybe_load_epoch_batches(self, key):
+        self._resumed_batches = None
+        if key is None or self.batches_dir is None or self._supports_prefetch:
+            return
+        path = self._batches_path(key)
+        if not os.path.exists(path):
+            logger.warning(f"{path} not found, rebuilding the batches of the epoch")
+            return
+        self._batches_key = key
+        self._resumed_batches = PersistedBatches.load(path)
+        logger.info(f"loaded {len(self._resumed_batches)} batches from {path}")
+
+    def _save_epoch_batches(self, batches, epoch, fix_batches_to_gpus, shuffle):
+        key = hashlib.blake2b(
+            json.dumps(
+                [
+                    epoch,
+                    self.seed,
+                    shuffle,
+                    fix_batches_to_gpus,
+                    self.grouped_shuffling,
+                    len(self.frozen_batches),
+                ]
+            ).encode("utf-8"),
+            digest_size=8,
+        ).hexdigest()
+        path = self._batches_path(key)
+        try:
+            os.makedirs(self.batches_dir, exist_ok=True)
+            PersistedBatches.save(batches, path)
+        except OSError as e:
+            logger.warning(f"could not save the batches of epoch {epoch}: {e}")
+            return None
+        # the batches of earlier epochs are not needed to resume anymore
+        pattern = f"epoch_batches.*.shard{self.shard_id}-of-{self.num_shards}.npy"
+        for old_path in glob.glob(os.path.join(self.batches_dir, pattern)):
+            if old_path != path:
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    pass
+        return key
+
+    def _epoch_batches(self, epoch, fix_batches_to_gpus, shuffle):
+        if self._resumed_batches is not None:
+            batches, self._resumed_batches = self._resumed_batches, None
+            return batches
+        batches = self.ordered_batches(epoch, fix_batches_to_gpus, shuffle)
+        self._batches_key = None
+        if self.batches_dir is not None and not self._supports_prefetch:
+            self._batches_key = self._save_epoch_batches(
+                batches, epoch, fix_batches_to_gpus, shuffle
+            )
+        return batches
+
     def ordered_batches(self, epoch, fix_batches_to_gpus, shuffle):
         def shuffle_batches(batches, seed):
             with data_utils.numpy_seed(seed):
@@ -750,6 +982,335 @@ class BufferedIterator(object):
         return item
 
 
+class _TensorRef:
+    """Placeholder for the *index*-th tensor of a batch sent through a slot."""
+
+    __slots__ = ["index"]
+
+    def __init__(self, index):
+        self.index = index
+
+    def __getstate__(self):
+        return self.index
+
+    def __setstate__(self, state):
+        self.index = state
+
+
+def _flatten_tensors(obj, tensors):
+    if torch.is_tensor(obj):
+        tensors.append(obj)
+        return _TensorRef(len(tensors) - 1)
+    if isinstance(obj, dict):
+        return {k: _flatten_tensors(v, tensors) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_flatten_tensors(v, tensors) for v in obj]
+    if type(obj) is tuple:
+        return tuple(_flatten_tensors(v, tensors) for v in obj)
+    return obj
+
+
+def _unflatten_tensors(obj, tensors):
+    if isinstance(obj, _TensorRef):
+        return tensors[obj.index]
+    if isinstance(obj, dict):
+        return {k: _unflatten_tensors(v, tensors) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_unflatten_tensors(v, tensors) for v in obj]
+    if type(obj) is tuple:
+        return tuple(_unflatten_tensors(v, tensors) for v in obj)
+    return obj
+
+
+def _align(nbytes, alignment=64):
+    return (nbytes + alignment - 1) // alignment * alignment
+
+
+def _copy_to_slot(batch, slots, free_slots):
+    """Copy the tensors of *batch* to a free slot and return the message for
+    the consumer, or send the batch itself if it does not fit or every slot
+    is still in use."""
+    tensors = []
+    structure = _flatten_tensors(batch, tensors)
+    if not all(t.layout == torch.strided and t.device.type == "cpu" for t in tensors):
+        return ("batch", batch)
+    nbytes = sum(_align(t.numel() * t.element_size()) for t in tensors)
+    if nbytes > slots[0].numel():
+        return ("batch", batch)
+    try:
+        slot = free_slots.get_nowait()
+    except queue.Empty:
+        return ("batch", batch)
+
+    buf = slots[slot]
+    offset = 0
+    metas = []
+    for t in tensors:
+        size = t.numel() * t.element_size()
+        buf[offset : offset + size].view(t.dtype).view(t.shape).copy_(t)
+        metas.append((offset, t.dtype, tuple(t.shape)))
+        offset += _align(size)
+    return ("slot", slot, structure, metas)
+
+
+def _put_unless_stopped(out_queue, item, stop):
+    while not stop.is_set():
+        try:
+            out_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _produce_batches(
+    dataset,
+    collate_fn,
+    batch_sampler,
+    num_workers,
+    timeout,
+    total,
+    slots,
+    free_slots,
+    out_queue,
+    stop,
+    produced,
+):
+    try:
+        itr = torch.utils.data.DataLoader(
+            dataset,
+            collate_fn=collate_fn,
+            batch_sampler=batch_sampler,
+            num_workers=num_workers,
+            timeout=timeout,
+        )
+        for batch in itertools.islice(itr, total):
+            item = _copy_to_slot(batch, slots, free_slots)
+            if not _put_unless_stopped(out_queue, item, stop):
+                break
+            with produced.get_lock():
+                produced.value += 1
+        else:
+            _put_unless_stopped(out_queue, ("done",), stop)
+    except Exception:
+        _put_unless_stopped(out_queue, ("error", traceback.format_exc()), stop)
+    # tensors sent through the queue are shared by file descriptors that this
+    # process serves, so stay alive until the consumer is done
+    stop.wait()
+    out_queue.cancel_join_thread()
+
+
+def _release_slot(released, slot):
+    event = None
+    if torch.cuda.is_available() and torch.cuda.is_initialized():
+        # the slot may still be the source of a pending non_blocking copy
+        event = torch.cuda.Event()
+        event.record()
+    released.append((slot, event))
+
+
+def _shutdown_producer(process, stop, registered):
+    stop.set()
+    if process is not None:
+        process.join(timeout=10)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+    for ptr in registered:
+        torch.cuda.cudart().cudaHostUnregister(ptr)
+
+
+class ProcessBufferedIterator(object):
+    """Alternative to :class:`BufferedIterator` that loads and collates the
+    batches in a separate process, so that data loading does not compete with
+    the training loop for the GIL.
+
+    The producer copies the tensors of each batch into one of ``size + 2``
+    shared memory slots of *slot_bytes*, which are also pinned when CUDA is
+    available, and the consumer returns views of that slot. A slot is reused
+    once all tensors of its batch (and their views) have been freed. Batches
+    that do not fit into a slot, or that are produced while every slot is
+    still in use, are pickled through the queue instead.
+
+    The producer is forked, unless CUDA is already initialized: a forked
+    child cannot use CUDA, and forking a process with CUDA driver threads is
+    unsafe. It is then started from a forkserver, which needs *dataset* and
+    *collate_fn* to be picklable.
+
+    The time spent waiting for a batch is logged as ``data_wait`` and the
+    number of ready batches as ``data_buffer``.
+
+    Args:
+        size (int): maximum number of batches to prefetch
+        dataset (~torch.utils.data.Dataset): dataset to load from
+        collate_fn (callable): merges a list of samples to form a mini-batch
+        batch_sampler (~torch.utils.data.Sampler): the batches of indices
+        num_workers (int, optional): number of DataLoader workers of the
+            producer process (default: 0).
+        timeout (int, optional): timeout of those workers (default: 0).
+        slot_bytes (int, optional): size of each shared memory slot
+            (default: 16MB).
+    """
+
+    def __init__(
+        self,
+        size,
+        dataset,
+        collate_fn,
+        batch_sampler,
+        num_workers=0,
+        timeout=0,
+        slot_bytes=16 * 1024 * 1024,
+    ):
+        self.size = size
+        self.dataset = dataset
+        self.collate_fn = collate_fn
+        self.batch_sampler = batch_sampler
+        self.num_workers = num_workers
+        self.timeout = timeout
+        self.slot_bytes = _align(slot_bytes)
+        self.total = len(batch_sampler)
+
+        self._process = None
+        self._consumed = 0
+        self._released = collections.deque()
+
+    def _start_producer(self):
+        import torch.multiprocessing as mp
+
+        if torch.cuda.is_initialized():
+            ctx = mp.get_context("forkserver")
+            # the sampler refers back to the epoch iterator, only send its batches
+            batch_sampler = list(self.batch_sampler)
+        else:
+            # fork, so that the dataset and sampler do not need to be pickled
+            ctx = mp.get_context("fork")
+            batch_sampler = self.batch_sampler
+        num_slots = self.size + 2
+        self._slots = [
+            torch.empty(self.slot_bytes, dtype=torch.uint8).share_memory_()
+            for _ in range(num_slots)
+        ]
+        self._slot_arrays = [slot.numpy() for slot in self._slots]
+
+        self._free_slots = ctx.Queue()
+        for i in range(num_slots):
+            self._free_slots.put(i)
+        self._queue = ctx.Queue(self.size)
+        self._stop = ctx.Event()
+        self._produced = ctx.Value("l", 0)
+        self._process = ctx.Process(
+            target=_produce_batches,
+            args=(
+                self.dataset,
+                self.collate_fn,
+                batch_sampler,
+                self.num_workers,
+                self.timeout,
+                self.total,
+                self._slots,
+                self._free_slots,
+                self._queue,
+                self._stop,
+                self._produced,
+            ),
+            daemon=False,  # the producer has DataLoader workers of its own
+        )
+        self._process.start()
+
+        # pinning initializes CUDA, so only once the producer is started
+        registered = []
+        if torch.cuda.is_available():
+            cudart = torch.cuda.cudart()
+            for slot in self._slots:
+                ptr = slot.data_ptr()
+                err = cudart.cudaHostRegister(ptr, self.slot_bytes, 0)
+                if int(err) != 0:
+                    logger.warning(
+                        f"could not pin the data buffer (error {int(err)}), "
+                        "host to device copies will be synchronous"
+                    )
+                    break
+                registered.append(ptr)
+        self._finalizer = weakref.finalize(
+            self, _shutdown_producer, self._process, self._stop, registered
+        )
+
+    def __iter__(self):
+        return self
+
+    def __len__(self):
+        return self.total
+
+    def take(self, n):
+        assert self._process is None, "take() must be called before iterating"
+        self.total = min(self.total, n)
+        return self
+
+    def close(self):
+        if self._process is not None:
+            self._finalizer()
+
+    def _recycle_slots(self):
+        pending = []
+        while self._released:
+            slot, event = self._released.popleft()
+            if event is None or event.query():
+                self._free_slots.put(slot)
+            else:
+                pending.append((slot, event))
+        self._released.extend(pending)
+
+    def _get(self):
+        while True:
+            try:
+                return self._queue.get(timeout=1.0)
+            except queue.Empty:
+                if not self._process.is_alive():
+                    raise RuntimeError(
+                        "data loading process exited unexpectedly "
+                        f"(exit code {self._process.exitcode})"
+                    )
+
+    def _from_slot(self, slot, structure, metas):
+        # the slot is released when this array, which backs the storage of
+        # every returned tensor, is garbage collected
+        lease = self._slot_arrays[slot][:]
+        weakref.finalize(lease, _release_slot, self._released, slot)
+        buf = torch.frombuffer(lease, dtype=torch.uint8)
+        tensors = []
+        for offset, dtype, shape in metas:
+            size = math.prod(shape) * torch.empty((), dtype=dtype).element_size()
+            tensors.append(buf[offset : offset + size].view(dtype).view(shape))
+        return _unflatten_tensors(structure, tensors)
+
+    def __next__(self):
+        if self._process is None:
+            self._start_producer()
+        if self._consumed >= self.total:
+            self.close()
+            raise StopIteration()
+        self._recycle_slots()
+
+        start = time.perf_counter()
+        item = self._get()
+        metrics.log_scalar_sum("data_wait", time.perf_counter() - start, 850, round=1)
+
+        if item[0] == "done":
+            self.close()
+            raise StopIteration()
+        if item[0] == "error":
+            self.close()
+            raise RuntimeError(f"error in the data loading process:\n{item[1]}")
+        self._consumed += 1
+        metrics.log_scalar(
+            "data_buffer", self._produced.value - self._consumed, priority=860
+        )
+        if item[0] == "slot":
+            return self._from_slot(*item[1:])
+        return item[1]
+
+
 class GroupedEpochBatchIterator(EpochBatchIterator):
     """Grouped version of EpochBatchIterator
     It takes several samplers from different datasets.
@@ -303,29 +303,46 @@ class LanguagePairDataset(FairseqDataset):
 
     def __getitem__(self, index):
         tgt_item = self.tgt[index] if self.tgt is not None else None
-        src_item = self.src[index]
+        return self._example(index, self.src[index], tgt_item)
+
+    def __getitems__(self, indices):
+        if type(self).__getitem__ is not LanguagePairDataset.__getitem__:
+            return [self[index] for index in indices]
+        # a single batched read of each side, e.g. from an MMapIndexedDataset
+        src_items = data_utils.get_many_items(self.src, indices)
+        if self.tgt is not None:
+            tgt_items = data_utils.get_many_items(self.tgt, indices)
+        else:
+            tgt_items = [None] * len(src_items)
+        return [
+            self._example(index, src_item, tgt_item)
+            for index, src_item, tgt_item in zip(indices, src_items, tgt_items)
+        ]
+
+    def _example(self, index, src, tgt):
+        src_item, tgt_item = src, tgt
         # Append EOS to end of tgt sentence if it does not have an EOS and remove
         # EOS from end of src sentence if it exists. This is useful when we use
         # use existing datasets for opposite directions i.e., when we want to
         # use tgt_dataset as src_dataset and vice versa
         if self.append_eos_to_target:
             eos = self.tgt_dict.eos() if self.tgt_dict else self.src_dict.eos()
-            if self.tgt and self.tgt[index][-1] != eos:
-                tgt_item = torch.cat([self.tgt[index], torch.LongTensor([eos])])
+            if self.tgt and tgt[-1] != eos:
+                tgt_item = torch.cat([tgt, torch.LongTensor([eos])])
 
         if self.append_bos:
             bos = self.tgt_dict.bos() if self.tgt_dict else self.src_dict.bos()
-            if self.tgt and self.tgt[index][0] != bos:
-                tgt_item = torch.cat([torch.LongTensor([bos]), self.tgt[index]])
+            if self.tgt and tgt[0] != bos:
+                tgt_item = torch.cat([torch.LongTensor([bos]), tgt])
 
             bos = self.src_dict.bos()
-            if self.src[index][0] != bos:
-                src_item = torch.cat([torch.LongTensor([bos]), self.src[index]])
+            if src[0] != bos:
+                src_item = torch.cat([torch.LongTensor([bos]), src])
 
         if self.remove_eos_from_source:
             eos = self.src_dict.eos()
-            if self.src[index][-1] == eos:
-                src_item = self.src[index][:-1]
+            if src[-1] == eos:
+                src_item = src[:-1]
 
         example = {
             "id": index,
@@ -25,6 +25,9 @@ class ListDataset(BaseWrapperDataset):
     def num_tokens(self, index):
         return self.sizes[index]
 
+    def num_tokens_vec(self, indices):
+        return self.sizes[indices]
+
     def size(self, index):
         return self.sizes[index]
 
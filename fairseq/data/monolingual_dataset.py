@@ -45,7 +45,7 @@ def collate(samples, pad_idx, eos_idx, fixed_pad_length=None, pad_to_bsz=None):
     else:
         target = src_tokens
 
-    return {
+    batch = {
         "id": torch.LongTensor([s["id"] for s in samples]),
         "nsentences": len(samples),
         "ntokens": sum(len(s["source"]) for s in samples),
@@ -55,6 +55,15 @@ def collate(samples, pad_idx, eos_idx, fixed_pad_length=None, pad_to_bsz=None):
         },
         "target": target,
     }
+    if samples[0].get("segment_ids") is not None:
+        batch["net_input"]["segment_ids"] = data_utils.collate_tokens(
+            [s["segment_ids"] for s in samples],
+            -1,
+            left_pad=False,
+            pad_to_length=fixed_pad_length,
+            pad_to_bsz=pad_to_bsz,
+        )
+    return batch
 
 
 class MonolingualDataset(FairseqDataset):
@@ -67,6 +76,8 @@ class MonolingualDataset(FairseqDataset):
         vocab (~fairseq.data.Dictionary): vocabulary
         shuffle (bool, optional): shuffle the elements before batching
             (default: True).
+        segment_ids (~fairseq.data.PackedSegmentIdsDataset, optional): segment
+            ids of a packed *dataset*, passed to the model as ``segment_ids``.
     """
 
     def __init__(
@@ -83,6 +94,7 @@ class MonolingualDataset(FairseqDataset):
         pad_to_bsz=None,
         src_lang_idx=None,
         tgt_lang_idx=None,
+        segment_ids=None,
     ):
         self.dataset = dataset
         self.sizes = np.array(sizes)
@@ -95,6 +107,11 @@ class MonolingualDataset(FairseqDataset):
         self.pad_to_bsz = pad_to_bsz
         self.src_lang_idx = src_lang_idx
         self.tgt_lang_idx = tgt_lang_idx
+        self.segment_ids = segment_ids
+        assert segment_ids is None or not add_bos_token, (
+            "a bos token can't be added to packed sequences, "
+            "add it to every packed item instead"
+        )
 
         assert targets is None or all(
             t in {"self", "future", "past"} for t in targets
@@ -121,7 +138,19 @@ class MonolingualDataset(FairseqDataset):
             source = self.dataset[index]
             target = None
         source, target = self._maybe_add_bos(source, target)
-        return {"id": index, "source": source, "target": target}
+        item = {"id": index, "source": source, "target": target}
+        if self.segment_ids is not None:
+            segment_ids = self.segment_ids[index]
+            if len(segment_ids) < len(source):
+                # an eos appended by _make_source_target ends the last segment
+                segment_ids = torch.cat(
+                    [
+                        segment_ids,
+                        segment_ids[-1:].expand(len(source) - len(segment_ids)),
+                    ]
+                )
+            item["segment_ids"] = segment_ids
+        return item
 
     def __len__(self):
         return len(self.dataset)
@@ -15,7 +15,7 @@ from typing import List
 import numpy as np
 import torch
 
-from fairseq.data import FairseqDataset, data_utils
+from fairseq.data import FairseqDataset, data_utils, shared_memory_utils
 from fairseq.distributed import utils as distributed_utils
 
 
@@ -227,7 +227,7 @@ class SampledMultiDataset(FairseqDataset):
 
     def _get_dataset_and_index(self, index):
         i = bisect_right(self.cumulated_sizes, index)
-        return i, self._cur_indices[index]
+        return i, self._cur_indices.array[index]
 
     def __getitem__(self, index):
         # self.__getitem__(index) returns self.datasets[k][self._cur_indices[index]]
@@ -333,10 +333,10 @@ class SampledMultiDataset(FairseqDataset):
     @property
     def sizes(self):
         if self._sizes is not None:
-            return self._sizes
+            return self._sizes.array
         start_time = time.time()
         in_sub_dataset_indices = [
-            self._cur_indices[
+            self._cur_indices.array[
                 0 if i == 0 else self.cumulated_sizes[i - 1] : self.cumulated_sizes[i]
             ]
             for i in range(len(self.datasets))
@@ -345,9 +345,11 @@ class SampledMultiDataset(FairseqDataset):
             d.sizes[indices]
             for d, indices in zip(self.datasets, in_sub_dataset_indices)
         ]
-        self._sizes = np.vstack(sub_dataset_sizes)
+        self._sizes = shared_memory_utils.SharedMemoryArray(
+            np.vstack(sub_dataset_sizes)
+        )
         logger.info(f"sizes() calling time: {get_time_gap(start_time, time.time())}")
-        return self._sizes
+        return self._sizes.array
 
     def ordered_indices(self):
         if self.shuffle:
@@ -420,7 +422,7 @@ class SampledMultiDataset(FairseqDataset):
         indices, cumulated_sizes, virtual_size_per_dataset = self.get_virtual_indices(
             rng, self.datasets, self.sample_ratios, self.virtual_size
         )
-        self._cur_indices = indices
+        self._cur_indices = shared_memory_utils.SharedMemoryArray(indices)
         self.cumulated_sizes = cumulated_sizes
         self.virtual_size_per_dataset = virtual_size_per_dataset
 
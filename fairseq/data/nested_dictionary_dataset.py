@@ -5,6 +5,7 @@
 
 from collections import OrderedDict
 
+import numpy as np
 import torch
 from torch.utils.data.dataloader import default_collate
 
@@ -96,6 +97,11 @@ class NestedDictionaryDataset(FairseqDataset):
         enforce ``--max-tokens`` during batching."""
         return max(s[index] for s in self.sizes)
 
+    def num_tokens_vec(self, indices):
+        """Return the number of tokens for a set of positions defined by indices.
+        This value is used to enforce ``--max-tokens`` during batching."""
+        return np.max([np.asarray(s)[indices] for s in self.sizes], axis=0)
+
     def size(self, index):
         """Return an example's size as a float or tuple. This value is used when
         filtering a dataset with ``--max-positions``."""
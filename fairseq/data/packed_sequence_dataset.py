@@ -0,0 +1,176 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import heapq
+import logging
+
+import numpy as np
+import torch
+
+from . import BaseWrapperDataset, FairseqDataset, data_utils
+
+logger = logging.getLogger(__name__)
+
+
+def pack_sequences(sizes, max_length):
+    """Pack items of the given *sizes* into rows of at most *max_length*
+    tokens, using best-fit decreasing. Items longer than *max_length* get a
+    row of their own.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: the item indices of all rows, sorted by
+        index within each row, and the offsets of each row into them
+        (``num_rows + 1`` entries).
+    """
+    sizes = np.asarray(sizes, dtype=np.int64)
+    order = np.argsort(-sizes, kind="stable")
+    row_of_item = np.empty(len(sizes), dtype=np.int64)
+
+    # rows that are not full, as (remaining capacity, -insertion, row). Items
+    # come by decreasing size, so a row that fits the current item fits all
+    # the next ones: those rows are in a min-heap (the best fit is at the
+    # top), the others wait in a max-heap until the items get small enough
+    fits, waiting = [], []
+    num_rows = 0
+    for n, (i, size) in enumerate(zip(order.tolist(), sizes[order].tolist())):
+        while waiting and -waiting[0][0] >= size:
+            capacity, key, row = heapq.heappop(waiting)
+            heapq.heappush(fits, (-capacity, key, row))
+        if fits:
+            capacity, _, row = heapq.heappop(fits)
+        else:
+            row, capacity = num_rows, max_length
+            num_rows += 1
+        row_of_item[i] = row
+        capacity -= size
+        if capacity >= size:
+            heapq.heappush(fits, (capacity, -n, row))
+        elif capacity > 0:
+            heapq.heappush(waiting, (-capacity, -n, row))
+
+    items = np.lexsort((np.arange(len(sizes)), row_of_item))
+    offsets = np.zeros(num_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row_of_item, minlength=num_rows), out=offsets[1:])
+    return items, offsets
+
+
+class PackedSequenceDataset(FairseqDataset):
+    """Concatenate several short items of *dataset* into rows of up to
+    *max_length* tokens, to train with little padding.
+
+    Items are tensors, or tuples/dicts of aligned tensors (e.g. the source and
+    targets of :class:`~fairseq.data.TokenBlockDataset`), which are
+    concatenated element-wise. Use :class:`PackedSegmentIdsDataset` to tell
+    the model where each packed item starts, so that attention does not
+    cross items and positions restart.
+
+    Args:
+        dataset (~torch.utils.data.Dataset): dataset to pack
+        sizes (List[int]): item lengths
+        max_length (int): maximum number of tokens per row
+    """
+
+    def __init__(self, dataset, sizes, max_length):
+        super().__init__()
+        self.dataset = dataset
+        self.max_length = max_length
+        self.item_sizes = np.asarray(sizes, dtype=np.int64)
+        self.items, self.offsets = pack_sequences(self.item_sizes, max_length)
+        self._sizes = np.add.reduceat(self.item_sizes[self.items], self.offsets[:-1])
+        if len(self._sizes) > 0:
+            logger.info(
+                f"packed {len(self.item_sizes)} items into {len(self._sizes)} rows "
+                f"of up to {max_length} tokens, "
+                f"{self._sizes.sum() / (len(self._sizes) * max_length):.1%} full"
+            )
+
+    def row_items(self, index):
+        """Return the indices of the items packed into row *index*."""
+        return self.items[self.offsets[index] : self.offsets[index + 1]]
+
+    def segment_sizes(self, index):
+        """Return the lengths of the items packed into row *index*."""
+        return self.item_sizes[self.row_items(index)]
+
+    def __getitem__(self, index):
+        items = [self.dataset[i] for i in self.row_items(index)]
+        first = items[0]
+        if isinstance(first, dict):
+            return {k: torch.cat([item[k] for item in items]) for k in first}
+        if isinstance(first, (tuple, list)):
+            return tuple(
+                None if first[k] is None else torch.cat([item[k] for item in items])
+                for k in range(len(first))
+            )
+        return torch.cat(items)
+
+    def __len__(self):
+        return len(self._sizes)
+
+    @property
+    def sizes(self):
+        return self._sizes
+
+    def num_tokens(self, index):
+        return self._sizes[index]
+
+    def num_tokens_vec(self, indices):
+        return self._sizes[indices]
+
+    def size(self, index):
+        return self._sizes[index]
+
+    @property
+    def supports_prefetch(self):
+        return getattr(self.dataset, "supports_prefetch", False)
+
+    def prefetch(self, indices):
+        self.dataset.prefetch(
+            np.unique(np.concatenate([self.row_items(i) for i in indices]))
+        )
+
+    @property
+    def can_reuse_epoch_itr_across_epochs(self):
+        return getattr(self.dataset, "can_reuse_epoch_itr_across_epochs", True)
+
+    def set_epoch(self, epoch):
+        super().set_epoch(epoch)
+        if hasattr(self.dataset, "set_epoch"):
+            self.dataset.set_epoch(epoch)
+
+
+class PackedSegmentIdsDataset(BaseWrapperDataset):
+    """For each row of a :class:`PackedSequenceDataset`, the index of the
+    packed item every token belongs to, collated with -1 for padding. This is
+    the ``segment_ids`` input of :class:`~fairseq.models.transformer.TransformerEncoder`
+    and :class:`~fairseq.models.transformer.TransformerDecoder`.
+
+    Args:
+        dataset (PackedSequenceDataset): packed dataset
+        pad_to_length (int, optional): pad the segment ids to this length
+        pad_to_multiple (int, optional): pad the segment ids to a multiple of
+            this length, must match the padding of the tokens (default: 1).
+    """
+
+    def __init__(self, dataset, pad_to_length=None, pad_to_multiple=1):
+        super().__init__(dataset)
+        assert isinstance(dataset, PackedSequenceDataset)
+        self.pad_to_length = pad_to_length
+        self.pad_to_multiple = pad_to_multiple
+
+    def __getitem__(self, index):
+        lengths = torch.from_numpy(self.dataset.segment_sizes(index))
+        return torch.repeat_interleave(torch.arange(len(lengths)), lengths)
+
+    def collater(self, samples):
+        if len(samples) == 0:
+            return samples
+        return data_utils.collate_tokens(
+            samples,
+            -1,
+            left_pad=False,
+            pad_to_length=self.pad_to_length,
+            pad_to_multiple=self.pad_to_multiple,
+        )
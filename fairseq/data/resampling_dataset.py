@@ -7,7 +7,7 @@ import logging
 
 import numpy as np
 
-from fairseq.data import BaseWrapperDataset, plasma_utils
+from fairseq.data import BaseWrapperDataset, shared_memory_utils
 
 logger = logging.getLogger(__name__)
 
@@ -57,7 +57,7 @@ class ResamplingDataset(BaseWrapperDataset):
             assert len(weights) == len(dataset)
             weights_arr = np.array(weights, dtype=np.float64)
             weights_arr /= weights_arr.sum()
-            self.weights = plasma_utils.PlasmaArray(weights_arr)
+            self.weights = shared_memory_utils.SharedMemoryArray(weights_arr)
 
         self.replace = replace
 
@@ -90,6 +90,9 @@ class ResamplingDataset(BaseWrapperDataset):
     def num_tokens(self, index):
         return self.dataset.num_tokens(self._cur_indices.array[index])
 
+    def num_tokens_vec(self, indices):
+        return self.dataset.num_tokens_vec(self._cur_indices.array[indices])
+
     def size(self, index):
         return self.dataset.size(self._cur_indices.array[index])
 
@@ -129,7 +132,7 @@ class ResamplingDataset(BaseWrapperDataset):
                 self._cur_epoch,  # epoch index
             ]
         )
-        self._cur_indices = plasma_utils.PlasmaArray(
+        self._cur_indices = shared_memory_utils.SharedMemoryArray(
             rng.choice(
                 len(self.dataset),
                 self.actual_size,
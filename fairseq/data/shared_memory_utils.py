@@ -0,0 +1,213 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import atexit
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import weakref
+from typing import Hashable
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_SHARED_MEMORY_PATH = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+def _write_shared_array(array, path):
+    """Write *array* to the ``.npy`` file *path*, reserving its space up front
+    so that a full tmpfs fails with an OSError instead of a SIGBUS."""
+    shared = np.lib.format.open_memmap(
+        path, mode="w+", dtype=array.dtype, shape=array.shape
+    )
+    try:
+        if hasattr(os, "posix_fallocate"):
+            with open(path, "r+b") as f:
+                os.posix_fallocate(f.fileno(), 0, os.fstat(f.fileno()).st_size)
+        shared[...] = array
+        shared.flush()
+    finally:
+        del shared
+
+
+def _unlink_if_owner(path, owner_pid):
+    # forked workers inherit the finalizer, only the creating process cleans up
+    if os.getpid() != owner_pid:
+        return
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class SharedMemoryArray:
+    """
+    Drop-in replacement for :class:`~fairseq.data.plasma_utils.PlasmaArray`
+    that does not need a plasma store.
+
+    Upon serialization the array is moved to a file in shared memory
+    (``/dev/shm`` by default), and deserialized copies memory-map that file
+    read-only, so DataLoader workers share a single copy with the main process.
+    The file is removed when the creating process releases the array.
+    """
+
+    def __init__(self, array, shm_path=None, min_nbytes=134217728):
+        super().__init__()
+        self.array = array
+        # disable for arrays <128MB
+        self.disable = array.nbytes < max(min_nbytes, 1)
+        self.path = None
+        self.shm_path = shm_path
+
+        # variables with underscores shouldn't be pickled
+        self._finalizer = None
+
+    @classmethod
+    def from_file(cls, path):
+        """Wrap an existing ``.npy`` file. It is memory-mapped by every process
+        instead of being copied to shared memory, and is never removed."""
+        shared = cls(np.load(path, mmap_mode="r"))
+        shared.disable = False
+        shared.path = path
+        return shared
+
+    def _move_to_shared_memory(self):
+        fd, path = tempfile.mkstemp(
+            prefix="fairseq_",
+            suffix=".npy",
+            dir=self.shm_path or DEFAULT_SHARED_MEMORY_PATH,
+        )
+        os.close(fd)
+        try:
+            _write_shared_array(self.array, path)
+        except OSError as e:
+            os.unlink(path)
+            logger.warning(
+                f"could not move a {self.array.nbytes} byte array to shared memory, "
+                f"workers will receive their own copy: {e}"
+            )
+            self.disable = True
+            return
+        self._finalizer = weakref.finalize(self, _unlink_if_owner, path, os.getpid())
+        self.path = path
+        self.array = np.load(path, mmap_mode="r")
+
+    def __getstate__(self):
+        """Called on pickle save"""
+        if self.disable:
+            state = self.__dict__.copy()
+            state["_finalizer"] = None
+            return state
+        if self.path is None:
+            self._move_to_shared_memory()
+            if self.disable:
+                return self.__getstate__()
+        state = self.__dict__.copy()
+        del state["array"]
+        state["_finalizer"] = None
+        return state
+
+    def __setstate__(self, state):
+        """Called on pickle load"""
+        self.__dict__.update(state)
+        if self.disable:
+            return
+        self.array = np.load(self.path, mmap_mode="r")
+
+
+class SharedMemoryView:
+    """
+    Drop-in replacement for :class:`~fairseq.data.plasma_utils.PlasmaView`
+    that does not need a plasma store.
+
+    The array is written once to a shared memory file whose name is derived
+    from *split_path* and *hash_data*, so every rank on a node that builds the
+    same array maps the same file instead of keeping its own copy. An existing
+    file is reused if it has the shape and dtype of *array*, so *hash_data*
+    must capture everything the contents of the array depend on. The file is
+    removed when the process that wrote it exits, but survives a crash.
+    """
+
+    def __init__(self, array, split_path: str, hash_data: Hashable, shm_path=None):
+        """
+        Args:
+            array: numpy array to store. This can be read with ``SharedMemoryView().array``
+            split_path: the path whence the data was read, used for hashing
+            hash_data: other metadata about the array that can be used to create a unique key.
+        """
+        assert split_path is not None
+        if shm_path is None:
+            shm_path = DEFAULT_SHARED_MEMORY_PATH or tempfile.gettempdir()
+
+        self.path = os.path.join(shm_path, self.get_file_name(split_path, hash_data))
+        self._array = None
+        self._n = None
+
+        if not self._reusable(array):
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                _write_shared_array(array, tmp_path)
+            except OSError:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+            # atomic, so other ranks never map a partially written file
+            os.replace(tmp_path, self.path)
+            atexit.register(_unlink_if_owner, self.path, os.getpid())
+
+    def _reusable(self, array) -> bool:
+        """Whether the existing file can be mapped instead of *array*."""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            existing = np.load(self.path, mmap_mode="r")
+        except (OSError, ValueError) as e:
+            logger.warning(f"replacing unreadable shared memory file {self.path}: {e}")
+            return False
+        if array is None or (
+            existing.shape == array.shape and existing.dtype == array.dtype
+        ):
+            return True
+        # e.g. left behind by a crashed run on other data
+        logger.warning(
+            f"replacing shared memory file {self.path} of shape {existing.shape} "
+            f"and dtype {existing.dtype}, expected {array.shape} and {array.dtype}"
+        )
+        return False
+
+    @staticmethod
+    def get_file_name(split_path: str, hash_data: Hashable):
+        """Returns the shared memory file name for split_path and hash_data."""
+        hash = hashlib.blake2b(bytes(split_path, "utf-8"), digest_size=20)
+        harg = json.dumps(hash_data).encode("utf-8")
+        hash.update(harg)
+        return f"fairseq_{hash.hexdigest()}.npy"
+
+    @property
+    def array(self):
+        """Fetch a read only view of an np.array, stored in shared memory."""
+        if self._array is None:
+            self._array = np.load(self.path, mmap_mode="r")
+        return self._array
+
+    def __getstate__(self):
+        """Called on pickle save"""
+        state = self.__dict__.copy()
+        state["_array"] = None
+        return state
+
+    def __setstate__(self, state):
+        """Called on pickle load"""
+        self.__dict__.update(state)
+
+    def __len__(self):
+        """Save reads by caching len"""
+        if self._n is None:
+            self._n = len(self.array)
+        return self._n
@@ -0,0 +1,418 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import hashlib
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from fairseq.data import FairseqIterableDataset
+from fairseq.data.indexed_dataset import (
+    MMapIndexedDataset,
+    data_file_path,
+    index_file_path,
+)
+from fairseq.file_io import PathManager
+
+logger = logging.getLogger(__name__)
+
+
+def read_index_length(path):
+    """Return the number of items of the ``mmap`` dataset *path* (a prefix,
+    readable by :class:`~fairseq.file_io.PathManager`), reading only the
+    header of its index."""
+    magic = MMapIndexedDataset.Index._HDR_MAGIC
+    with PathManager.open(index_file_path(path), "rb") as f:
+        header = f.read(len(magic) + 17)
+    if header[: len(magic)] != magic:
+        raise ValueError(f"{index_file_path(path)} is not an mmap dataset index")
+    return struct.unpack("<Q", header[len(magic) + 9 :])[0]
+
+
+class StreamingFileCache(object):
+    """
+    Local copies of files readable by :class:`~fairseq.file_io.PathManager`,
+    kept in *cache_dir* within *max_bytes* by removing the least recently used
+    files. Local files are read in place.
+
+    Several processes (e.g. DataLoader workers and the ranks of a node) can
+    share the same *cache_dir*; removing a file that another process has
+    memory-mapped is safe.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=10 * 1024**3):
+        self.cache_dir = cache_dir or os.path.join(
+            tempfile.gettempdir(), "fairseq_streaming_cache"
+        )
+        self.max_bytes = max_bytes
+        self._lock = None
+        self._executor = None
+        self._downloads = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_lock"] = None
+        state["_executor"] = None
+        state["_downloads"] = {}
+        return state
+
+    def local_path(self, path):
+        if os.path.exists(path):
+            return path
+        # files of the same directory share a prefix, so that the .bin and .idx
+        # of a dataset stay next to each other
+        dirname, basename = os.path.split(path)
+        digest = hashlib.blake2b(dirname.encode("utf-8"), digest_size=10).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}_{basename}")
+
+    def get(self, path, keep=()):
+        """Return a local path with the contents of *path*, downloading it if
+        needed. Files in *keep* are not removed to make room for it."""
+        local = self.local_path(path)
+        if local == path:
+            return path
+        if self._lock is None:
+            self._lock = threading.Lock()
+        with self._lock:
+            future = self._downloads.pop(path, None)
+        if future is not None:
+            future.result()
+        if os.path.exists(local):
+            try:
+                os.utime(local)
+                return local
+            except FileNotFoundError:
+                pass  # removed by another process in the meantime
+        self._download(path, local, keep)
+        return local
+
+    def prefetch(self, path):
+        """Start downloading *path* in the background."""
+        if self.local_path(path) == path:
+            return
+        if self._lock is None:
+            self._lock = threading.Lock()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        with self._lock:
+            if path not in self._downloads:
+                self._downloads[path] = self._executor.submit(self.get, path)
+
+    def _download(self, path, local, keep):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = f"{local}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with PathManager.open(path, "rb") as src, open(tmp, "wb") as dst:
+                shutil.copyfileobj(src, dst, 16 * 1024 * 1024)
+            os.replace(tmp, local)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+        self._evict(set(keep) | {local})
+
+    def _evict(self, keep):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, entry.path, stat.st_size))
+        total = sum(size for _, _, size in entries)
+        for _, path, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path in keep:
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        if total > self.max_bytes:
+            logger.warning(
+                f"streaming cache {self.cache_dir} uses {total} bytes, more than "
+                f"its limit of {self.max_bytes}, because the files in use need it"
+            )
+
+
+class StreamingIndexedDataset(FairseqIterableDataset):
+    """
+    Stream the items of sharded ``mmap`` datasets (``.bin``/``.idx`` pairs)
+    from any :class:`~fairseq.file_io.PathManager` path, for corpora that do
+    not fit on local disk. Shards are downloaded through a
+    :class:`StreamingFileCache` and read sequentially.
+
+    Every epoch, the shards (split into pieces if there are fewer shards than
+    readers) are shuffled and dealt to the DataLoader workers of every
+    data-parallel rank, which shuffle their items with a window of
+    *shuffle_buffer* items and yield collated batches of *batch_size* items.
+    Every worker yields the same number of batches, so the items left over
+    by the worker with the fewest items are dropped for that epoch. The order
+    only depends on the seed, the epoch and the number of ranks and workers,
+    so training can resume in the middle of an epoch with
+    :func:`set_batch_offset` without reading the skipped items.
+
+    Args:
+        shards (List[List[str]]): for each shard, the prefixes of its aligned
+            columns (e.g. the source and target of a language pair)
+        make_dataset (callable): builds a
+            :class:`~fairseq.data.FairseqDataset` from the items of a batch,
+            given as a list of tuples with the tensors of each column. Its
+            collater creates the batch, whose ``id`` refers to the position of
+            the items in the stream.
+        max_sample_size (int): the largest number of tokens of a sample, to
+            derive the batch size from ``--max-tokens``
+        cache (StreamingFileCache, optional): the local cache of the shards
+        shuffle_buffer (int, optional): number of items to shuffle across
+            (default: 10000).
+        seed (int, optional): seed of the shuffling (default: 1).
+    """
+
+    def __init__(
+        self,
+        shards,
+        make_dataset,
+        max_sample_size,
+        cache=None,
+        shuffle_buffer=10000,
+        seed=1,
+    ):
+        super().__init__()
+        assert len(shards) > 0, "no shards to stream"
+        self.shards = [list(columns) for columns in shards]
+        self.make_dataset = make_dataset
+        self.max_sample_size = max_sample_size
+        self.cache = cache or StreamingFileCache()
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+
+        self.epoch = 1
+        self.batch_size = 1
+        self.num_shards = 1
+        self.shard_id = 0
+        self.num_workers = 0
+        self.batch_offset = 0
+
+        self._offsets = None
+        self._plan = None
+        self._open_shards = OrderedDict()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_open_shards"] = OrderedDict()
+        return state
+
+    @property
+    def offsets(self):
+        """The position of the first item of every shard in the stream."""
+        if self._offsets is None:
+            counts = []
+            for columns in self.shards:
+                lengths = {read_index_length(prefix) for prefix in columns}
+                if len(lengths) != 1:
+                    raise ValueError(f"columns of {columns} differ in length")
+                counts.append(lengths.pop())
+            self._offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+            np.cumsum(counts, out=self._offsets[1:])
+            logger.info(
+                f"streaming {self._offsets[-1]} items from {len(counts)} shards"
+            )
+        return self._offsets
+
+    def set_batching(
+        self,
+        max_tokens=None,
+        max_sentences=None,
+        required_batch_size_multiple=1,
+        num_shards=1,
+        shard_id=0,
+        num_workers=0,
+        seed=None,
+    ):
+        """Set the batch size, from *max_sentences* or else *max_tokens*, and
+        how the stream is split across ranks and DataLoader workers."""
+        batch_size = max_sentences
+        if batch_size is None:
+            assert max_tokens is not None, "Must specify --max-tokens or --batch-size"
+            batch_size = max(max_tokens // self.max_sample_size, 1)
+        if (
+            batch_size >= required_batch_size_multiple
+            and batch_size % required_batch_size_multiple != 0
+        ):
+            batch_size -= batch_size % required_batch_size_multiple
+        self.batch_size = batch_size
+        self.num_shards = num_shards
+        self.shard_id = shard_id
+        self.num_workers = num_workers
+        if seed is not None:
+            self.seed = seed
+        self._plan = None
+
+    def set_epoch(self, epoch):
+        super().set_epoch(epoch)
+        if epoch != self.epoch:
+            self.epoch = epoch
+            self._plan = None
+
+    def set_batch_offset(self, offset):
+        """Skip the first *offset* batches of this rank in the next epoch
+        iteration, to resume training."""
+        self.batch_offset = offset
+
+    def _get_plan(self):
+        """Deal the pieces of the epoch to the workers of all ranks.
+
+        Returns the pieces of each worker, as ``(first, last)`` positions in the
+        stream, and the number of batches of every worker."""
+        if self._plan is not None and self._plan[0] == self.epoch:
+            return self._plan[1:]
+        num_readers = self.num_shards * max(self.num_workers, 1)
+        offsets = self.offsets
+        # a few pieces per reader, so that their loads can be balanced
+        num_splits = -(-4 * num_readers // (len(offsets) - 1))
+        pieces = []
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            bounds = np.linspace(start, end, num_splits + 1).astype(np.int64)
+            pieces.extend((a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b > a)
+
+        # shuffle the pieces, then deal the largest first to the reader with
+        # the fewest items, to drop as few items as possible
+        rng = np.random.RandomState((self.seed + self.epoch) % 2**32)
+        order = rng.permutation(len(pieces))
+        sizes = np.array([b - a for a, b in pieces], dtype=np.int64)
+        order = order[np.argsort(-sizes[order], kind="stable")]
+        readers = [[] for _ in range(num_readers)]
+        loads = np.zeros(num_readers, dtype=np.int64)
+        for p in order:
+            r = int(np.argmin(loads))
+            readers[r].append(pieces[p])
+            loads[r] += sizes[p]
+        for r in range(num_readers):
+            # read the pieces of a reader in random order
+            rng.shuffle(readers[r])
+        num_batches = int(loads.min()) // self.batch_size
+        if num_batches == 0:
+            logger.warning(
+                f"some of the {num_readers} readers only get {loads.min()} items, "
+                f"not enough for a batch of {self.batch_size}"
+            )
+        self._plan = (self.epoch, readers, num_batches)
+        return readers, num_batches
+
+    def __len__(self):
+        """The number of batches of this rank in the epoch, after the offset."""
+        _, num_batches = self._get_plan()
+        return max(num_batches * max(self.num_workers, 1) - self.batch_offset, 0)
+
+    def _positions(self, pieces, rng):
+        """Yield the positions of the items of *pieces*, shuffled within a
+        window of *shuffle_buffer* items."""
+        size = self.shuffle_buffer
+        buffer = []
+        for k, (first, last) in enumerate(pieces):
+            if k + 1 < len(pieces):
+                # download the shard of the next piece while reading this one
+                self._prefetch_shard(pieces[k + 1][0])
+            for chunk_start in range(first, last, 4096):
+                chunk = np.arange(chunk_start, min(chunk_start + 4096, last))
+                if size <= 1:
+                    yield from chunk.tolist()
+                    continue
+                n = min(size - len(buffer), len(chunk))
+                buffer.extend(chunk[:n].tolist())
+                if n == len(chunk):
+                    continue
+                for position, j in zip(
+                    chunk[n:].tolist(), rng.randint(0, size, len(chunk) - n).tolist()
+                ):
+                    yield buffer[j]
+                    buffer[j] = position
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def _get_columns(self, shard):
+        columns = self._open_shards.get(shard)
+        if columns is not None:
+            self._open_shards.move_to_end(shard)
+            return columns
+        keep = {
+            self.cache.local_path(path)
+            for s in self._open_shards
+            for prefix in self.shards[s]
+            for path in (index_file_path(prefix), data_file_path(prefix))
+        }
+        columns = []
+        for prefix in self.shards[shard]:
+            local_idx = self.cache.get(index_file_path(prefix), keep=keep)
+            local_bin = self.cache.get(data_file_path(prefix), keep=keep)
+            keep.update([local_idx, local_bin])
+            if local_idx[: -len(".idx")] != local_bin[: -len(".bin")]:
+                raise ValueError(
+                    f"{prefix}.idx and {prefix}.bin must be cached together"
+                )
+            columns.append(MMapIndexedDataset(local_idx[: -len(".idx")], warmup="none"))
+        self._open_shards[shard] = columns
+        while len(self._open_shards) > 4:
+            self._open_shards.popitem(last=False)
+        return columns
+
+    def _read_batch(self, positions):
+        positions = np.asarray(positions, dtype=np.int64)
+        shards = np.searchsorted(self.offsets, positions, side="right") - 1
+        items = []
+        for position, shard in zip(positions.tolist(), shards.tolist()):
+            columns = self._get_columns(shard)
+            index = position - self.offsets[shard]
+            items.append(tuple(column[index] for column in columns))
+        dataset = self.make_dataset(items)
+        batch = dataset.collater([dataset[i] for i in range(len(dataset))])
+        if isinstance(batch, dict) and torch.is_tensor(batch.get("id")):
+            batch["id"] = torch.from_numpy(positions)[batch["id"]]
+        return batch
+
+    def __iter__(self):
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id = worker_info.id if worker_info is not None else 0
+        num_workers = worker_info.num_workers if worker_info is not None else 1
+        assert num_workers == max(self.num_workers, 1), (
+            f"expected {self.num_workers} DataLoader workers, got {num_workers}, "
+            "see set_batching()"
+        )
+        readers, num_batches = self._get_plan()
+
+        # batch i of this rank comes from worker i % num_workers. The
+        # DataLoader takes the first batch from its first worker, so after
+        # skipping batches the workers play the part of the following ones
+        worker_id = (worker_id + self.batch_offset) % num_workers
+        skip = max(self.batch_offset - worker_id + num_workers - 1, 0) // num_workers
+        reader = self.shard_id * num_workers + worker_id
+        pieces = readers[reader]
+
+        rng = np.random.RandomState(
+            [(self.seed + self.epoch) % 2**32, self.num_shards, num_workers, reader]
+        )
+        positions = self._positions(pieces, rng)
+        for i in range(num_batches):
+            batch = [next(positions) for _ in range(self.batch_size)]
+            if i < skip:
+                continue
+            yield self._read_batch(batch)
+
+    def _prefetch_shard(self, position):
+        shard = int(np.searchsorted(self.offsets, position, side="right")) - 1
+        for prefix in self.shards[shard]:
+            self.cache.prefetch(index_file_path(prefix))
+            self.cache.prefetch(data_file_path(prefix))
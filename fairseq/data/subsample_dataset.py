@@ -58,6 +58,9 @@ class SubsampleDataset(BaseWrapperDataset):
     def num_tokens(self, index):
         return self.dataset.num_tokens(self.indices[index])
 
+    def num_tokens_vec(self, indices):
+        return self.dataset.num_tokens_vec(self.indices[indices])
+
     def size(self, index):
         return self.dataset.size(self.indices[index])
 
@@ -3,11 +3,73 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import hashlib
+import json
+import logging
+import os
+import socket
+import time
+
 import numpy as np
 import torch
-from fairseq.data import FairseqDataset, plasma_utils
+from fairseq.data import FairseqDataset, plasma_utils, shared_memory_utils
 from fairseq.data.indexed_dataset import best_fitting_int_dtype
-from typing import Tuple
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_CACHED_ARRAYS = ("sizes", "block_to_dataset_index", "slice_indices")
+
+# a cache lock of another host older than this was left behind by a writer
+# that died
+_CACHE_LOCK_MAX_AGE = 120
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _cache_lock_is_stale(lock_file: str) -> bool:
+    """Whether the writer that holds *lock_file* is gone. The lock holds the
+    host and pid of the writer; a lock of this host is stale once its pid is
+    dead, a lock of another host once it is older than
+    ``_CACHE_LOCK_MAX_AGE`` seconds."""
+    try:
+        age = time.time() - os.path.getmtime(lock_file)
+        with open(lock_file, "r") as f:
+            owner = f.read().split()
+    except OSError:
+        # removed in the meantime
+        return False
+    if len(owner) == 2 and owner[0] == socket.gethostname():
+        return not _pid_alive(int(owner[1]))
+    return age > _CACHE_LOCK_MAX_AGE
+
+
+def _release_cache_lock(lock_file: str, owner: str):
+    """Remove *lock_file* unless it was taken over by another writer after
+    being considered stale."""
+    try:
+        with open(lock_file, "r") as f:
+            if f.read().strip() != owner:
+                return
+        os.remove(lock_file)
+    except FileNotFoundError:
+        pass
+
+
+def _remove_stale_cache_lock(lock_file: str):
+    logger.warning(f"removing stale block index cache lock {lock_file}")
+    try:
+        os.remove(lock_file)
+    except FileNotFoundError:
+        pass
 
 
 class TokenBlockDataset(FairseqDataset):
@@ -31,6 +93,9 @@ class TokenBlockDataset(FairseqDataset):
         document_sep_len (int, optional): document separator size (required for
             'complete_doc' break mode). Typically 1 if the sentences have eos
             and 0 otherwise.
+        cache_path (str, optional): if set, the block indices are saved to (or
+            loaded from) ``.npy`` files with this prefix, keyed by the block
+            arguments and a fingerprint of *sizes*, and memory-mapped from there.
     """
 
     def __init__(
@@ -46,6 +111,9 @@ class TokenBlockDataset(FairseqDataset):
         use_plasma_view=False,
         split_path=None,
         plasma_path=None,
+        use_shared_memory_view=False,
+        shared_memory_path=None,
+        cache_path=None,
     ):
 
         super().__init__()
@@ -57,9 +125,23 @@ class TokenBlockDataset(FairseqDataset):
         assert len(dataset) > 0
 
         assert len(dataset) == len(sizes)
-        _sizes, block_to_dataset_index, slice_indices = self._build_slice_indices(
-            sizes, break_mode, document_sep_len, block_size
-        )
+        cache_files, cached = None, None
+        if cache_path is not None:
+            cache_files = self._cache_files(
+                cache_path, sizes, break_mode, document_sep_len, block_size
+            )
+            cached = self._load_cached_slice_indices(cache_files)
+        if cached is not None:
+            _sizes, block_to_dataset_index, slice_indices = cached
+        else:
+            _sizes, block_to_dataset_index, slice_indices = self._build_slice_indices(
+                sizes, break_mode, document_sep_len, block_size
+            )
+            if cache_files is not None:
+                self._save_cached_slice_indices(
+                    cache_files, (_sizes, block_to_dataset_index, slice_indices)
+                )
+
         if use_plasma_view:
             plasma_id = (block_size, document_sep_len, str(break_mode), len(dataset))
             self._slice_indices = plasma_utils.PlasmaView(
@@ -74,12 +156,119 @@ class TokenBlockDataset(FairseqDataset):
                 (plasma_id, 2),
                 plasma_path=plasma_path,
             )
+        elif use_shared_memory_view:
+            # the sizes fingerprint keeps a dataset that was binarized again from
+            # mapping the indices of the previous one
+            view_id = (
+                block_size,
+                document_sep_len,
+                str(break_mode),
+                len(dataset),
+                self._sizes_fingerprint(
+                    sizes, break_mode, document_sep_len, block_size
+                ),
+            )
+            self._slice_indices = shared_memory_utils.SharedMemoryView(
+                slice_indices, split_path, (view_id, 0), shm_path=shared_memory_path
+            )
+            self._sizes = shared_memory_utils.SharedMemoryView(
+                _sizes, split_path, (view_id, 1), shm_path=shared_memory_path
+            )
+            self._block_to_dataset_index = shared_memory_utils.SharedMemoryView(
+                block_to_dataset_index,
+                split_path,
+                (view_id, 2),
+                shm_path=shared_memory_path,
+            )
+        elif cache_files is not None and os.path.exists(cache_files[-1]):
+            # workers map the cache files instead of receiving a copy
+            self._sizes, self._block_to_dataset_index, self._slice_indices = (
+                shared_memory_utils.SharedMemoryArray.from_file(path)
+                for path in cache_files
+            )
         else:
-            self._slice_indices = plasma_utils.PlasmaArray(slice_indices)
-            self._sizes = plasma_utils.PlasmaArray(_sizes)
-            self._block_to_dataset_index = plasma_utils.PlasmaArray(
-                block_to_dataset_index
+            self._slice_indices = shared_memory_utils.SharedMemoryArray(
+                slice_indices, shm_path=shared_memory_path
             )
+            self._sizes = shared_memory_utils.SharedMemoryArray(
+                _sizes, shm_path=shared_memory_path
+            )
+            self._block_to_dataset_index = shared_memory_utils.SharedMemoryArray(
+                block_to_dataset_index, shm_path=shared_memory_path
+            )
+
+    @staticmethod
+    def _sizes_fingerprint(sizes, break_mode, document_sep_len, block_size) -> str:
+        """Hash of *sizes* and the block arguments."""
+        if torch.is_tensor(sizes):
+            sizes = sizes.numpy()
+        sizes = np.ascontiguousarray(sizes, dtype=np.int64)
+        hash = hashlib.blake2b(sizes.view(np.uint8), digest_size=16)
+        hash.update(
+            json.dumps([block_size, str(break_mode), document_sep_len]).encode("utf-8")
+        )
+        return hash.hexdigest()
+
+    @staticmethod
+    def _cache_files(cache_path, sizes, break_mode, document_sep_len, block_size):
+        """Cache file names for the given block arguments and *sizes*."""
+        key = TokenBlockDataset._sizes_fingerprint(
+            sizes, break_mode, document_sep_len, block_size
+        )
+        return tuple(f"{cache_path}.blocks.{key}.{name}.npy" for name in _CACHED_ARRAYS)
+
+    @staticmethod
+    def _load_cached_slice_indices(
+        cache_files, wait_timeout=30
+    ) -> Optional[Tuple[np.ndarray]]:
+        lock_file = cache_files[-1] + ".lock"
+        start = time.time()
+        # another rank may be building the same cache
+        while os.path.exists(lock_file) and not os.path.exists(cache_files[-1]):
+            if _cache_lock_is_stale(lock_file):
+                _remove_stale_cache_lock(lock_file)
+                break
+            if time.time() - start > wait_timeout:
+                # build the indices locally rather than waiting any longer
+                break
+            time.sleep(0.5)
+        # the last file is written last, so the cache is complete if it exists
+        if not os.path.exists(cache_files[-1]):
+            return None
+        logger.info(f"loading block indices from {cache_files[-1]}")
+        return tuple(np.load(path, mmap_mode="r") for path in cache_files)
+
+    @staticmethod
+    def _save_cached_slice_indices(cache_files, arrays):
+        lock_file = cache_files[-1] + ".lock"
+        try:
+            fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not _cache_lock_is_stale(lock_file):
+                # another rank is writing the cache
+                return
+            _remove_stale_cache_lock(lock_file)
+            try:
+                fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError:
+                return
+        except OSError:
+            # the data directory is read-only
+            return
+        owner = f"{socket.gethostname()} {os.getpid()}"
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(f"{owner}\n")
+            for path, array in zip(cache_files, arrays):
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    np.save(f, array)
+                os.replace(tmp_path, path)
+            logger.info(f"saved block indices to {cache_files[-1]}")
+        except OSError as e:
+            logger.warning(f"could not save block indices to {cache_files[-1]}: {e}")
+        finally:
+            _release_cache_lock(lock_file, owner)
 
     @staticmethod
     def _build_slice_indices(
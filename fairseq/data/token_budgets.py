@@ -0,0 +1,279 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import logging
+
+import numpy as np
+
+from fairseq.data import data_utils
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBudgets(object):
+    """
+    Per-length-bucket token budgets for :class:`~fairseq.data.iterators.EpochBatchIterator`,
+    learned online from the step time and peak memory of the training steps.
+
+    Samples are assigned to up to *num_buckets* buckets by length, and every
+    bucket starts with a budget of *max_tokens*. Steps are reported to
+    :func:`observe`, and when the batches of the next epoch are built, each
+    bucket with at least *min_steps* steps adjusts its budget:
+
+    - it shrinks by *shrink* if a step ran out of memory or the peak memory
+      exceeded *memory_fraction* of *total_memory*, and never grows back past
+      a budget that ran out of memory;
+    - it reverts to its previous budget, and stops growing, if the last growth
+      lowered the throughput (tokens per second) by more than *tolerance*;
+    - otherwise it grows by *growth*, as long as the peak memory leaves room
+      for it.
+
+    Budgets stay within [*min_tokens*, *max_tokens_limit*]. The budgets an
+    epoch was built with only change with the epoch, so that every shard sees
+    the same batches and mid-epoch resumes rebuild them exactly. Each worker
+    observes its own steps; the caller shares their statistics with
+    :func:`reduce_stats` on every worker before the batches of the next epoch
+    are built, so that they all take the same decisions without a collective
+    per step.
+
+    Args:
+        max_tokens (int): initial budget of every bucket
+        min_tokens (int, optional): smallest budget (default: *max_tokens*).
+        max_tokens_limit (int, optional): largest budget
+            (default: *max_tokens*).
+        num_buckets (int, optional): number of length buckets (default: 8).
+        min_steps (int, optional): number of steps of a bucket needed to
+            adjust its budget (default: 10).
+        growth (float, optional): budget growth factor (default: 1.1).
+        shrink (float, optional): budget shrink factor (default: 0.8).
+        memory_fraction (float, optional): largest fraction of *total_memory*
+            to use (default: 0.9).
+        total_memory (int, optional): device memory in bytes, memory is
+            ignored if not set (default: None).
+        tolerance (float, optional): relative throughput loss that reverts a
+            growth (default: 0.02).
+        max_sentences (int, optional): max number of sentences in each batch
+            (default: None).
+        required_batch_size_multiple (int, optional): require batch size to
+            be less than N or a multiple of N (default: 1).
+    """
+
+    def __init__(
+        self,
+        max_tokens,
+        min_tokens=None,
+        max_tokens_limit=None,
+        num_buckets=8,
+        min_steps=10,
+        growth=1.1,
+        shrink=0.8,
+        memory_fraction=0.9,
+        total_memory=None,
+        tolerance=0.02,
+        max_sentences=None,
+        required_batch_size_multiple=1,
+    ):
+        assert max_tokens is not None, "dynamic token budgets need --max-tokens"
+        self.max_tokens = int(max_tokens)
+        self.min_tokens = int(min_tokens or max_tokens)
+        self.max_tokens_limit = int(max_tokens_limit or max_tokens)
+        assert self.min_tokens <= self.max_tokens <= self.max_tokens_limit
+        self.num_buckets = num_buckets
+        self.min_steps = min_steps
+        self.growth = growth
+        self.shrink = shrink
+        self.memory_fraction = memory_fraction
+        self.total_memory = total_memory
+        self.tolerance = tolerance
+        self.max_sentences = max_sentences
+        self.required_batch_size_multiple = required_batch_size_multiple
+
+        # upper length bound of each bucket, set from the data by init_buckets
+        self.bounds = None
+        # budgets of the current epoch's batches
+        self.epoch = None
+        self.budgets = None
+
+    def init_buckets(self, num_tokens_vec):
+        """Set the length buckets from the number of tokens of every sample,
+        unless they are already set (e.g. by :func:`load_state_dict`)."""
+        if self.bounds is not None:
+            return
+        self.bounds = data_utils.get_buckets(num_tokens_vec, self.num_buckets).astype(
+            np.int64
+        )
+        n = len(self.bounds)
+        self.budgets = np.full(n, self.max_tokens, dtype=np.int64)
+        self._prev_budgets = np.zeros(n, dtype=np.int64)
+        self._prev_throughput = np.zeros(n)
+        self._ceilings = np.full(n, self.max_tokens_limit, dtype=np.int64)
+        self._reset_stats()
+
+    def _reset_stats(self):
+        n = len(self.bounds)
+        self._steps = np.zeros(n, dtype=np.int64)
+        self._tokens = np.zeros(n, dtype=np.int64)
+        self._time = np.zeros(n)
+        self._peak_memory = np.zeros(n)
+        self._ooms = np.zeros(n, dtype=np.int64)
+        # (bucket, start, end) CUDA events of steps that may still be running
+        self._pending_times = []
+
+    def _collect_step_times(self, wait=False):
+        """Add the time of the pending steps that finished (or of all of them
+        with *wait*) to their buckets."""
+        pending = []
+        for b, start, end in self._pending_times:
+            if wait:
+                end.synchronize()
+            elif not end.query():
+                pending.append((b, start, end))
+                continue
+            self._time[b] += start.elapsed_time(end) / 1000
+        self._pending_times = pending
+
+    def reduce_stats(self, reduce_fn=None):
+        """Wait for the pending steps and, with *reduce_fn*, replace the
+        statistics of this worker by their maximum over all workers.
+        *reduce_fn* returns the element-wise maximum of a float64 array over
+        the workers; all of them must call this at the same point."""
+        self._collect_step_times(wait=True)
+        if self.bounds is None or reduce_fn is None:
+            return
+        stats = np.stack(
+            [self._steps, self._tokens, self._time, self._peak_memory, self._ooms]
+        )
+        stats = np.asarray(reduce_fn(stats.astype(np.float64)))
+        self._steps = stats[0].astype(np.int64)
+        self._tokens = stats[1].astype(np.int64)
+        self._time = stats[2]
+        self._peak_memory = stats[3]
+        self._ooms = stats[4].astype(np.int64)
+
+    def bucket(self, num_tokens):
+        """Return the bucket of samples (or batches) of *num_tokens* tokens."""
+        return np.minimum(
+            np.searchsorted(self.bounds, num_tokens, side="left"), len(self.bounds) - 1
+        )
+
+    def observe(self, num_tokens, batch_tokens, step_time, peak_memory=None, oom=False):
+        """Report a training step on batches of up to *num_tokens* tokens per
+        sample and *batch_tokens* tokens in total, which took *step_time*
+        seconds and *peak_memory* bytes. *step_time* can also be a pair of
+        :class:`torch.cuda.Event` recorded around the step, which are only
+        waited for when the budgets are adjusted."""
+        if self.bounds is None or num_tokens <= 0:
+            return
+        b = self.bucket(num_tokens)
+        if oom:
+            self._ooms[b] += 1
+            return
+        self._steps[b] += 1
+        self._tokens[b] += batch_tokens
+        if isinstance(step_time, tuple):
+            self._pending_times.append((b,) + step_time)
+            if len(self._pending_times) >= 64:
+                self._collect_step_times()
+        else:
+            self._time[b] += step_time
+        if peak_memory is not None:
+            self._peak_memory[b] = max(self._peak_memory[b], peak_memory)
+
+    def _adjust(self, b):
+        budget = self.budgets[b]
+        if self._ooms[b] > 0:
+            self._ceilings[b] = min(self._ceilings[b], budget - 1)
+            return budget * self.shrink
+        if self._steps[b] < self.min_steps:
+            return budget
+
+        throughput = self._tokens[b] / max(self._time[b], 1e-9)
+        memory = None
+        if self.total_memory and self._peak_memory[b] > 0:
+            memory = self._peak_memory[b] / self.total_memory
+        prev_budget, prev_throughput = self._prev_budgets[b], self._prev_throughput[b]
+        self._prev_budgets[b], self._prev_throughput[b] = budget, throughput
+
+        if memory is not None and memory > self.memory_fraction:
+            return budget * self.shrink
+        if prev_budget < budget and throughput < prev_throughput * (1 - self.tolerance):
+            # growing made this bucket slower, go back and stay there
+            self._ceilings[b] = prev_budget
+            self._prev_budgets[b], self._prev_throughput[b] = 0, 0.0
+            return prev_budget
+        if memory is None or memory * self.growth <= self.memory_fraction:
+            return budget * self.growth
+        return budget
+
+    def budgets_for_epoch(self, epoch):
+        """Return the budget of every bucket for the batches of *epoch*,
+        adjusting them with the steps observed since the previous epoch."""
+        if self.epoch is not None and epoch != self.epoch:
+            self._collect_step_times(wait=True)
+            budgets = np.array([self._adjust(b) for b in range(len(self.bounds))])
+            budgets = np.minimum(budgets.astype(np.int64), self._ceilings)
+            budgets = budgets.clip(self.min_tokens, self.max_tokens_limit)
+            if not np.array_equal(budgets, self.budgets):
+                logger.info(
+                    f"token budgets for epoch {epoch}: "
+                    + ", ".join(
+                        f"<={bound}: {budget}"
+                        for bound, budget in zip(self.bounds, budgets)
+                    )
+                )
+            self.budgets = budgets
+            self._reset_stats()
+        self.epoch = epoch
+        return self.budgets
+
+    def batch(self, batches, num_tokens_vec, epoch):
+        """Regroup *batches*, whose samples are ordered by size, into batches
+        that follow the budgets of *epoch*. *num_tokens_vec* gives the number
+        of tokens of each sample of the concatenated batches."""
+        budgets = self.budgets_for_epoch(epoch)
+        indices = np.concatenate([np.asarray(b, dtype=np.int64) for b in batches])
+        num_tokens_vec = np.asarray(num_tokens_vec, dtype=np.int64)
+        max_tokens = np.maximum(budgets[self.bucket(num_tokens_vec)], num_tokens_vec)
+        return data_utils.batch_by_size_vec_numpy(
+            indices,
+            num_tokens_vec,
+            max_tokens,
+            self.max_sentences if self.max_sentences is not None else -1,
+            self.required_batch_size_multiple,
+        )
+
+    def state_dict(self):
+        if self.bounds is None:
+            return {}
+        self._collect_step_times(wait=True)
+        return {
+            "bounds": self.bounds.tolist(),
+            "epoch": self.epoch,
+            "budgets": self.budgets.tolist(),
+            "prev_budgets": self._prev_budgets.tolist(),
+            "prev_throughput": self._prev_throughput.tolist(),
+            "ceilings": self._ceilings.tolist(),
+            "steps": self._steps.tolist(),
+            "tokens": self._tokens.tolist(),
+            "time": self._time.tolist(),
+            "peak_memory": self._peak_memory.tolist(),
+            "ooms": self._ooms.tolist(),
+        }
+
+    def load_state_dict(self, state_dict):
+        if not state_dict:
+            return
+        self.bounds = np.array(state_dict["bounds"], dtype=np.int64)
+        self.epoch = state_dict["epoch"]
+        self.budgets = np.array(state_dict["budgets"], dtype=np.int64)
+        self._prev_budgets = np.array(state_dict["prev_budgets"], dtype=np.int64)
+        self._prev_throughput = np.array(state_dict["prev_throughput"])
+        self._ceilings = np.array(state_dict["ceilings"], dtype=np.int64)
+        self._steps = np.array(state_dict["steps"], dtype=np.int64)
+        self._tokens = np.array(state_dict["tokens"], dtype=np.int64)
+        self._time = np.array(state_dict["time"])
+        self._peak_memory = np.array(state_dict["peak_memory"])
+        self._ooms = np.array(state_dict["ooms"], dtype=np.int64)
+        self._pending_times = []
@@ -18,6 +18,9 @@ from fairseq.dataclass.constants import (
     GENERATION_CONSTRAINTS_CHOICES,
     GENERATION_DECODING_FORMAT_CHOICES,
     LOG_FORMAT_CHOICES,
+    MMAP_WARMUP_CHOICES,
+    BATCHING_STRATEGY_CHOICES,
+    DATA_BUFFER_BACKEND_CHOICES,
     PIPELINE_CHECKPOINT_CHOICES,
     PRINT_ALIGNMENT_CHOICES,
     ZERO_SHARDING_CHOICES,
@@ -250,6 +253,20 @@ class CommonConfig(FairseqDataclass):
             "help": "path to run plasma_store, defaults to /tmp/plasma. Paths outside /tmp tend to fail."
         },
     )
+    use_shared_memory_view: bool = field(
+        default=False,
+        metadata={
+            "help": "Store indices and sizes in shared memory files that all ranks "
+            "and workers on a node map, without a plasma store"
+        },
+    )
+    shared_memory_path: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "directory for shared memory files, defaults to /dev/shm "
+            "(or the temp directory if /dev/shm does not exist)"
+        },
+    )
 
 
 @dataclass
@@ -488,12 +505,111 @@ class DatasetConfig(FairseqDataclass):
             "help": "maximum sequence length in batch will be a multiplier of this value"
         },
     )
+    batching_strategy: BATCHING_STRATEGY_CHOICES = field(
+        default="greedy",
+        metadata={
+            "help": "how training batches are formed: greedily in the order of "
+            "the dataset, or grouped into length buckets (per source and target "
+            "length) chosen to minimize padding"
+        },
+    )
+    padding_buckets: int = field(
+        default=8,
+        metadata={
+            "help": "number of length buckets per size column with "
+            "--batching-strategy min_padding"
+        },
+    )
+    dynamic_batching: bool = field(
+        default=False,
+        metadata={
+            "help": "learn the token budget of training batches per length bucket, "
+            "starting at --max-tokens, from the step time and peak memory of "
+            "training; budgets are updated when the batches of an epoch are built"
+        },
+    )
+    dynamic_batching_min_tokens: Optional[int] = field(
+        default=None,
+        metadata={
+            "help": "smallest token budget of --dynamic-batching "
+            "(default: half of --max-tokens)"
+        },
+    )
+    dynamic_batching_max_tokens: Optional[int] = field(
+        default=None,
+        metadata={
+            "help": "largest token budget of --dynamic-batching "
+            "(default: twice --max-tokens)"
+        },
+    )
+    dynamic_batching_buckets: int = field(
+        default=8,
+        metadata={"help": "number of length buckets of --dynamic-batching"},
+    )
+    dynamic_batching_memory_fraction: float = field(
+        default=0.9,
+        metadata={
+            "help": "largest fraction of the device memory --dynamic-batching "
+            "may use at peak"
+        },
+    )
+    streaming_cache_dir: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "local directory for the shards of --streaming datasets "
+            "(default: a directory in the system's temporary directory)"
+        },
+    )
+    streaming_cache_mb: int = field(
+        default=10240,
+        metadata={
+            "help": "size of --streaming-cache-dir in MB, least recently used "
+            "shards are removed beyond it"
+        },
+    )
+    streaming_shuffle_buffer: int = field(
+        default=10000,
+        metadata={
+            "help": "number of items --streaming datasets shuffle across, "
+            "1 to read them in order"
+        },
+    )
     dataset_impl: Optional[DATASET_IMPL_CHOICES] = field(
         default=None, metadata={"help": "output dataset implementation"}
     )
+    dataset_native_dtype: bool = field(
+        default=False,
+        metadata={
+            "help": "keep tokens of mmap datasets in their stored dtype (e.g. uint16) "
+            "as zero-copy views and only widen them to int64 on the training device"
+        },
+    )
+    mmap_warmup: MMAP_WARMUP_CHOICES = field(
+        default="full",
+        metadata={
+            "help": "how mmap datasets are brought into the page cache when opened: "
+            "read both files, the index only, the data in a background thread, "
+            "madvise the ranges of upcoming batches, or nothing"
+        },
+    )
     data_buffer_size: int = field(
         default=10, metadata={"help": "Number of batches to preload"}
     )
+    data_buffer_backend: DATA_BUFFER_BACKEND_CHOICES = field(
+        default="thread",
+        metadata={
+            "help": "how training batches are preloaded: 'thread' uses a background "
+            "thread, 'process' loads and collates them in a separate process and "
+            "hands them over through a ring of shared (and pinned, on GPU) memory"
+        },
+    )
+    data_buffer_slot_mb: int = field(
+        default=16,
+        metadata={
+            "help": "size of each shared memory slot of --data-buffer-backend "
+            "process, larger batches are sent through a queue instead"
+        },
+    )
     train_subset: str = field(
         default="train",
         metadata={"help": "data subset to use for training (e.g. train, valid, test)"},
@@ -766,6 +882,14 @@ class CheckpointConfig(FairseqDataclass):
             "(default: only load on rank 0 and broadcast to other devices)"
         },
     )
+    save_epoch_batches: bool = field(
+        default=False,
+        metadata={
+            "help": "save the batch order of each epoch to a memory-mapped file "
+            "per data parallel rank in --save-dir, so that resuming mid-epoch "
+            "does not rebuild and reshuffle the batches"
+        },
+    )
     write_checkpoints_asynchronously: bool = field(
         default=False,
         metadata={
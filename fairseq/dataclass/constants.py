@@ -46,7 +46,12 @@ DDP_BACKEND_CHOICES = ChoiceEnum(
     ]
 )
 DDP_COMM_HOOK_CHOICES = ChoiceEnum(["none", "fp16"])
-DATASET_IMPL_CHOICES = ChoiceEnum(["raw", "lazy", "cached", "mmap", "fasta", "huffman"])
+DATASET_IMPL_CHOICES = ChoiceEnum(
+    ["raw", "lazy", "cached", "mmap", "fasta", "huffman", "compressed"]
+)
+MMAP_WARMUP_CHOICES = ChoiceEnum(["full", "index", "background", "madvise", "none"])
+BATCHING_STRATEGY_CHOICES = ChoiceEnum(["greedy", "min_padding"])
+DATA_BUFFER_BACKEND_CHOICES = ChoiceEnum(["thread", "process"])
 GENERATION_CONSTRAINTS_CHOICES = ChoiceEnum(["ordered", "unordered"])
 GENERATION_DECODING_FORMAT_CHOICES = ChoiceEnum(
     ["unigram", "ensemble", "vote", "dp", "bs"]
@@ -3,9 +3,49 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import gzip
+import io
+import lzma
 import os
+import sys
 import typing as tp
 
+# inputs that can only be read sequentially, see is_stream()
+_STREAM_SUFFIXES = (".gz", ".xz", ".zst")
+
+
+def is_stream(path: str) -> bool:
+    """
+    whether *path* is stdin ("-") or a compressed file, which can only be read
+    from start to end in a single chunk
+    """
+    return path == "-" or path.endswith(_STREAM_SUFFIXES)
+
+
+def open_stream(path: str) -> tp.TextIO:
+    """
+    open stdin ("-") or a gzip, xz or zstd compressed file for reading text
+    """
+    if path == "-":
+        return open(sys.stdin.fileno(), "r", encoding="utf-8", closefd=False)
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".xz"):
+        return lzma.open(path, "rt", encoding="utf-8")
+    if path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(
+                "Please install zstandard to read zstd compressed inputs: "
+                "pip install zstandard"
+            )
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            open(path, "rb"), read_across_frames=True, closefd=True
+        )
+        return io.TextIOWrapper(reader, encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
 
 def _safe_readline(fd) -> str:
     pos = fd.tell()
@@ -20,8 +60,11 @@ def _safe_readline(fd) -> str:
 def find_offsets(filename: str, num_chunks: int) -> tp.List[int]:
     """
     given a file and a number of chuncks, find the offsets in the file
-    to be able to chunk around full lines.
+    to be able to chunk around full lines. Streams (see is_stream()) are
+    read in a single chunk, [0, -1].
     """
+    if is_stream(filename):
+        return [0, -1]
     with open(filename, "r", encoding="utf-8") as f:
         size = os.fstat(f.fileno()).st_size
         chunk_size = size // num_chunks
@@ -68,7 +111,8 @@ class ChunkLineIterator:
 
 class Chunker:
     """
-    contextmanager to read a chunck of a file line by line.
+    contextmanager to read a chunck of a file line by line. Streams (see
+    is_stream()) can only be read as a whole, from offset 0 to -1.
     """
 
     def __init__(self, path: str, start_offset: int, end_offset: int):
@@ -76,7 +120,13 @@ class Chunker:
         self.start_offset = start_offset
         self.end_offset = end_offset
 
-    def __enter__(self) -> ChunkLineIterator:
+    def __enter__(self) -> tp.Iterable[str]:
+        if is_stream(self.path):
+            assert (
+                self.start_offset == 0 and self.end_offset <= 0
+            ), f"{self.path} can only be read as a whole"
+            self.fd = open_stream(self.path)
+            return self.fd
         self.fd = open(self.path, "r", encoding="utf-8")
         return ChunkLineIterator(self.fd, self.start_offset, self.end_offset)
 
@@ -15,7 +15,7 @@ from omegaconf import open_dict
 from torch import nn
 
 from fairseq import utils
-from fairseq.data import encoders
+from fairseq.data import Dictionary, encoders
 
 logger = logging.getLogger(__name__)
 
@@ -140,7 +140,7 @@ class GeneratorHubInterface(nn.Module):
     ) -> List[str]:
         if isinstance(sentences, str):
             return self.sample([sentences], beam=beam, verbose=verbose, **kwargs)[0]
-        tokenized_sentences = [self.encode(sentence) for sentence in sentences]
+        tokenized_sentences = self.encode_batch(sentences)
         batched_hypos = self.generate(tokenized_sentences, beam, verbose, **kwargs)
         return [self.decode(hypos[0]["tokens"]) for hypos in batched_hypos]
 
@@ -248,6 +248,21 @@ class GeneratorHubInterface(nn.Module):
         sentence = self.apply_bpe(sentence)
         return self.binarize(sentence)
 
+    def encode_batch(
+        self, sentences: List[str], num_workers: int = 1
+    ) -> List[torch.LongTensor]:
+        """Encode several sentences, binarizing them at once. BPEs with an
+        ``encode_batch`` (e.g. GPT-2) use *num_workers* processes."""
+        if type(self).encode is not GeneratorHubInterface.encode:
+            # subclasses encode differently
+            return [self.encode(sentence) for sentence in sentences]
+        sentences = [self.tokenize(sentence) for sentence in sentences]
+        if hasattr(self.bpe, "encode_batch"):
+            sentences = self.bpe.encode_batch(sentences, num_workers=num_workers)
+        else:
+            sentences = [self.apply_bpe(sentence) for sentence in sentences]
+        return self.binarize_batch(sentences)
+
     def decode(self, tokens: torch.LongTensor) -> str:
         sentence = self.string(tokens)
         sentence = self.remove_bpe(sentence)
@@ -276,6 +291,17 @@ class GeneratorHubInterface(nn.Module):
     def binarize(self, sentence: str) -> torch.LongTensor:
         return self.src_dict.encode_line(sentence, add_if_not_exist=False).long()
 
+    def binarize_batch(self, sentences: List[str]) -> List[torch.LongTensor]:
+        if type(self.src_dict).encode_line is not Dictionary.encode_line:
+            # subclasses of Dictionary may encode lines differently
+            return [self.binarize(sentence) for sentence in sentences]
+        tokens, offsets = self.src_dict.encode_lines(sentences, add_if_not_exist=False)
+        tokens = torch.from_numpy(tokens).long()
+        return [
+            tokens[start:end]
+            for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())
+        ]
+
     def string(self, tokens: torch.LongTensor) -> str:
         return self.tgt_dict.string(tokens)
 
@@ -0,0 +1,115 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Debug tracing of the model and generator internals.
+
+Tracing is off unless the ``FAIRSEQ_TRACE`` environment variable is set or
+:func:`enable` is called. Call sites in hot loops check the module-level flag
+before doing anything, so that disabled tracing costs a single attribute
+lookup::
+
+    from fairseq.logging import trace
+
+    if trace.ENABLED:
+        trace.event("encoder layer %d", idx)
+
+Events are logged at DEBUG level by the ``fairseq.trace`` logger with lazy
+%-style formatting. With a ring buffer (``FAIRSEQ_TRACE_BUFFER=N``), the last
+N events are also kept in memory and logged at ERROR level when an exception
+leaves a :func:`span`, even if DEBUG logging is off. Spans are also recorded
+by :mod:`torch.autograd.profiler`.
+"""
+
+import collections
+import contextlib
+import logging
+import os
+import time
+from typing import Deque, Optional, Tuple
+
+import torch
+
+logger = logging.getLogger("fairseq.trace")
+
+ENABLED: bool = bool(os.environ.get("FAIRSEQ_TRACE"))
+
+_buffer: Optional[Deque[Tuple[float, str, tuple]]] = None
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+def enable(buffer_size: int = 0):
+    """Turn tracing on, keeping the last *buffer_size* events in memory."""
+    global ENABLED, _buffer
+    ENABLED = True
+    _buffer = collections.deque(maxlen=buffer_size) if buffer_size > 0 else None
+
+
+def disable():
+    global ENABLED, _buffer
+    ENABLED = False
+    _buffer = None
+
+
+def event(msg: str, *args):
+    """Record an event, formatted as ``msg % args`` only if it is logged."""
+    if not ENABLED:
+        return
+    if _buffer is not None:
+        _buffer.append((time.time(), msg, args))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(msg, *args)
+
+
+def dump():
+    """Log the events in the ring buffer, oldest first, and clear it."""
+    if not _buffer:
+        return
+    lines = []
+    while _buffer:
+        timestamp, msg, args = _buffer.popleft()
+        try:
+            msg = msg % args
+        except Exception:
+            msg = f"{msg} {args}"
+        lines.append(f"{timestamp:.6f} {msg}")
+    logger.error("last %d trace events:\n%s", len(lines), "\n".join(lines))
+
+
+def span(name: str):
+    """Context manager around a traced region, shown as *name* by the
+    profiler. Does nothing while tracing is disabled."""
+    if not ENABLED:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+class _Span(object):
+    def __init__(self, name: str):
+        self.name = name
+        self.record = torch.autograd.profiler.record_function(name)
+
+    def __enter__(self):
+        event("begin %s", self.name)
+        self.record.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.record.__exit__(exc_type, exc, tb)
+        if exc is None:
+            event("end %s", self.name)
+        elif not getattr(exc, "_fairseq_trace_dumped", False):
+            event("error in %s: %r", self.name, exc)
+            dump()
+            try:
+                exc._fairseq_trace_dumped = True
+            except AttributeError:
+                pass
+        return False
+
+
+if ENABLED:
+    enable(int(os.environ.get("FAIRSEQ_TRACE_BUFFER", 0)))
@@ -580,6 +580,7 @@ class RobertaEncoder(FairseqEncoder):
         features_only=False,
         return_all_hiddens=False,
         masked_tokens=None,
+        segment_ids=None,
         **unused,
     ):
         """
@@ -590,6 +591,8 @@ class RobertaEncoder(FairseqEncoder):
                 `(batch, src_len, embed_dim)`.
             return_all_hiddens (bool, optional): also return all of the
                 intermediate hidden states (default: False).
+            segment_ids (LongTensor, optional): index of the packed sequence
+                each token belongs to, of shape `(batch, src_len)`
 
         Returns:
             tuple:
@@ -599,7 +602,7 @@ class RobertaEncoder(FairseqEncoder):
                   states have shape `(src_len, batch, vocab)`.
         """
         x, extra = self.extract_features(
-            src_tokens, return_all_hiddens=return_all_hiddens
+            src_tokens, return_all_hiddens=return_all_hiddens, segment_ids=segment_ids
         )
         if not features_only:
             x = self.output_layer(x, masked_tokens=masked_tokens)
@@ -610,6 +613,7 @@ class RobertaEncoder(FairseqEncoder):
             src_tokens,
             return_all_hiddens=return_all_hiddens,
             token_embeddings=kwargs.get("token_embeddings", None),
+            segment_ids=kwargs.get("segment_ids", None),
         )
         # T x B x C -> B x T x C
         features = encoder_out["encoder_out"][0].transpose(0, 1)
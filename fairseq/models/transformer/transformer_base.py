@@ -140,6 +140,17 @@ class TransformerModelBase(FairseqEncoderDecoderModel):
             no_encoder_attn=cfg.no_cross_attention,
         )
 
+    @torch.jit.unused
+    def attention_probes(
+        self,
+        layers: Optional[List[int]] = None,
+        heads: Optional[List[int]] = None,
+        reduce: str = "none",
+    ):
+        """Capture the self-attention weights of some encoder layers, see
+        :func:`TransformerEncoderBase.attention_probes`."""
+        return self.encoder.attention_probes(layers, heads, reduce)
+
     # TorchScript doesn't support optional arguments with variable length (**kwargs).
     # Current workaround is to add union of all arguments in child classes.
     def forward(
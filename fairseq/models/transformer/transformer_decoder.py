@@ -12,6 +12,7 @@ from torch import Tensor
 
 from fairseq import utils
 from fairseq.distributed import fsdp_wrap
+from fairseq.logging import trace
 from fairseq.models import FairseqIncrementalDecoder
 from fairseq.models.transformer import TransformerConfig
 from fairseq.modules import (
@@ -194,6 +195,7 @@ class TransformerDecoderBase(FairseqIncrementalDecoder):
         alignment_heads: Optional[int] = None,
         src_lengths: Optional[Any] = None,
         return_all_hiddens: bool = False,
+        segment_ids: Optional[Tensor] = None,
     ):
         """
         Args:
@@ -207,6 +209,11 @@ class TransformerDecoderBase(FairseqIncrementalDecoder):
                 applying output layer (default: False).
             full_context_alignment (bool, optional): don't apply
                 auto-regressive mask to self-attention (default: False).
+            segment_ids (LongTensor, optional): for rows that pack several
+                sequences, the index of the sequence each token belongs to,
+                of shape `(batch, tgt_len)` and -1 for padding. Positions
+                restart and self-attention is restricted within each
+                sequence. Not supported with *incremental_state*.
 
         Returns:
             tuple:
@@ -214,14 +221,26 @@ class TransformerDecoderBase(FairseqIncrementalDecoder):
                 - a dictionary with any model-specific outputs
         """
 
-        x, extra = self.extract_features(
-            prev_output_tokens,
-            encoder_out=encoder_out,
-            incremental_state=incremental_state,
-            full_context_alignment=full_context_alignment,
-            alignment_layer=alignment_layer,
-            alignment_heads=alignment_heads,
-        )
+        if segment_ids is None:
+            x, extra = self.extract_features(
+                prev_output_tokens,
+                encoder_out=encoder_out,
+                incremental_state=incremental_state,
+                full_context_alignment=full_context_alignment,
+                alignment_layer=alignment_layer,
+                alignment_heads=alignment_heads,
+            )
+        else:
+            # only passed when set, subclasses may override extract_features
+            x, extra = self.extract_features(
+                prev_output_tokens,
+                encoder_out=encoder_out,
+                incremental_state=incremental_state,
+                full_context_alignment=full_context_alignment,
+                alignment_layer=alignment_layer,
+                alignment_heads=alignment_heads,
+                segment_ids=segment_ids,
+            )
 
         if not features_only:
             x = self.output_layer(x)
@@ -235,6 +254,7 @@ class TransformerDecoderBase(FairseqIncrementalDecoder):
         full_context_alignment: bool = False,
         alignment_layer: Optional[int] = None,
         alignment_heads: Optional[int] = None,
+        segment_ids: Optional[Tensor] = None,
     ):
         return self.extract_features_scriptable(
             prev_output_tokens,
@@ -243,6 +263,7 @@ class TransformerDecoderBase(FairseqIncrementalDecoder):
             full_context_alignment,
             alignment_layer,
             alignment_heads,
+            segment_ids,
         )
 
     """
@@ -259,6 +280,7 @@ class TransformerDecoderBase(FairseqIncrementalDecoder):
         full_context_alignment: bool = False,
         alignment_layer: Optional[int] = None,
         alignment_heads: Optional[int] = None,
+        segment_ids: Optional[Tensor] = None,
     ):
         """
         Similar to *forward* but only return features.
@@ -273,6 +295,8 @@ class TransformerDecoderBase(FairseqIncrementalDecoder):
                 heads at this layer (default: last layer).
             alignment_heads (int, optional): only average alignment over
                 this many heads (default: all heads).
+            segment_ids (LongTensor, optional): index of the packed sequence
+                each token belongs to, of shape `(batch, tgt_len)`
 
         Returns:
             tuple:
@@ -290,11 +314,21 @@ class TransformerDecoderBase(FairseqIncrementalDecoder):
         if encoder_out is not None and len(encoder_out["encoder_padding_mask"]) > 0:
             padding_mask = encoder_out["encoder_padding_mask"][0]
 
+        if incremental_state is not None:
+            assert segment_ids is None, "segment_ids require full sequences"
+
         # embed positions
         positions = None
         if self.embed_positions is not None:
+            segment_positions: Optional[Tensor] = None
+            if segment_ids is not None:
+                segment_positions = utils.make_segment_positions(
+                    segment_ids, self.padding_idx
+                )
             positions = self.embed_positions(
-                prev_output_tokens, incremental_state=incremental_state
+                prev_output_tokens,
+                incremental_state=incremental_state,
+                positions=segment_positions,
             )
 
         if incremental_state is not None:
@@ -328,6 +362,13 @@ class TransformerDecoderBase(FairseqIncrementalDecoder):
         if self.cross_self_attention or prev_output_tokens.eq(self.padding_idx).any():
             self_attn_padding_mask = prev_output_tokens.eq(self.padding_idx)
 
+        # keep packed sequences from attending to each other
+        segment_mask: Optional[Tensor] = None
+        if segment_ids is not None:
+            segment_mask = x.new_zeros(bs, slen, slen).masked_fill(
+                utils.make_segment_attention_mask(segment_ids), float("-inf")
+            )
+
         # decoder layers
         attn: Optional[Tensor] = None
         inner_states: List[Optional[Tensor]] = [x]
@@ -336,7 +377,13 @@ class TransformerDecoderBase(FairseqIncrementalDecoder):
                 self_attn_mask = self.buffered_future_mask(x)
             else:
                 self_attn_mask = None
-            print(f'[DEBUG] now Decoder layer{idx}')
+            if segment_mask is not None:
+                if self_attn_mask is None:
+                    self_attn_mask = segment_mask
+                else:
+                    self_attn_mask = self_attn_mask.unsqueeze(0) + segment_mask
+            if not torch.jit.is_scripting() and trace.ENABLED:
+                trace.event("decoder layer %d", idx)
             x, layer_attn, _ = layer(
                 x,
                 enc,
@@ -12,9 +12,11 @@ from torch import Tensor
 
 from fairseq import utils
 from fairseq.distributed import fsdp_wrap
+from fairseq.logging import trace
 from fairseq.models import FairseqEncoder
 from fairseq.models.transformer import TransformerConfig
 from fairseq.modules import (
+    AttentionProbe,
     FairseqDropout,
     LayerDropModuleList,
     LayerNorm,
@@ -96,6 +98,8 @@ class TransformerEncoderBase(FairseqEncoder):
             [self.build_encoder_layer(cfg) for i in range(cfg.encoder.layers)]
         )
         self.num_layers = len(self.layers)
+        # see attention_probes()
+        self._attention_probes: Dict[int, AttentionProbe] = {}
 
         if cfg.encoder.normalize_before:
             self.layer_norm = LayerNorm(embed_dim, export=cfg.export)
@@ -116,15 +120,43 @@ class TransformerEncoderBase(FairseqEncoder):
         layer = fsdp_wrap(layer, min_num_params=min_params_to_wrap)
         return layer
 
+    def attention_probes(
+        self,
+        layers: Optional[List[int]] = None,
+        heads: Optional[List[int]] = None,
+        reduce: str = "none",
+    ) -> AttentionProbe:
+        """Capture the self-attention weights of *layers* until the returned
+        :class:`~fairseq.modules.AttentionProbe` is removed."""
+        return AttentionProbe(self._attention_probes, layers, heads, reduce)
+
+    @torch.jit.unused
+    def _probed_layers(self) -> List[int]:
+        probes = getattr(self, "_attention_probes", {}).values()
+        return [
+            idx
+            for idx in range(self.num_layers)
+            if any(probe.wants(idx) for probe in probes)
+        ]
+
+    @torch.jit.unused
+    def _capture_attention(self, idx: int, attn: Tensor):
+        for probe in list(self._attention_probes.values()):
+            if probe.wants(idx):
+                probe.capture(idx, attn)
+
     def forward_embedding(
-        self, src_tokens, token_embedding: Optional[torch.Tensor] = None
+        self,
+        src_tokens,
+        token_embedding: Optional[torch.Tensor] = None,
+        positions: Optional[torch.Tensor] = None,
     ):
         # embed tokens and positions
         if token_embedding is None:
             token_embedding = self.embed_tokens(src_tokens)
         x = embed = self.embed_scale * token_embedding
         if self.embed_positions is not None:
-            x = embed + self.embed_positions(src_tokens)
+            x = embed + self.embed_positions(src_tokens, positions=positions)
         if self.layernorm_embedding is not None:
             x = self.layernorm_embedding(x)
         x = self.dropout_module(x)
@@ -139,6 +171,7 @@ class TransformerEncoderBase(FairseqEncoder):
         return_all_hiddens: bool = False,
         return_all_attn: bool = False,  # de9uch1
         token_embeddings: Optional[torch.Tensor] = None,
+        segment_ids: Optional[torch.Tensor] = None,
     ):
         """
         Args:
@@ -150,8 +183,13 @@ class TransformerEncoderBase(FairseqEncoder):
                 intermediate hidden states (default: False).
             return_all_attn (bool, optional): also return all of the    # de9uch1
                 intermediate layers' attention weights (default: False).   # de9uch1
+                See :func:`attention_probes` to capture only some layers.
             token_embeddings (torch.Tensor, optional): precomputed embeddings
                 default `None` will recompute embeddings
+            segment_ids (LongTensor, optional): for rows that pack several
+                sequences, the index of the sequence each token belongs to,
+                of shape `(batch, src_len)` and -1 for padding. Positions
+                restart and attention is restricted within each sequence.
 
         Returns:
             dict:
@@ -169,7 +207,7 @@ class TransformerEncoderBase(FairseqEncoder):
                   Only populated if *return_all_attn* is True.
         """
         return self.forward_scriptable(
-            src_tokens, src_lengths, return_all_hiddens, return_all_attn, token_embeddings  # Stanley
+            src_tokens, src_lengths, return_all_hiddens, return_all_attn, token_embeddings, segment_ids  # Stanley
         )
 
     # TorchScript doesn't support super() method so that the scriptable Subclass
@@ -181,8 +219,9 @@ class TransformerEncoderBase(FairseqEncoder):
         src_tokens,
         src_lengths: Optional[torch.Tensor] = None,
         return_all_hiddens: bool = False,
-        return_all_attn: bool = True,  # Stanley
+        return_all_attn: bool = False,
         token_embeddings: Optional[torch.Tensor] = None,
+        segment_ids: Optional[torch.Tensor] = None,
     ):
         """
         Args:
@@ -194,6 +233,8 @@ class TransformerEncoderBase(FairseqEncoder):
                 intermediate hidden states (default: False).
             token_embeddings (torch.Tensor, optional): precomputed embeddings
                 default `None` will recompute embeddings
+            segment_ids (LongTensor, optional): index of the packed sequence
+                each token belongs to, of shape `(batch, src_len)`
 
         Returns:
             dict:
@@ -207,7 +248,6 @@ class TransformerEncoderBase(FairseqEncoder):
                   hidden states of shape `(src_len, batch, embed_dim)`.
                   Only populated if *return_all_hiddens* is True.
         """
-        return_all_attn = True  # Stanley: Forcing return_all_attn
         # compute padding mask
         encoder_padding_mask = src_tokens.eq(self.padding_idx)
         has_pads = (
@@ -217,7 +257,18 @@ class TransformerEncoderBase(FairseqEncoder):
         if torch.jit.is_scripting():
             has_pads = torch.tensor(1) if has_pads else torch.tensor(0)
 
-        x, encoder_embedding = self.forward_embedding(src_tokens, token_embeddings)
+        positions: Optional[torch.Tensor] = None
+        if segment_ids is not None:
+            positions = utils.make_segment_positions(segment_ids, self.padding_idx)
+
+        x, encoder_embedding = self.forward_embedding(
+            src_tokens, token_embeddings, positions
+        )
+
+        # the layers turn ones into large negative values
+        attn_mask: Optional[torch.Tensor] = None
+        if segment_ids is not None:
+            attn_mask = utils.make_segment_attention_mask(segment_ids).type_as(x)
 
         # account for padding while computing the representation
         x = x * (
@@ -233,14 +284,23 @@ class TransformerEncoderBase(FairseqEncoder):
         if return_all_hiddens:
             encoder_states.append(x)
 
+        # layers whose attention weights are needed, the others can use the
+        # fused attention implementations
+        probed_layers: List[int] = []
+        if not torch.jit.is_scripting():
+            probed_layers = self._probed_layers()
+
         # encoder layers
         encoder_attn = []  # Stanley: container for encoder_attn
         for layernumber, layer in enumerate(self.layers):
-            print(f'[DEBUG] Now encoder layer #{layernumber}')
+            if not torch.jit.is_scripting() and trace.ENABLED:
+                trace.event("encoder layer %d", layernumber)
+            probed = layernumber in probed_layers
             lr, attn = layer(
                 x,
                 encoder_padding_mask=encoder_padding_mask if has_pads else None,
-                need_head_weights=True  # Stanley
+                attn_mask=attn_mask,
+                need_head_weights=return_all_attn or probed,
             )
 
             if isinstance(lr, tuple) and len(lr) == 2:
@@ -259,6 +319,8 @@ class TransformerEncoderBase(FairseqEncoder):
                 assert encoder_attn is not None
                 encoder_attn.append(attn)
             """End addition"""
+            if probed and attn is not None and not torch.jit.is_scripting():
+                self._capture_attention(layernumber, attn)
 
         if self.layer_norm is not None:
             x = self.layer_norm(x)
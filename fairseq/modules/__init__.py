@@ -6,6 +6,7 @@
 
 from .adaptive_input import AdaptiveInput
 from .adaptive_softmax import AdaptiveSoftmax
+from .attention_probe import AttentionProbe
 from .base_layer import BaseLayer
 from .beamable_mm import BeamableMM
 from .character_token_embedder import CharacterTokenEmbedder
@@ -54,6 +55,7 @@ from .positional_encoding import (
 __all__ = [
     "AdaptiveInput",
     "AdaptiveSoftmax",
+    "AttentionProbe",
     "BaseLayer",
     "BeamableMM",
     "CharacterTokenEmbedder",
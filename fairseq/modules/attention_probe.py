@@ -0,0 +1,88 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import itertools
+from typing import Dict, Iterable, List, Optional
+
+import torch
+from torch import Tensor
+
+REDUCTIONS = ("none", "mean_heads", "max_heads")
+
+_probe_ids = itertools.count()
+
+
+class AttentionProbe:
+    """Captures the self-attention weights of some layers of a model on each
+    forward pass, until it is removed.
+
+    Layers only compute their attention weights while a probe asks for them,
+    otherwise they use the fused attention implementations. Probes are
+    registered with ``model.attention_probes(...)`` and can be used as
+    context managers::
+
+        with model.attention_probes(layers=[0, 5], reduce="mean_heads") as probe:
+            model(**net_input)
+        attn = probe.attn[5]  # batch x tgt_len x src_len
+
+    Args:
+        probes (dict): the registry of the module, keyed by probe id
+        layers (List[int], optional): layers to capture (default: all)
+        heads (List[int], optional): heads to keep (default: all)
+        reduce (str, optional): ``"none"`` to keep the heads, giving weights
+            of shape `(heads, batch, tgt_len, src_len)`, or ``"mean_heads"``
+            / ``"max_heads"`` to reduce over them (default: ``"none"``)
+    """
+
+    def __init__(
+        self,
+        probes: Dict[int, "AttentionProbe"],
+        layers: Optional[Iterable[int]] = None,
+        heads: Optional[Iterable[int]] = None,
+        reduce: str = "none",
+    ):
+        if reduce not in REDUCTIONS:
+            raise ValueError(
+                f"unknown attention reduction {reduce}, choose from {REDUCTIONS}"
+            )
+        self.layers = None if layers is None else set(layers)
+        self.heads = None if heads is None else list(heads)
+        self.reduce = reduce
+        # weights captured by the last forward pass, keyed by layer
+        self.attn: Dict[int, Tensor] = {}
+
+        self.id = next(_probe_ids)
+        self._probes = probes
+        probes[self.id] = self
+
+    def wants(self, layer: int) -> bool:
+        return self.layers is None or layer in self.layers
+
+    def capture(self, layer: int, attn: Tensor):
+        """Record the per-head weights *attn* of *layer*, of shape
+        `(heads, batch, tgt_len, src_len)`."""
+        attn = attn.detach()
+        if self.heads is not None:
+            attn = attn.index_select(
+                0, torch.tensor(self.heads, dtype=torch.long, device=attn.device)
+            )
+        if self.reduce == "mean_heads":
+            attn = attn.mean(dim=0)
+        elif self.reduce == "max_heads":
+            attn = attn.amax(dim=0)
+        self.attn[layer] = attn
+
+    def weights(self) -> List[Tensor]:
+        """The captured weights in layer order."""
+        return [self.attn[layer] for layer in sorted(self.attn)]
+
+    def remove(self):
+        self._probes.pop(self.id, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.remove()
@@ -34,11 +34,9 @@ class LearnedPositionalEmbedding(nn.Embedding):
         incremental_state: Optional[Dict[str, Dict[str, Optional[Tensor]]]] = None,
         positions: Optional[Tensor] = None,
     ):
-        """Input is expected to be of size [bsz x seqlen]."""
-        assert (positions is None) or (
-            self.padding_idx is None
-        ), "If positions is pre-computed then padding_idx should not be set."
-
+        """Input is expected to be of size [bsz x seqlen]. Pre-computed
+        *positions* must be offset by ``padding_idx + 1`` like
+        :func:`fairseq.utils.make_positions`."""
         if positions is None:
             if incremental_state is not None:
                 # positions is the same for every token when decoding a single step
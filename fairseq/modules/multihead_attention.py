@@ -20,6 +20,7 @@ except ImportError:
     _xformers_available = False
 
 from fairseq import utils
+from fairseq.logging import trace
 from fairseq.modules.fairseq_dropout import FairseqDropout
 from fairseq.modules.quant_noise import quant_noise
 from fairseq.models.fairseq_incremental_decoder import FairseqIncrementalDecoder
@@ -489,7 +490,9 @@ class MultiheadAttention(FairseqIncrementalDecoder):
                 averaged over heads (default: False).
             attn_mask (ByteTensor, optional): typically used to
                 implement causal attention, where the mask prevents the
-                attention from looking forward in time (default: None).
+                attention from looking forward in time, of shape
+                `(tgt_len, src_len)`, or `(batch, tgt_len, src_len)` to mask
+                each sample differently (default: None).
             before_softmax (bool, optional): return the raw attention
                 weights and values before the attention softmax.
             need_head_weights (bool, optional): return the attention
@@ -514,6 +517,15 @@ class MultiheadAttention(FairseqIncrementalDecoder):
                 assert value is not None
                 assert src_len, key_bsz == value.shape[:2]
 
+        if (
+            attn_mask is not None
+            and attn_mask.dim() == 3
+            and attn_mask.size(0) == bsz
+            and self.num_heads > 1
+        ):
+            # a per-sample mask is shared by all heads
+            attn_mask = attn_mask.repeat_interleave(self.num_heads, dim=0)
+
         if (
             not self.onnx_trace
             and not is_tpu  # don't use PyTorch version on TPUs
@@ -706,8 +718,9 @@ class MultiheadAttention(FairseqIncrementalDecoder):
         assert list(attn_weights.size()) == [bsz * self.num_heads, tgt_len, src_len]
 
         if attn_mask is not None:
-            attn_mask = attn_mask.unsqueeze(0)
-            if self.onnx_trace:
+            if attn_mask.dim() == 2:
+                attn_mask = attn_mask.unsqueeze(0)
+            if self.onnx_trace and attn_mask.size(0) == 1:
                 attn_mask = attn_mask.repeat(attn_weights.size(0), 1, 1)
             attn_weights += attn_mask
 
@@ -780,8 +793,12 @@ class MultiheadAttention(FairseqIncrementalDecoder):
             if not need_head_weights:
                 # average attention weights over heads
                 attn_weights = attn_weights.mean(dim=0)
-        print(
-            f"[DEBUG] inside MultiheadAttention forward(): \nattn (size {attn.size()}):\n{attn}\nattn_weights (size {attn_weights.size()}):\n{attn_weights}")
+        if not torch.jit.is_scripting() and trace.ENABLED:
+            trace.event(
+                "attention output %s, weights %s",
+                attn.size(),
+                None if attn_weights is None else attn_weights.size(),
+            )
         return attn, attn_weights
 
     @staticmethod
@@ -10,6 +10,7 @@ import torch.nn as nn
 from torch import Tensor
 
 from fairseq import utils
+from fairseq.logging import trace
 from fairseq.models.transformer import TransformerConfig
 from fairseq.modules import LayerNorm, MultiheadAttention
 from fairseq.modules.fairseq_dropout import FairseqDropout
@@ -203,7 +204,8 @@ class TransformerEncoderLayerBase(nn.Module):
         residual = x
         if self.normalize_before:
             x = self.self_attn_layer_norm(x)
-        print("[DEBUG] currently in Encoder layer base.")  # Stanley
+        if not torch.jit.is_scripting() and trace.ENABLED:
+            trace.event("encoder self attention, input %s", x.size())
 
         x, attn = self.self_attn(
             query=x,
@@ -464,7 +466,8 @@ class TransformerDecoderLayerBase(nn.Module):
         else:
             y = x
 
-        print(f'[DEBUG] currently in Decoder layer base.')
+        if not torch.jit.is_scripting() and trace.ENABLED:
+            trace.event("decoder self attention, input %s", x.size())
         x, attn = self.self_attn(
             query=x,
             key=y,
@@ -487,7 +490,8 @@ class TransformerDecoderLayerBase(nn.Module):
             x = self.self_attn_layer_norm(x)
 
         if self.encoder_attn is not None and encoder_out is not None:
-            print("[DEBUG] encoder results ready, decoder just done ==> cross attention?? ")
+            if not torch.jit.is_scripting() and trace.ENABLED:
+                trace.event("decoder encoder attention, input %s", x.size())
             residual = x
             if self.normalize_before:
                 x = self.encoder_attn_layer_norm(x)
@@ -267,7 +267,9 @@ def add_preprocess_args(parser):
     group.add_argument("-t", "--target-lang", default=None, metavar="TARGET",
                        help="target language")
     group.add_argument("--trainpref", metavar="FP", default=None,
-                       help="train file prefix (also used to build dictionaries)")
+                       help="train file prefix (also used to build dictionaries); "
+                            "with --only-source, this can also be \"-\" to read stdin "
+                            "or a .gz, .xz or .zst compressed file")
     group.add_argument("--validpref", metavar="FP", default=None,
                        help="comma separated, valid file prefixes "
                             "(words missing from train set are replaced with <unk>)")
@@ -303,6 +305,14 @@ def add_preprocess_args(parser):
                        help="Pad dictionary size to be multiple of N")
     group.add_argument("--workers", metavar="N", default=1, type=int,
                        help="number of parallel workers")
+    group.add_argument("--dict-max-symbols", metavar="N", default=None, type=int,
+                       help="bound the memory used to build dictionaries by pruning "
+                            "word counts to the most frequent words whenever they "
+                            "exceed N entries (rare word counts become approximate)")
+    group.add_argument("--single-pass", action="store_true",
+                       help="read the training data once: tokenize it to interim ids "
+                            "while building the dictionaries and remap them to the "
+                            "final ids afterwards")
     group.add_argument("--dict-only", action='store_true',
                        help="if true, only builds a dictionary and then exits")
     # fmt: on
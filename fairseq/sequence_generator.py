@@ -12,15 +12,12 @@ import torch.nn as nn
 from torch import Tensor
 
 from fairseq import search, utils
+from fairseq.attention_store import GenerationCapture, get_default_store
 from fairseq.data import data_utils
+from fairseq.logging import trace
 from fairseq.models import FairseqIncrementalDecoder
+from fairseq.modules import AttentionProbe
 from fairseq.ngram_repeat_block import NGramRepeatBlock
-"""stanley: for pickling"""
-import os
-import pickle
-pkl_dir = os.environ["PKL_LOC"].split(',')
-pkl_path = os.path.join(os.getcwd(), pkl_dir[0], f'{pkl_dir[1]}.pkl')
-"""end for pickling"""
 
 
 class SequenceGenerator(nn.Module):
@@ -207,7 +204,8 @@ class SequenceGenerator(nn.Module):
             bos_token (int, optional): beginning of sentence token
                 (default: self.eos)
         """
-        return self._generate(sample, **kwargs)
+        with trace.span("SequenceGenerator: generate"):
+            return self._generate(sample, **kwargs)
 
     def _generate(
         self,
@@ -283,18 +281,35 @@ class SequenceGenerator(nn.Module):
         ), "min_len cannot be larger than max_len, please adjust these!"
         # compute the encoder output for each beam
         with torch.autograd.profiler.record_function("EnsembleModel: forward_encoder"):
-            encoder_outs = self.model.forward_encoder(net_input)
+            # appended to the store named by PKL_LOC, keyed by the source tokens
+            attention_store = get_default_store()
+            attention_capture: Optional[GenerationCapture] = None
+            probes = []
+            if attention_store is not None:
+                attention_capture = GenerationCapture(
+                    attention_store,
+                    src_tokens,
+                    self.pad,
+                    beam_size,
+                    ids=sample["id"] if "id" in sample else None,
+                )
+                probes = self.model.attention_probes(
+                    reduce=attention_capture.config.reduce_heads
+                )
+            try:
+                encoder_outs = self.model.forward_encoder(net_input)
+            finally:
+                for probe in probes:
+                    if probe is not None:
+                        probe.remove()
             """Stanley: injected lines here. encoder_outs[n]['encoder_attn'] contains encoder attentions."""
-            print("[DEBUG] About to start pickling encoder_attn")
-            with open(pkl_path, 'rb') as file:
-                # Load the pickled object
-                attention_pickle = pickle.load(file)
-            flatten_key = tuple(src_tokens.numpy().flatten())
-            attention_pickle[flatten_key]['encoder_outs'] = encoder_outs
-            with open(pkl_path, 'wb') as file:
-                # Pickle the 'data' dictionary and write it to the file
-                pickle.dump(attention_pickle, file)
-            # print(encoder_outs)
+            if attention_capture is not None:
+                if trace.ENABLED:
+                    trace.event("capturing encoder attention of %d sentences", bsz)
+                attention_capture.encoder(
+                    encoder_outs,
+                    [probe.weights() if probe is not None else [] for probe in probes],
+                )
             """Injection ends here"""
 
         # placeholder of indices for bsz * beam_size to hold tokens and accumulative scores
@@ -368,6 +383,8 @@ class SequenceGenerator(nn.Module):
                         corr.unsqueeze(-1) * beam_size
                     )
                     original_batch_idxs = original_batch_idxs[batch_idxs]
+                    if attention_capture is not None:
+                        attention_capture.select(batch_idxs)
                 self.model.reorder_incremental_state(incremental_states, reorder_state)
                 encoder_outs = self.model.reorder_encoder_out(
                     encoder_outs, reorder_state
@@ -382,17 +399,10 @@ class SequenceGenerator(nn.Module):
                     self.temperature,
                 )
                 """ Stanley added this chunk to save decoder self-attention"""
-                print("[DEBUG] About to start pickling decoder_attn")
-                with open(pkl_path, 'rb') as file:
-                    # Load the pickled object
-                    attention_pickle = pickle.load(file)
-                flatten_key = tuple(src_tokens.numpy().flatten())
-                if not 'decoder_attn' in attention_pickle[flatten_key]:
-                    attention_pickle[flatten_key]['decoder_attn'] = []
-                attention_pickle[flatten_key]['decoder_attn'].append(avg_attn_scores)
-                with open(pkl_path, 'wb') as file:
-                    # Pickle the 'data' dictionary and write it to the file
-                    pickle.dump(attention_pickle, file)
+                if attention_capture is not None:
+                    if trace.ENABLED:
+                        trace.event("capturing decoder attention of step %d", step)
+                    attention_capture.decoder_step(avg_attn_scores)
                 """end addition"""
 
             if self.lm_model is not None:
@@ -831,6 +841,19 @@ class EnsembleModel(nn.Module):
                 if hasattr(model, "set_beam_size"):
                     model.set_beam_size(beam_size)
 
+    @torch.jit.unused
+    def attention_probes(self, **kwargs) -> List[Optional[AttentionProbe]]:
+        """Capture the encoder self-attention of the models that support it,
+        see :func:`TransformerEncoderBase.attention_probes`."""
+        if not self.has_encoder():
+            return []
+        return [
+            model.encoder.attention_probes(**kwargs)
+            if hasattr(model.encoder, "attention_probes")
+            else None
+            for model in self.models
+        ]
+
     @torch.jit.export
     def forward_encoder(self, net_input: Dict[str, Tensor]):
         if not self.has_encoder():
@@ -9,10 +9,18 @@ import warnings
 from argparse import Namespace
 from typing import Any, Callable, Dict, List
 
+import numpy as np
 import torch
 from fairseq import search, tokenizer, utils
 from fairseq.logging import metrics
-from fairseq.data import Dictionary, FairseqDataset, data_utils, encoders, iterators
+from fairseq.data import (
+    Dictionary,
+    FairseqDataset,
+    StreamingIndexedDataset,
+    data_utils,
+    encoders,
+    iterators,
+)
 from fairseq.dataclass import FairseqDataclass
 from fairseq.dataclass.utils import gen_parser_from_dataclass
 from fairseq.optim.amp_optimizer import AMPOptimizer
@@ -96,7 +104,13 @@ class FairseqTask(object):
 
     @classmethod
     def build_dictionary(
-        cls, filenames, workers=1, threshold=-1, nwords=-1, padding_factor=8
+        cls,
+        filenames,
+        workers=1,
+        threshold=-1,
+        nwords=-1,
+        padding_factor=8,
+        max_symbols=None,
     ):
         """Build the dictionary
 
@@ -109,11 +123,14 @@ class FairseqTask(object):
             padding_factor (int): can be used to pad the dictionary size to be a
                 multiple of 8, which is important on some hardware (e.g., Nvidia
                 Tensor Cores).
+            max_symbols (int, optional): prune the word counts to the most
+                frequent words whenever they exceed this many entries, to
+                bound memory on very large vocabularies
         """
         d = Dictionary()
         for filename in filenames:
             Dictionary.add_file_to_dictionary(
-                filename, d, tokenizer.tokenize_line, workers
+                filename, d, tokenizer.tokenize_line, workers, max_symbols
             )
         d.finalize(threshold=threshold, nwords=nwords, padding_factor=padding_factor)
         return d
@@ -157,11 +174,13 @@ class FairseqTask(object):
         Returns:
             a :class:`~fairseq.data.FairseqDataset` corresponding to *split*
         """
-        from fairseq.data import FairseqDataset
+        from fairseq.data import FairseqDataset, FairseqIterableDataset
 
         if split not in self.datasets:
             raise KeyError("Dataset not loaded: " + split)
-        if not isinstance(self.datasets[split], FairseqDataset):
+        if not isinstance(
+            self.datasets[split], (FairseqDataset, FairseqIterableDataset)
+        ):
             raise TypeError("Datasets are expected to be of type FairseqDataset")
         return self.datasets[split]
 
@@ -223,6 +242,12 @@ class FairseqTask(object):
         skip_remainder_batch=False,
         grouped_shuffling=False,
         update_epoch_batch_itr=False,
+        batching_strategy="greedy",
+        padding_buckets=8,
+        batches_dir=None,
+        buffer_backend="thread",
+        buffer_slot_bytes=16 * 1024 * 1024,
+        token_budgets=None,
     ):
         """
         Get an iterator that yields batches of data from the given dataset.
@@ -263,6 +288,22 @@ class FairseqTask(object):
                 between sequence lengths among workers for batches sorted by length.
             update_epoch_batch_itr (bool optional): if true then donot use the cached
                 batch iterator for the epoch
+            batching_strategy (str, optional): ``"greedy"`` to batch samples in
+                the order of the dataset, or ``"min_padding"`` to batch them
+                within length buckets chosen to minimize padding
+                (default: ``"greedy"``).
+            padding_buckets (int, optional): number of length buckets per size
+                column of the ``"min_padding"`` strategy (default: 8).
+            batches_dir (str, optional): directory to save the batches of each
+                epoch to, see :class:`~fairseq.data.iterators.EpochBatchIterator`
+                (default: None).
+            buffer_backend (str, optional): ``"thread"`` or ``"process"``
+                preloading of *data_buffer_size* batches (default: ``"thread"``).
+            buffer_slot_bytes (int, optional): size of the shared memory slots
+                of the ``"process"`` backend (default: 16MB).
+            token_budgets (~fairseq.data.TokenBudgets, optional): per-length
+                bucket token budgets that regroup the batches of each epoch
+                (default: None).
 
         Returns:
             ~fairseq.iterators.EpochBatchIterator: a batched iterator over the
@@ -278,6 +319,29 @@ class FairseqTask(object):
             logger.debug("reusing EpochBatchIterator for epoch {}".format(epoch))
             return self.dataset_to_epoch_iter[dataset]
 
+        if isinstance(dataset, StreamingIndexedDataset):
+            # the dataset batches and shards itself, there are no sizes to
+            # filter or sort by
+            dataset.set_batching(
+                max_tokens=max_tokens,
+                max_sentences=max_sentences,
+                required_batch_size_multiple=required_batch_size_multiple,
+                num_shards=num_shards,
+                shard_id=shard_id,
+                num_workers=num_workers,
+                seed=seed,
+            )
+            epoch_iter = iterators.StreamingEpochBatchIterator(
+                dataset,
+                max_sentences=None,
+                epoch=epoch,
+                num_workers=num_workers,
+                buffer_size=data_buffer_size,
+            )
+            if can_reuse_epoch_itr:
+                self.dataset_to_epoch_iter[dataset] = epoch_iter
+            return epoch_iter
+
         assert isinstance(dataset, FairseqDataset)
 
         # initialize the dataset with the correct starting epoch
@@ -297,12 +361,22 @@ class FairseqTask(object):
                 )
 
             # create mini-batches with given size constraints
-            batches = dataset.batch_by_size(
-                indices,
-                max_tokens=max_tokens,
-                max_sentences=max_sentences,
-                required_batch_size_multiple=required_batch_size_multiple,
-            )
+            if batching_strategy == "min_padding":
+                batches = dataset.batch_by_size_min_padding(
+                    indices,
+                    max_tokens=max_tokens,
+                    max_sentences=max_sentences,
+                    required_batch_size_multiple=required_batch_size_multiple,
+                    num_buckets=padding_buckets,
+                )
+            else:
+                batches = dataset.batch_by_size(
+                    indices,
+                    max_tokens=max_tokens,
+                    max_sentences=max_sentences,
+                    required_batch_size_multiple=required_batch_size_multiple,
+                )
+            self._log_padding_efficiency(dataset, batches, epoch)
             return batches
 
         reuse_dataloader = getattr(self.cfg, "reuse_dataloader", True)
@@ -332,6 +406,10 @@ class FairseqTask(object):
             grouped_shuffling=grouped_shuffling,
             reuse_dataloader=reuse_dataloader,
             persistent_workers=persistent_workers,
+            batches_dir=batches_dir,
+            buffer_backend=buffer_backend,
+            buffer_slot_bytes=buffer_slot_bytes,
+            token_budgets=token_budgets,
         )
 
         if can_reuse_epoch_itr:
@@ -339,6 +417,21 @@ class FairseqTask(object):
 
         return epoch_iter
 
+    def _log_padding_efficiency(self, dataset, batches, epoch):
+        try:
+            sizes = dataset.sizes
+        except (AttributeError, NotImplementedError):
+            return
+        if isinstance(sizes, (list, tuple)):
+            sizes = np.stack(sizes, axis=1)
+        if sizes is None or len(sizes) != len(dataset):
+            return
+        efficiency = data_utils.padding_efficiency(batches, sizes)
+        logger.info(
+            f"padding efficiency (real / padded tokens) of {len(batches)} batches "
+            f"for epoch {epoch}: " + ", ".join(f"{e:.1%}" for e in efficiency)
+        )
+
     def build_model(self, cfg: FairseqDataclass, from_checkpoint=False):
         """
         Build the :class:`~fairseq.models.BaseFairseqModel` instance for this
@@ -646,13 +739,24 @@ class FairseqTask(object):
         return encoders.build_bpe(args)
 
     def get_interactive_tokens_and_lengths(self, lines, encode_fn):
+        if type(self.source_dictionary).encode_line is not Dictionary.encode_line:
+            # subclasses of Dictionary may encode lines differently
+            tokens = [
+                self.source_dictionary.encode_line(
+                    encode_fn(src_str), add_if_not_exist=False
+                ).long()
+                for src_str in lines
+            ]
+            return tokens, [t.numel() for t in tokens]
+        tokens, offsets = self.source_dictionary.encode_lines(
+            [encode_fn(src_str) for src_str in lines], add_if_not_exist=False
+        )
+        tokens = torch.from_numpy(tokens).long()
+        lengths = np.diff(offsets).tolist()
         tokens = [
-            self.source_dictionary.encode_line(
-                encode_fn(src_str), add_if_not_exist=False
-            ).long()
-            for src_str in lines
+            tokens[start:end]
+            for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())
         ]
-        lengths = [t.numel() for t in tokens]
         return tokens, lengths
 
 
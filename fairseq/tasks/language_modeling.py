@@ -15,12 +15,17 @@ from fairseq.data import (
     AppendTokenDataset,
     Dictionary,
     IdDataset,
+    ListDataset,
     LMContextWindowDataset,
     MonolingualDataset,
     NestedDictionaryDataset,
     NumelDataset,
+    PackedSegmentIdsDataset,
+    PackedSequenceDataset,
     PadDataset,
     PrependTokenDataset,
+    StreamingFileCache,
+    StreamingIndexedDataset,
     StripTokenDataset,
     TokenBlockDataset,
     TruncatedDictionary,
@@ -29,6 +34,7 @@ from fairseq.data import (
 from fairseq.data.indexed_dataset import get_available_dataset_impl
 from fairseq.data.shorten_dataset import maybe_shorten_dataset
 from fairseq.dataclass import ChoiceEnum, FairseqDataclass
+from fairseq.dataclass.constants import MMAP_WARMUP_CHOICES
 from fairseq.tasks import LegacyFairseqTask, register_task
 from omegaconf import II
 
@@ -92,6 +98,29 @@ class LanguageModelingConfig(FairseqDataclass):
         default=False,
         metadata={"help": "boolean to pad to fixed batch size"},
     )
+    cache_token_blocks: bool = field(
+        default=False,
+        metadata={
+            "help": "cache the block indices as .npy files next to the data, "
+            "so that restarts and other ranks can memory-map them"
+        },
+    )
+    pack_sequences: bool = field(
+        default=False,
+        metadata={
+            "help": "pack several samples (e.g. --sample-break-mode eos) into each "
+            "row of up to --tokens-per-sample tokens. Positions restart and "
+            "attention does not cross samples within a row"
+        },
+    )
+    streaming: bool = field(
+        default=False,
+        metadata={
+            "help": "stream the training data instead of memory-mapping it, for "
+            "corpora larger than local disk. Every path of --data is a shard of "
+            "the same split, requires --sample-break-mode eos"
+        },
+    )
 
     # TODO common vars below add to parent
     seed: int = II("common.seed")
@@ -100,10 +129,18 @@ class LanguageModelingConfig(FairseqDataclass):
     dataset_impl: Optional[ChoiceEnum(get_available_dataset_impl())] = II(
         "dataset.dataset_impl"
     )
+    dataset_native_dtype: bool = II("dataset.dataset_native_dtype")
+    mmap_warmup: MMAP_WARMUP_CHOICES = II("dataset.mmap_warmup")
     data_buffer_size: int = II("dataset.data_buffer_size")
+    train_subset: str = II("dataset.train_subset")
+    streaming_cache_dir: Optional[str] = II("dataset.streaming_cache_dir")
+    streaming_cache_mb: int = II("dataset.streaming_cache_mb")
+    streaming_shuffle_buffer: int = II("dataset.streaming_shuffle_buffer")
     tpu: bool = II("common.tpu")
     use_plasma_view: bool = II("common.use_plasma_view")
     plasma_path: str = II("common.plasma_path")
+    use_shared_memory_view: bool = II("common.use_shared_memory_view")
+    shared_memory_path: Optional[str] = II("common.shared_memory_path")
 
 
 @register_task("language_modeling", dataclass=LanguageModelingConfig)
@@ -208,12 +245,23 @@ class LanguageModelingTask(LegacyFairseqTask):
         paths = utils.split_paths(self.args.data)
         assert len(paths) > 0
 
+        if getattr(self.args, "streaming", False) and split == getattr(
+            self.args, "train_subset", "train"
+        ):
+            self.datasets[split] = self.load_streaming_dataset(split, paths)
+            return
+
         data_path = paths[(epoch - 1) % len(paths)]
         split_path = os.path.join(data_path, split)
 
         # each process has its own copy of the raw data (likely to be an np.memmap)
         dataset = data_utils.load_indexed_dataset(
-            split_path, self.dictionary, self.args.dataset_impl, combine=combine
+            split_path,
+            self.dictionary,
+            self.args.dataset_impl,
+            combine=combine,
+            native_dtype=getattr(self.args, "dataset_native_dtype", False),
+            mmap_warmup=getattr(self.args, "mmap_warmup", "full"),
         )
         if dataset is None:
             raise FileNotFoundError(f"Dataset not found: {split} ({split_path})")
@@ -237,8 +285,20 @@ class LanguageModelingTask(LegacyFairseqTask):
             use_plasma_view=self.args.use_plasma_view,
             split_path=split_path,
             plasma_path=self.args.plasma_path,
+            use_shared_memory_view=getattr(self.args, "use_shared_memory_view", False),
+            shared_memory_path=getattr(self.args, "shared_memory_path", None),
+            cache_path=(
+                split_path if getattr(self.args, "cache_token_blocks", False) else None
+            ),
         )
 
+        segment_ids = None
+        if getattr(self.args, "pack_sequences", False):
+            dataset = PackedSequenceDataset(
+                dataset, dataset.sizes, self.args.tokens_per_sample
+            )
+            segment_ids = PackedSegmentIdsDataset(dataset)
+
         add_eos_for_other_targets = (
             self.args.sample_break_mode is not None
             and self.args.sample_break_mode != "none"
@@ -264,6 +324,48 @@ class LanguageModelingTask(LegacyFairseqTask):
             add_bos_token=self.args.add_bos_token,
             fixed_pad_length=fixed_pad_length,
             pad_to_bsz=pad_to_bsz,
+            segment_ids=segment_ids,
+        )
+
+    def load_streaming_dataset(self, split, paths):
+        """Stream *split* from the shards in *paths* (see --streaming), as
+        batches of samples of up to --tokens-per-sample tokens."""
+        if self.args.sample_break_mode != "eos":
+            raise ValueError("--streaming requires --sample-break-mode eos")
+        cache = StreamingFileCache(
+            getattr(self.args, "streaming_cache_dir", None),
+            getattr(self.args, "streaming_cache_mb", 10240) * 1024 * 1024,
+        )
+        return StreamingIndexedDataset(
+            [[os.path.join(path, split)] for path in paths],
+            self._build_streaming_batch,
+            max_sample_size=self.args.tokens_per_sample,
+            cache=cache,
+            shuffle_buffer=getattr(self.args, "streaming_shuffle_buffer", 10000),
+            seed=self.args.seed,
+        )
+
+    def _build_streaming_batch(self, items):
+        tokens = [item[0][: self.args.tokens_per_sample] for item in items]
+        sizes = np.array([len(t) for t in tokens], dtype=np.int64)
+        dataset = TokenBlockDataset(
+            ListDataset(tokens, sizes),
+            sizes,
+            block_size=None,  # ignored for "eos" break mode
+            pad=self.dictionary.pad(),
+            eos=self.dictionary.eos(),
+            break_mode="eos",
+            include_targets=True,
+        )
+        return MonolingualDataset(
+            dataset=dataset,
+            sizes=dataset.sizes,
+            src_vocab=self.dictionary,
+            tgt_vocab=self.output_dictionary,
+            add_eos_for_other_targets=True,
+            shuffle=False,
+            targets=self.targets,
+            add_bos_token=self.args.add_bos_token,
         )
 
     def build_dataset_for_inference(self, src_tokens, src_lengths, **kwargs):
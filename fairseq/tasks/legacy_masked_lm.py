@@ -58,12 +58,18 @@ class LegacyMaskedLMTask(LegacyFairseqTask):
 
     @classmethod
     def build_dictionary(
-        cls, filenames, workers=1, threshold=-1, nwords=-1, padding_factor=8
+        cls,
+        filenames,
+        workers=1,
+        threshold=-1,
+        nwords=-1,
+        padding_factor=8,
+        max_symbols=None,
     ):
         d = BertDictionary()
         for filename in filenames:
             Dictionary.add_file_to_dictionary(
-                filename, d, tokenizer.tokenize_line, workers
+                filename, d, tokenizer.tokenize_line, workers, max_symbols
             )
         d.finalize(threshold=threshold, nwords=nwords, padding_factor=padding_factor)
         return d
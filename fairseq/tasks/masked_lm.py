@@ -18,6 +18,8 @@ from fairseq.data import (
     NestedDictionaryDataset,
     NumelDataset,
     NumSamplesDataset,
+    PackedSegmentIdsDataset,
+    PackedSequenceDataset,
     PrependTokenDataset,
     RightPadDataset,
     RightPaddingMaskDataset,
@@ -123,6 +125,14 @@ class MaskedLMConfig(FairseqDataclass):
         default=False,
         metadata={"help": "prepare dataset for data2vec_multi"},
     )
+    pack_sequences: bool = field(
+        default=False,
+        metadata={
+            "help": "pack several samples (e.g. --sample-break-mode complete_doc) "
+            "into each row of up to --tokens-per-sample tokens. Positions restart "
+            "and attention does not cross samples within a row"
+        },
+    )
 
 
 @register_task("masked_lm", dataclass=MaskedLMConfig)
@@ -199,6 +209,15 @@ class MaskedLMTask(FairseqTask):
         """
         dataset = self._load_dataset_split(split, epoch, combine)
 
+        packed = None
+        if self.cfg.pack_sequences:
+            assert (
+                not self.cfg.d2v2_multi
+            ), "--pack-sequences requires --d2v2-multi=False"
+            dataset = packed = PackedSequenceDataset(
+                dataset, dataset.sizes, self.cfg.tokens_per_sample
+            )
+
         # create masked input and targets
         mask_whole_words = (
             get_whole_word_mask(self.args, self.source_dictionary)
@@ -233,13 +252,13 @@ class MaskedLMTask(FairseqTask):
         if self.cfg.d2v2_multi:
             dataset = self._d2v2_multi_dataset(src_dataset)
         else:
-            dataset = self._regular_dataset(src_dataset, target_dataset)
+            dataset = self._regular_dataset(src_dataset, target_dataset, packed)
 
         self.datasets[split] = SortDataset(
             dataset, sort_order=[shuffle, src_dataset.sizes]
         )
 
-    def _regular_dataset(self, src_dataset, target_dataset):
+    def _regular_dataset(self, src_dataset, target_dataset, packed=None):
         input_dict = {
             "src_tokens": RightPadDataset(
                 src_dataset,
@@ -252,16 +271,17 @@ class MaskedLMTask(FairseqTask):
         if self.cfg.include_index:
             input_dict["src_id"] = IdDataset()
 
-        dataset = NestedDictionaryDataset(
-            {
-                "id": IdDataset(),
-                "net_input": input_dict,
-                "target": target_dataset,
-                "nsentences": NumSamplesDataset(),
-                "ntokens": NumelDataset(src_dataset, reduce=True),
-            },
-            sizes=[src_dataset.sizes],
-        )
+        defn = {
+            "id": IdDataset(),
+            "net_input": input_dict,
+            "target": target_dataset,
+            "nsentences": NumSamplesDataset(),
+            "ntokens": NumelDataset(src_dataset, reduce=True),
+        }
+        if packed is not None:
+            input_dict["segment_ids"] = PackedSegmentIdsDataset(packed)
+
+        dataset = NestedDictionaryDataset(defn, sizes=[src_dataset.sizes])
         return dataset
 
     def _d2v2_multi_dataset(self, src_dataset):
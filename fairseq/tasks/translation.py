@@ -13,6 +13,7 @@ from argparse import Namespace
 from omegaconf import II
 
 import numpy as np
+import torch
 from fairseq import utils
 from fairseq.logging import metrics
 from fairseq.data import (
@@ -20,6 +21,8 @@ from fairseq.data import (
     ConcatDataset,
     LanguagePairDataset,
     PrependTokenDataset,
+    StreamingFileCache,
+    StreamingIndexedDataset,
     StripTokenDataset,
     TruncateDataset,
     data_utils,
@@ -28,6 +31,8 @@ from fairseq.data import (
 )
 from fairseq.data.indexed_dataset import get_available_dataset_impl
 from fairseq.dataclass import ChoiceEnum, FairseqDataclass
+from fairseq.dataclass.constants import MMAP_WARMUP_CHOICES
+from fairseq.file_io import PathManager
 from fairseq.tasks import FairseqTask, register_task
 
 
@@ -59,6 +64,8 @@ def load_langpair_dataset(
     shuffle=True,
     pad_to_multiple=1,
     prepend_bos_src=None,
+    native_dtype=False,
+    mmap_warmup="full",
 ):
     def split_exists(split, src, tgt, lang, data_path):
         filename = os.path.join(data_path, "{}.{}-{}.{}".format(split, src, tgt, lang))
@@ -84,7 +91,11 @@ def load_langpair_dataset(
                 )
 
         src_dataset = data_utils.load_indexed_dataset(
-            prefix + src, src_dict, dataset_impl
+            prefix + src,
+            src_dict,
+            dataset_impl,
+            native_dtype=native_dtype,
+            mmap_warmup=mmap_warmup,
         )
         if truncate_source:
             src_dataset = AppendTokenDataset(
@@ -97,7 +108,11 @@ def load_langpair_dataset(
         src_datasets.append(src_dataset)
 
         tgt_dataset = data_utils.load_indexed_dataset(
-            prefix + tgt, tgt_dict, dataset_impl
+            prefix + tgt,
+            tgt_dict,
+            dataset_impl,
+            native_dtype=native_dtype,
+            mmap_warmup=mmap_warmup,
         )
         if tgt_dataset is not None:
             tgt_datasets.append(tgt_dataset)
@@ -223,10 +238,23 @@ class TranslationConfig(FairseqDataclass):
             "N buckets and pad accordingly; this is useful on TPUs to minimize the number of compilations"
         },
     )
+    streaming: bool = field(
+        default=False,
+        metadata={
+            "help": "stream the training data instead of memory-mapping it, for "
+            "corpora larger than local disk. Every path of --data is a shard of "
+            "the same split"
+        },
+    )
     train_subset: str = II("dataset.train_subset")
+    streaming_cache_dir: Optional[str] = II("dataset.streaming_cache_dir")
+    streaming_cache_mb: int = II("dataset.streaming_cache_mb")
+    streaming_shuffle_buffer: int = II("dataset.streaming_shuffle_buffer")
     dataset_impl: Optional[ChoiceEnum(get_available_dataset_impl())] = II(
         "dataset.dataset_impl"
     )
+    dataset_native_dtype: bool = II("dataset.dataset_native_dtype")
+    mmap_warmup: MMAP_WARMUP_CHOICES = II("dataset.mmap_warmup")
     required_seq_len_multiple: int = II("dataset.required_seq_len_multiple")
 
     # options for reporting BLEU during validation
@@ -328,6 +356,9 @@ class TranslationTask(FairseqTask):
         """
         paths = utils.split_paths(self.cfg.data)
         assert len(paths) > 0
+        if self.cfg.streaming and split == self.cfg.train_subset:
+            self.datasets[split] = self.load_streaming_dataset(split, paths)
+            return
         if split != self.cfg.train_subset:
             # if not training data set, use the first shard for valid and test
             paths = paths[:1]
@@ -355,6 +386,54 @@ class TranslationTask(FairseqTask):
             num_buckets=self.cfg.num_batch_buckets,
             shuffle=(split != "test"),
             pad_to_multiple=self.cfg.required_seq_len_multiple,
+            native_dtype=self.cfg.dataset_native_dtype,
+            mmap_warmup=self.cfg.mmap_warmup,
+        )
+
+    def load_streaming_dataset(self, split, paths):
+        """Stream *split* from the shards in *paths* (see --streaming).
+        Samples longer than --max-source-positions or --max-target-positions
+        are truncated."""
+        src, tgt = self.cfg.source_lang, self.cfg.target_lang
+        shards = []
+        for path in paths:
+            prefix = os.path.join(path, f"{split}.{src}-{tgt}.")
+            if not PathManager.exists(indexed_dataset.index_file_path(prefix + src)):
+                prefix = os.path.join(path, f"{split}.{tgt}-{src}.")
+            shards.append([prefix + src, prefix + tgt])
+        cache = StreamingFileCache(
+            self.cfg.streaming_cache_dir, self.cfg.streaming_cache_mb * 1024 * 1024
+        )
+        return StreamingIndexedDataset(
+            shards,
+            self._build_streaming_batch,
+            max_sample_size=max(
+                self.cfg.max_source_positions, self.cfg.max_target_positions
+            ),
+            cache=cache,
+            shuffle_buffer=self.cfg.streaming_shuffle_buffer,
+        )
+
+    def _build_streaming_batch(self, items):
+        def truncate(tokens, max_length):
+            if len(tokens) <= max_length:
+                return tokens
+            # keep the final eos
+            return torch.cat([tokens[: max_length - 1], tokens[-1:]])
+
+        src = [truncate(s, self.cfg.max_source_positions) for s, _ in items]
+        tgt = [truncate(t, self.cfg.max_target_positions) for _, t in items]
+        return LanguagePairDataset(
+            src,
+            np.array([len(s) for s in src]),
+            self.src_dict,
+            tgt,
+            np.array([len(t) for t in tgt]),
+            self.tgt_dict,
+            left_pad_source=self.cfg.left_pad_source,
+            left_pad_target=self.cfg.left_pad_target,
+            shuffle=False,
+            pad_to_multiple=self.cfg.required_seq_len_multiple,
         )
 
     def build_dataset_for_inference(self, src_tokens, src_lengths, constraints=None):
@@ -465,9 +544,11 @@ class TranslationTask(FairseqTask):
         import sacrebleu
 
         def decode(toks, escape_unk=False):
-            s = self.tgt_dict.string(
-                toks.int().cpu(),
+            sentences = self.tgt_dict.strings(
+                toks,
                 self.cfg.eval_bleu_remove_bpe,
+                # don't count padding in the references
+                extra_symbols_to_ignore=[self.tgt_dict.pad()],
                 # The default unknown string in fairseq is `<unk>`, but
                 # this is tokenized by sacrebleu as `< unk >`, inflating
                 # BLEU scores. Instead, we use a somewhat more verbose
@@ -476,19 +557,15 @@ class TranslationTask(FairseqTask):
                 unk_string=("UNKNOWNTOKENINREF" if escape_unk else "UNKNOWNTOKENINHYP"),
             )
             if self.tokenizer:
-                s = self.tokenizer.decode(s)
-            return s
+                sentences = [self.tokenizer.decode(s) for s in sentences]
+            return sentences
 
         gen_out = self.inference_step(generator, [model], sample, prefix_tokens=None)
-        hyps, refs = [], []
-        for i in range(len(gen_out)):
-            hyps.append(decode(gen_out[i][0]["tokens"]))
-            refs.append(
-                decode(
-                    utils.strip_pad(sample["target"][i], self.tgt_dict.pad()),
-                    escape_unk=True,  # don't count <unk> as matches to the hypo
-                )
-            )
+        hyps = decode([hypos[0]["tokens"] for hypos in gen_out])
+        refs = decode(
+            sample["target"][: len(gen_out)],
+            escape_unk=True,  # don't count <unk> as matches to the hypo
+        )
         if self.cfg.eval_bleu_print_samples:
             logger.info("example hypothesis: " + hyps[0])
             logger.info("example reference: " + refs[0])
@@ -352,6 +352,12 @@ class TranslationMultiSimpleEpochTask(LegacyFairseqTask):
         skip_remainder_batch=False,
         grouped_shuffling=False,
         update_epoch_batch_itr=False,
+        batching_strategy="greedy",
+        padding_buckets=8,
+        batches_dir=None,
+        buffer_backend="thread",
+        buffer_slot_bytes=16 * 1024 * 1024,
+        token_budgets=None,
     ):
         """
         Get an iterator that yields batches of data from the given dataset.
@@ -389,6 +395,19 @@ class TranslationMultiSimpleEpochTask(LegacyFairseqTask):
                 between sequence lengths among workers for batches sorted by length.
             update_epoch_batch_itr (bool optional): if true then donot use the cached
                 batch iterator for the epoch
+            batching_strategy (str, optional): how batches are formed with the
+                RoundRobin sampling method (default: ``"greedy"``).
+            padding_buckets (int, optional): number of length buckets of the
+                ``"min_padding"`` strategy (default: 8).
+            batches_dir (str, optional): directory to save the batches of each
+                epoch to (default: None).
+            buffer_backend (str, optional): ``"thread"`` or ``"process"``
+                preloading of *data_buffer_size* batches (default: ``"thread"``).
+            buffer_slot_bytes (int, optional): size of the shared memory slots
+                of the ``"process"`` backend (default: 16MB).
+            token_budgets (~fairseq.data.TokenBudgets, optional): per-length
+                bucket token budgets that regroup the batches of each epoch
+                (default: None).
 
         Returns:
             ~fairseq.iterators.EpochBatchIterator: a batched iterator over the
@@ -415,6 +434,12 @@ class TranslationMultiSimpleEpochTask(LegacyFairseqTask):
                 disable_iterator_cache=disable_iterator_cache,
                 skip_remainder_batch=skip_remainder_batch,
                 update_epoch_batch_itr=update_epoch_batch_itr,
+                batching_strategy=batching_strategy,
+                padding_buckets=padding_buckets,
+                batches_dir=batches_dir,
+                buffer_backend=buffer_backend,
+                buffer_slot_bytes=buffer_slot_bytes,
+                token_budgets=token_budgets,
             )
             self.dataset_to_epoch_iter[dataset] = batch_iter
             return batch_iter
@@ -437,5 +462,9 @@ class TranslationMultiSimpleEpochTask(LegacyFairseqTask):
             shard_id=shard_id,
             num_workers=num_workers,
             epoch=epoch,
+            batches_dir=batches_dir,
+            buffer_backend=buffer_backend,
+            buffer_slot_bytes=buffer_slot_bytes,
+            token_budgets=token_budgets,
         )
         return epoch_iter
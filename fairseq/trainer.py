@@ -20,6 +20,7 @@ import torch
 from omegaconf import OmegaConf
 
 from fairseq import checkpoint_utils, models, optim, utils
+from fairseq.data import TokenBudgets
 from fairseq.dataclass.configs import FairseqConfig
 from fairseq.dataclass.utils import convert_namespace_to_omegaconf
 from fairseq.distributed import utils as distributed_utils
@@ -140,6 +141,7 @@ class Trainer(object):
         self._wrapped_criterion = None
         self._wrapped_model = None
         self._ema = None
+        self._token_budgets = None
 
         # TODO(myleott): support tpu
         if self.cuda and self.data_parallel_world_size > 1:
@@ -709,6 +711,12 @@ class Trainer(object):
                 data_selector=data_selector,
                 tpu=self.tpu,
             )
+        if self._token_budgets is not None:
+            # share the statistics of the steps so far here, which every worker
+            # reaches before the batches of the next epoch are built
+            self._token_budgets.reduce_stats(
+                self._all_reduce_max if self.data_parallel_world_size > 1 else None
+            )
         batch_iterator = self.task.get_batch_iterator(
             dataset=self.task.dataset(self.cfg.dataset.train_subset),
             max_tokens=self.cfg.dataset.max_tokens,
@@ -732,6 +740,18 @@ class Trainer(object):
             skip_remainder_batch=self.cfg.optimization.skip_remainder_batch,
             grouped_shuffling=self.cfg.dataset.grouped_shuffling,
             update_epoch_batch_itr=self.cfg.dataset.update_epoch_batch_itr,
+            batching_strategy=self.cfg.dataset.batching_strategy,
+            padding_buckets=self.cfg.dataset.padding_buckets,
+            batches_dir=(
+                self.cfg.checkpoint.save_dir
+                if self.cfg.checkpoint.save_epoch_batches
+                else None
+            ),
+            buffer_backend=self.cfg.dataset.data_buffer_backend,
+            buffer_slot_bytes=self.cfg.dataset.data_buffer_slot_mb * 1024 * 1024,
+            token_budgets=(
+                self._get_token_budgets() if self.cfg.dataset.dynamic_batching else None
+            ),
         )
         self.reset_dummy_batch(batch_iterator.first_batch)
         return batch_iterator
@@ -790,6 +810,66 @@ class Trainer(object):
         # task specific setup per validation epoch
         self.task.begin_valid_epoch(epoch, self.get_model())
 
+    def _get_token_budgets(self):
+        if self._token_budgets is None:
+            cfg = self.cfg.dataset
+            total_memory = None
+            if self.cuda_env_arr is not None:
+                # the smallest device, so that all workers take the same decisions
+                total_memory = min(
+                    env.total_memory_in_GB for env in self.cuda_env_arr
+                ) * (1024**3)
+            self._token_budgets = TokenBudgets(
+                cfg.max_tokens,
+                min_tokens=cfg.dynamic_batching_min_tokens or cfg.max_tokens // 2,
+                max_tokens_limit=cfg.dynamic_batching_max_tokens or cfg.max_tokens * 2,
+                num_buckets=cfg.dynamic_batching_buckets,
+                memory_fraction=cfg.dynamic_batching_memory_fraction,
+                total_memory=total_memory,
+                max_sentences=cfg.batch_size,
+                required_batch_size_multiple=cfg.required_batch_size_multiple,
+            )
+        return self._token_budgets
+
+    def _all_reduce_max(self, array):
+        stats = torch.from_numpy(array).to(self.device)
+        distributed_utils.all_reduce(
+            stats, group=self.data_parallel_process_group, op="max"
+        )
+        return stats.cpu().numpy()
+
+    def _start_token_budgets_step(self):
+        if self._token_budgets is None:
+            return None
+        if self.cuda:
+            start = torch.cuda.Event(enable_timing=True)
+            start.record()
+            return start
+        return time.perf_counter()
+
+    def _observe_token_budgets(self, samples, step_start, oom=False):
+        """Report the time and peak memory of a step to the token budgets of
+        --dynamic-batching. CUDA steps are timed with events, and the workers
+        only share their statistics in :func:`get_train_iterator`, so that this
+        neither synchronizes nor communicates."""
+        if self._token_budgets is None or step_start is None:
+            return
+        num_tokens = max((_max_sample_length(s) for s in samples), default=0)
+        batch_tokens = sum(s.get("ntokens", 0) for s in samples if isinstance(s, dict))
+        if self.cuda:
+            end = torch.cuda.Event(enable_timing=True)
+            end.record()
+            step_time = (step_start, end)
+        else:
+            step_time = time.perf_counter() - step_start
+        self._token_budgets.observe(
+            num_tokens,
+            batch_tokens,
+            step_time,
+            peak_memory=torch.cuda.max_memory_allocated() if self.cuda else None,
+            oom=oom,
+        )
+
     def reset_dummy_batch(self, batch):
         self._dummy_batch = batch
 
@@ -802,6 +882,7 @@ class Trainer(object):
         self.zero_grad()
 
         metrics.log_start_time("train_wall", priority=800, round=0)
+        step_start = self._start_token_budgets_step()
 
         # If EMA is enabled through store_ema=True
         # and task.uses_ema is True, pass the EMA model as a keyword
@@ -883,6 +964,7 @@ class Trainer(object):
                     torch.cuda.empty_cache()
 
                 if self.cfg.distributed_training.distributed_world_size == 1:
+                    self._observe_token_budgets(samples, step_start, oom=True)
                     return None
 
             if self.tpu and i < len(samples) - 1:
@@ -1085,6 +1167,8 @@ class Trainer(object):
                 # optimization
                 self._check_xla_compilation()
             else:
+                self._observe_token_budgets(samples, step_start, oom=ooms > 0)
+
                 if self.cuda and self.cuda_env is not None:
                     # log minimum free memory over the iteration
                     gb_used = torch.cuda.max_memory_allocated() / 1024 / 1024 / 1024
@@ -1363,6 +1447,9 @@ class Trainer(object):
         if not self.cfg.common.on_cpu_convert_precision:
             sample = self._fp_convert_sample(sample)
 
+        if self.cfg.dataset.dataset_native_dtype:
+            sample = utils.widen_native_dtype(sample)
+
         if self._dummy_batch == "DUMMY":
             self._dummy_batch = sample
 
@@ -1588,6 +1675,18 @@ class Trainer(object):
             return xla_device_to_cpu(data)
 
 
+def _max_sample_length(sample):
+    """The padded length of the source or target of a batch, i.e. the number of
+    tokens of its longest sample."""
+    if not isinstance(sample, dict):
+        return 0
+    length = 0
+    for tokens in (sample.get("net_input", {}).get("src_tokens"), sample.get("target")):
+        if torch.is_tensor(tokens) and tokens.dim() >= 2:
+            length = max(length, tokens.size(1))
+    return length
+
+
 def _catalog_shared_params(module, memo=None, prefix=""):
     if memo is None:
         first_call = True
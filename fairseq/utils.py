@@ -115,6 +115,24 @@ def move_to_cuda(sample, device=None):
     return apply_to_sample(_move_to_cuda, sample)
 
 
+def widen_native_dtype(sample):
+    """Widen the token tensors of a batch read with ``--dataset-native-dtype``,
+    which keep their stored integer dtype (e.g. uint16) through collation, to
+    the int64 that models, criterions and generators expect. Called once the
+    batch is on its device, so only the narrow tokens are copied there."""
+    narrow_dtypes = {torch.int16, torch.int32}
+    narrow_dtypes.update(
+        getattr(torch, name) for name in ("uint16", "uint32") if hasattr(torch, name)
+    )
+
+    def _widen(tensor):
+        if tensor.dtype in narrow_dtypes:
+            return tensor.long()
+        return tensor
+
+    return apply_to_sample(_widen, sample)
+
+
 def move_to_cpu(sample):
     def _move_to_cpu(tensor):
         # PyTorch has poor support for half tensors (float16) on CPU.
@@ -266,6 +284,31 @@ def make_positions(tensor, padding_idx: int, onnx_trace: bool = False):
     return (torch.cumsum(mask, dim=1).type_as(mask) * mask).long() + padding_idx
 
 
+def make_segment_positions(segment_ids, padding_idx: int):
+    """Replace the symbols of packed rows with their position numbers.
+
+    Like :func:`make_positions`, but position numbers restart at padding_idx+1
+    at the start of every segment of *segment_ids*. Padding is marked by a
+    segment id of -1.
+    """
+    mask = segment_ids.ne(-1)
+    steps = torch.arange(segment_ids.size(1), device=segment_ids.device)
+    steps = steps.unsqueeze(0).expand_as(segment_ids)
+    is_start = torch.ones_like(mask)
+    is_start[:, 1:] = segment_ids[:, 1:].ne(segment_ids[:, :-1])
+    starts = torch.where(is_start, steps, torch.zeros_like(steps)).cummax(dim=1)[0]
+    return ((steps - starts + 1) * mask).long() + padding_idx
+
+
+def make_segment_attention_mask(segment_ids):
+    """Return a `(bsz, seq_len, seq_len)` mask that is True where a query and a
+    key belong to different segments of *segment_ids*, so that the sequences
+    packed into a row do not attend to each other. Padding queries (segment
+    id -1) are left unmasked."""
+    mask = segment_ids.unsqueeze(2).ne(segment_ids.unsqueeze(1))
+    return mask & segment_ids.ne(-1).unsqueeze(2)
+
+
 def strip_pad(tensor, pad):
     return tensor[tensor.ne(pad)]
 
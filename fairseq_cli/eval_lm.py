@@ -109,6 +109,7 @@ def eval_lm(
             continue
 
         sample = utils.move_to_cuda(sample, device=device)
+        sample = utils.widen_native_dtype(sample)
 
         gen_timer.start()
         hypos = scorer.generate(models, sample)
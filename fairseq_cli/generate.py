@@ -186,6 +186,7 @@ def _main(cfg: DictConfig, output_file):
     wps_meter = TimeMeter()
     for sample in progress:
         sample = utils.move_to_cuda(sample) if use_cuda else sample
+        sample = utils.widen_native_dtype(sample)
         if "net_input" not in sample:
             continue
 
@@ -145,6 +145,7 @@ def validate(cfg):
         log_outputs = []
         for i, sample in enumerate(progress):
             sample = utils.move_to_cuda(sample) if use_cuda else sample
+            sample = utils.widen_native_dtype(sample)
 
             if use_fp16:
                 sample = utils.apply_to_sample(apply_half, sample)
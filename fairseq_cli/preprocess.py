@@ -19,9 +19,11 @@ from fairseq import options, tasks, utils
 from fairseq.binarizer import (
     AlignmentDatasetBinarizer,
     FileBinarizer,
+    InterimBinarizer,
     VocabularyDatasetBinarizer,
 )
 from fairseq.data import Dictionary
+from fairseq.tasks import FairseqTask
 
 logging.basicConfig(
     format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
@@ -82,15 +84,54 @@ def _build_dictionary(
     args,
     src=False,
     tgt=False,
+    interim=None,
 ):
     assert src ^ tgt
+    assert (
+        "-" not in filenames or interim is not None
+    ), "stdin can only be read once, use --srcdict or --single-pass"
+    if interim is not None:
+        return _build_dictionary_single_pass(
+            filenames, task, args, interim, src=src, tgt=tgt
+        )
     return task.build_dictionary(
         filenames,
         workers=args.workers,
         threshold=args.thresholdsrc if src else args.thresholdtgt,
         nwords=args.nwordssrc if src else args.nwordstgt,
         padding_factor=args.padding_factor,
+        max_symbols=args.dict_max_symbols,
+    )
+
+
+def _build_dictionary_single_pass(filenames, task, args, interim, src=False, tgt=False):
+    """
+    Build the dictionary from interim tokenized copies of *filenames*, which
+    are kept in *interim* so that the training set is remapped to the final
+    ids instead of being read again.
+    """
+    assert (
+        task.build_dictionary.__func__ is FairseqTask.build_dictionary.__func__
+    ), "--single-pass only supports tasks with the default dictionary"
+    assert (
+        args.dict_max_symbols is None
+    ), "--single-pass cannot be combined with --dict-max-symbols"
+    d = Dictionary()
+    for filename in sorted(filenames):
+        interim[filename] = InterimBinarizer.tokenize(
+            filename,
+            os.path.join(args.destdir, os.path.basename(filename) + ".interim"),
+            d.eos_word,
+            num_workers=args.workers,
+        )
+        for chunk in interim[filename]:
+            chunk.add_counts_to(d)
+    d.finalize(
+        threshold=args.thresholdsrc if src else args.thresholdtgt,
+        nwords=args.nwordssrc if src else args.nwordstgt,
+        padding_factor=args.padding_factor,
     )
+    return d
 
 
 #####################################################################
@@ -105,6 +146,7 @@ def _make_binary_dataset(
     lang: tp.Optional[str],
     num_workers: int,
     args: Namespace,
+    interim=None,
 ):
     logger.info("[{}] Dictionary: {} types".format(lang, len(vocab)))
 
@@ -116,14 +158,20 @@ def _make_binary_dataset(
     input_file = "{}{}".format(input_prefix, ("." + lang) if lang is not None else "")
     full_output_prefix = dataset_dest_prefix(args, output_prefix, lang)
 
-    final_summary = FileBinarizer.multiprocess_dataset(
-        input_file,
-        args.dataset_impl,
-        binarizer,
-        full_output_prefix,
-        vocab_size=len(vocab),
-        num_workers=num_workers,
-    )
+    if interim is not None and input_file in interim:
+        # already tokenized while building the dictionary
+        final_summary = InterimBinarizer.remap(
+            interim.pop(input_file), vocab, full_output_prefix, args.dataset_impl
+        )
+    else:
+        final_summary = FileBinarizer.multiprocess_dataset(
+            input_file,
+            args.dataset_impl,
+            binarizer,
+            full_output_prefix,
+            vocab_size=len(vocab),
+            num_workers=num_workers,
+        )
 
     logger.info(f"[{lang}] {input_file}: {final_summary} (by {vocab.unk_word})")
 
@@ -165,6 +213,7 @@ def _make_dataset(
     lang: tp.Optional[str],
     args: Namespace,
     num_workers: int,
+    interim=None,
 ):
     if args.dataset_impl == "raw":
         # Copy original text file to destination folder
@@ -176,14 +225,20 @@ def _make_dataset(
         shutil.copyfile(_file_name(input_prefix, lang), output_text_file)
     else:
         _make_binary_dataset(
-            vocab, input_prefix, output_prefix, lang, num_workers, args
+            vocab, input_prefix, output_prefix, lang, num_workers, args, interim
         )
 
 
-def _make_all(lang, vocab, args):
+def _make_all(lang, vocab, args, interim=None):
     if args.trainpref:
         _make_dataset(
-            vocab, args.trainpref, "train", lang, args=args, num_workers=args.workers
+            vocab,
+            args.trainpref,
+            "train",
+            lang,
+            args=args,
+            num_workers=args.workers,
+            interim=interim,
         )
     if args.validpref:
         for k, validpref in enumerate(args.validpref.split(",")):
@@ -307,6 +362,13 @@ def main(args):
 
     task = tasks.get_task(args.task)
 
+    # interim tokenized training files, keyed by file name
+    interim = (
+        {}
+        if args.single_pass and not args.dict_only and args.dataset_impl != "raw"
+        else None
+    )
+
     if args.joined_dictionary:
         assert (
             not args.srcdict or not args.tgtdict
@@ -328,6 +390,7 @@ def main(args):
                 task=task,
                 args=args,
                 src=True,
+                interim=interim,
             )
         tgt_dict = src_dict
     else:
@@ -342,6 +405,7 @@ def main(args):
                 task=task,
                 args=args,
                 src=True,
+                interim=interim,
             )
 
         if target:
@@ -356,6 +420,7 @@ def main(args):
                     task=task,
                     args=args,
                     tgt=True,
+                    interim=interim,
                 )
         else:
             tgt_dict = None
@@ -369,9 +434,9 @@ def main(args):
     if args.dict_only:
         return
 
-    _make_all(args.source_lang, src_dict, args)
+    _make_all(args.source_lang, src_dict, args, interim)
     if target:
-        _make_all(args.target_lang, tgt_dict, args)
+        _make_all(args.target_lang, tgt_dict, args, interim)
 
     # align the datasets if needed
     if args.align_suffix:
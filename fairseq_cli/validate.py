@@ -117,6 +117,7 @@ def main(cfg: DictConfig, override_args=None):
         log_outputs = []
         for i, sample in enumerate(progress):
             sample = utils.move_to_cuda(sample) if use_cuda else sample
+            sample = utils.widen_native_dtype(sample)
             _loss, _sample_size, log_output = task.valid_step(sample, model, criterion)
             progress.log(log_output, step=i)
             log_outputs.append(log_output)
@@ -1,10 +1,17 @@
+import itertools
+import logging
 import os
-import pickle
 from datetime import datetime
 
+from omegaconf import open_dict
+
+from fairseq.attention_store import AttentionStore, AttentionStoreReader, id_key
 from fairseq.models.transformer import TransformerModel
 from fairseq.data import Dictionary
 
+logging.basicConfig(format='%(asctime)s | %(levelname)s | %(name)s | %(message)s', level=logging.INFO)
+logger = logging.getLogger('selective_processes')
+
 # make sure to set '2024-01-26 model_outputs' as the working directory
 # and also environment variable for pickle
 
@@ -26,57 +33,67 @@ CHECKPOINT = 'checkpoint97.pt'
 #DICTIONARY = os.path.join(DATA_BIN, 'dict.en.txt')
 #CHECKPOINT = 'model.pt'
 
-
-def pkl_handler(dest_path: str,
-                key_to_write: str = None,
-                value_to_write: any = None,
-                new: bool = False,
-                flatten_key: tuple = 0) -> None:
-    if key_to_write is None:
-        # create new pkl file.
-        dummy = {}
-        with open(dest_path, 'wb') as file:
-            pickle.dump(dummy, file)
-        return
-
-    with open(dest_path, 'rb') as file:
-        # Load the dummy pickled object for the first time
-        attention_pickle = pickle.load(file)
-
-    if new:
-        attention_pickle[flatten_key] = {'input_word': value_to_write}
-    else:
-        attention_pickle[flatten_key][key_to_write] = value_to_write
-
-    with open(dest_path, 'wb') as file:
-        # Pickle the 'data' dictionary and write it to the file
-        pickle.dump(attention_pickle, file)
-    return
-
-
-def extract_attention(model, input_word: str, pkl_path:str):
-    print(f'Input: {input_word}')
-    src_tokens = model.encode(input_word)
-    flatten_key = tuple(src_tokens.numpy().flatten())
-
-    # add input_word to pickle
-    pkl_handler(dest_path=pkl_path, new=True, key_to_write='input_word',
-                value_to_write=input_word, flatten_key=flatten_key)
-
-    output_word = model.translate(sentence=input_word, verbose=True)
-    print(f'Output: {output_word}')
-
-    # add output_word to pickle
-    pkl_handler(dest_path=pkl_path, key_to_write='output_word', value_to_write=output_word, flatten_key=flatten_key)
+# the word list is translated in chunks of WORDS_PER_CHUNK words, in batches
+# of at most MAX_TOKENS source tokens
+MAX_TOKENS = 4096
+WORDS_PER_CHUNK = 1000
+BEAM = 5
+# keep the words already in the attention store and continue after them
+RESUME = True
+
+
+def completed_words(store_path: str) -> int:
+    """Number of words of the word list with a complete record in the store."""
+    if not os.path.exists(os.path.join(store_path, 'index.jsonl')):
+        return 0
+    reader = AttentionStoreReader(store_path)
+    word_ids = [reader.get(key, 'word_id') for key in reader
+                if {'word_id', 'output_word'} <= set(reader.fields(key))]
+    return max(word_ids, default=-1) + 1
+
+
+def extract_attention_batched(model, words, store: AttentionStore, start: int = 0,
+                              max_tokens: int = MAX_TOKENS, words_per_chunk: int = WORDS_PER_CHUNK,
+                              beam: int = BEAM):
+    """Translate the iterable *words*, whose first word has id *start*, and add
+    them to the store.
+
+    The sequence generator stores the attention of each word of a batch in the
+    record of its word id (see fairseq.attention_store.id_key), so that a word
+    that occurs more than once in the list gets a record each. The word and its
+    translation are added to the record once its chunk is translated. The
+    output_word of a record thus marks it as complete.
+    """
+    with open_dict(model.cfg):
+        model.cfg.dataset.max_tokens = max_tokens
+        model.cfg.dataset.batch_size = None
+
+    words = iter(words)
+    while True:
+        chunk = list(itertools.islice(words, words_per_chunk))
+        if not chunk:
+            break
+        logger.info(f'start working on words #{start} to #{start + len(chunk) - 1}.')
+        src_tokens = model.encode_batch(chunk)
+        # the hypotheses come back in the order of src_tokens, and the generator
+        # keys the records by start + the position of the word in the chunk
+        store.id_offset = start
+        hypos = model.generate(src_tokens, beam=beam)
+        for i, (word, word_hypos) in enumerate(zip(chunk, hypos)):
+            key = id_key(start + i)
+            store.put(key, 'word_id', start + i)
+            store.put(key, 'input_word', word)
+            store.put(key, 'output_word', model.decode(word_hypos[0]['tokens']))
+        start += len(chunk)
 
 
 def main():
     # Initial printout to help myself...
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f'[DEBUG] The start time is {now}.')
+    logger.info(f'The start time is {now}.')
     pkl_dir = os.environ["PKL_LOC"].split(',')
-    pkl_path = os.path.join(os.getcwd(), pkl_dir[0], f'{pkl_dir[1]}.pkl')
-    print(f'[DEBUG] Working directory: {os.getcwd()} || Pickle location: {pkl_path}')
+    store_path = os.path.join(os.getcwd(), pkl_dir[0], pkl_dir[1])
+    logger.info(f'Working directory: {os.getcwd()} || Attention store location: {store_path}')
 
     # Script actually starts here.
 
@@ -85,21 +102,23 @@ def main():
     underlying_model = model.models[0]  # since 'model' is a GeneratorHubInterface instance, wrapping the actual model.
     dictionary = Dictionary.load(DICTIONARY)
 
-    # prepare pkl file to save attention weights.
-    pkl_handler(pkl_path)
+    # open the attention store, shared with the sequence generator.
+    # read it back with fairseq.attention_store.AttentionStoreReader(store_path)
+    start = completed_words(store_path) if RESUME else 0
+    store = AttentionStore.open(store_path, truncate=start == 0)
+    if start > 0:
+        logger.info(f'resuming after {start} words.')
 
-    # load the wordlist I used for the human experiment
+    # stream the wordlist I used for the human experiment
     experiment_wordlist_path = os.path.join('2024-03-08 apply_translation', 'entries.txt')
     with open(experiment_wordlist_path, 'r', encoding='utf-8') as file:
-        words = [line.strip() for line in file]
-
-    # iterate over the words
-    for i, word in enumerate(words):
-        print(f'[DEBUG] start working on word #{i}: {word}.')
-        extract_attention(model=model,
-                          input_word=word,
-                          pkl_path=pkl_path
-                          )
+        words = (line.strip() for line in itertools.islice(file, start, None))
+        extract_attention_batched(model=model,
+                                  words=words,
+                                  store=store,
+                                  start=start
+                                  )
+    store.close()
 
 
 if __name__ == '__main__':
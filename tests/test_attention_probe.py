@@ -0,0 +1,76 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import unittest
+
+import torch
+from fairseq.models.transformer import TransformerModel
+from tests.test_export import get_dummy_task_and_parser
+
+
+class TestAttentionProbe(unittest.TestCase):
+    def setUp(self):
+        task, parser = get_dummy_task_and_parser()
+        TransformerModel.add_args(parser)
+        args = parser.parse_args([])
+        args.encoder_layers = 3
+        args.encoder_embed_dim = 16
+        args.encoder_ffn_embed_dim = 32
+        args.encoder_attention_heads = 4
+        args.decoder_layers = 1
+        args.decoder_embed_dim = 16
+        args.decoder_ffn_embed_dim = 32
+        args.decoder_attention_heads = 4
+        torch.manual_seed(0)
+        self.model = TransformerModel.build_model(args, task).eval()
+        self.src_tokens = torch.randint(4, 50, (2, 7))
+        self.src_tokens[1, :2] = task.dictionary.pad()
+        self.src_lengths = torch.LongTensor([7, 5])
+
+    def encode(self, **kwargs):
+        return self.model.encoder(self.src_tokens, self.src_lengths, **kwargs)
+
+    def test_no_probe(self):
+        self.assertEqual(self.encode()["encoder_attn"], [])
+        full = self.encode(return_all_attn=True)["encoder_attn"]
+        self.assertEqual(len(full), 3)
+        self.assertEqual(full[0].size(), (4, 2, 7, 7))
+
+    def test_probe(self):
+        expected = self.encode(return_all_attn=True)
+        with self.model.attention_probes(
+            layers=[0, 2], heads=[1, 3], reduce="mean_heads"
+        ) as mean_probe, self.model.attention_probes(layers=[1]) as head_probe:
+            out = self.encode()
+        self.assertEqual(out["encoder_attn"], [])
+        self.assertTrue(
+            torch.allclose(out["encoder_out"][0], expected["encoder_out"][0], atol=1e-6)
+        )
+
+        self.assertEqual(sorted(mean_probe.attn), [0, 2])
+        for layer in [0, 2]:
+            self.assertTrue(
+                torch.allclose(
+                    mean_probe.attn[layer],
+                    expected["encoder_attn"][layer][[1, 3]].mean(dim=0),
+                )
+            )
+        self.assertEqual(len(head_probe.weights()), 1)
+        self.assertTrue(
+            torch.allclose(head_probe.weights()[0], expected["encoder_attn"][1])
+        )
+
+        # removed probes no longer capture
+        self.assertEqual(self.model.encoder._probed_layers(), [])
+        mean_probe.attn.clear()
+        self.encode()
+        self.assertEqual(mean_probe.attn, {})
+
+        with self.assertRaises(ValueError):
+            self.model.attention_probes(reduce="sum")
+
+
+if __name__ == "__main__":
+    unittest.main()
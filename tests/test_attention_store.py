@@ -0,0 +1,277 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+import tempfile
+import unittest
+
+import torch
+from fairseq.attention_store import (
+    INDEX_FILE,
+    AttentionStore,
+    AttentionStoreReader,
+    CaptureConfig,
+    GenerationCapture,
+    compress_attention,
+    id_key,
+    token_key,
+)
+
+
+class TestAttentionStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmpdir.name, "att")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_round_trip(self):
+        src_tokens = torch.LongTensor([[4, 5, 2]])
+        encoder_outs = [
+            {
+                "encoder_out": [torch.rand(3, 1, 8)],
+                "encoder_padding_mask": [torch.zeros(1, 3, dtype=torch.bool)],
+                "encoder_states": [],
+                "encoder_attn": [torch.rand(2, 1, 3, 3), torch.rand(2, 1, 3, 3)],
+                "fc_results": [None],
+            }
+        ]
+        steps = [torch.rand(1, 3) for _ in range(4)]
+
+        store = AttentionStore(self.root, max_shard_bytes=200)
+        store.put([4, 5, 2], "input_word", "word")
+        store.put(src_tokens, "encoder_outs", encoder_outs)
+        for step in steps:
+            store.append(src_tokens, "decoder_attn", step)
+        store.append(src_tokens, "decoder_attn", None)
+        store.put(token_key([7, 2]), "input_word", "other")
+        store.close()
+        # small shards roll over
+        self.assertTrue(os.path.exists(os.path.join(self.root, "data-00001.bin")))
+
+        reader = AttentionStoreReader(self.root)
+        self.assertEqual(len(reader), 2)
+        self.assertIn(src_tokens, reader)
+        self.assertEqual(reader.tokens(token_key(src_tokens)), [4, 5, 2])
+        record = reader[src_tokens]
+        self.assertEqual(sorted(record), ["decoder_attn", "encoder_outs", "input_word"])
+        self.assertEqual(record["input_word"], "word")
+        self.assertEqual(reader.get([7, 2], "input_word"), "other")
+
+        out = record["encoder_outs"]
+        self.assertEqual(len(out), 1)
+        self.assertEqual(sorted(out[0]), sorted(encoder_outs[0]))
+        self.assertEqual(out[0]["encoder_states"], [])
+        self.assertEqual(out[0]["fc_results"], [None])
+        for k in ["encoder_out", "encoder_padding_mask", "encoder_attn"]:
+            self.assertEqual(len(out[0][k]), len(encoder_outs[0][k]))
+            for a, b in zip(out[0][k], encoder_outs[0][k]):
+                self.assertTrue(torch.equal(a, b))
+        self.assertEqual(len(record["decoder_attn"]), 5)
+        for a, b in zip(record["decoder_attn"], steps):
+            self.assertTrue(torch.equal(a, b))
+        self.assertIsNone(record["decoder_attn"][-1])
+
+    def test_reopen(self):
+        store = AttentionStore.open(self.root)
+        self.assertIs(AttentionStore.open(self.root), store)
+        store.append([1], "decoder_attn", torch.ones(2))
+        store.close()
+        # an interrupted write leaves a partial index line
+        with open(os.path.join(self.root, INDEX_FILE), "a") as f:
+            f.write('{"key": ')
+
+        store = AttentionStore.open(self.root)
+        store.append([1], "decoder_attn", torch.zeros(2))
+        store.put([1], "output_word", "out")
+        store.close()
+        record = AttentionStoreReader(self.root)[[1]]
+        self.assertEqual(record["output_word"], "out")
+        self.assertEqual(
+            [t.tolist() for t in record["decoder_attn"]], [[1.0, 1.0], [0.0, 0.0]]
+        )
+
+        # generating again resets the steps
+        store = AttentionStore.open(self.root)
+        store.put([1], "decoder_attn", [])
+        store.append([1], "decoder_attn", torch.ones(2))
+        store.close()
+        reader = AttentionStoreReader(self.root)
+        for _ in range(2):
+            self.assertEqual(len(reader.get([1], "decoder_attn")), 1)
+
+        store = AttentionStore.open(self.root, truncate=True)
+        store.close()
+        self.assertEqual(len(AttentionStoreReader(self.root)), 0)
+
+    def test_index_follows_data(self):
+        calls = []
+
+        class Recorder:
+            def __init__(self, name, f):
+                self.name, self.f = name, f
+
+            def __getattr__(self, attr):
+                return getattr(self.f, attr)
+
+            def write(self, data):
+                calls.append(f"{self.name} write")
+                return self.f.write(data)
+
+            def flush(self):
+                calls.append(f"{self.name} flush")
+                self.f.flush()
+
+        store = AttentionStore(self.root)
+        store._data = Recorder("data", store._data)
+        store._index = Recorder("index", store._index)
+        for _ in range(20):
+            store.append([1], "decoder_attn", torch.rand(3))
+        store.close()
+
+        self.assertIn("index write", calls)
+        for i, call in enumerate(calls):
+            if call == "index write":
+                last_data = max(
+                    j for j, c in enumerate(calls[:i]) if c.startswith("data")
+                )
+                self.assertEqual(calls[last_data], "data flush")
+        self.assertEqual(
+            len(AttentionStoreReader(self.root).get([1], "decoder_attn")), 20
+        )
+
+    def test_compress(self):
+        attn = torch.softmax(torch.randn(2, 3, 10), dim=-1)
+        store = AttentionStore(self.root)
+        configs = {
+            "float16": CaptureConfig(dtype="float16"),
+            "int8": CaptureConfig(dtype="int8"),
+            "topk": CaptureConfig(topk=4, dtype="int8"),
+        }
+        for name, config in configs.items():
+            store.put([1], name, compress_attention(attn, config))
+        store.close()
+        self.assertEqual(
+            CaptureConfig.from_string("topk=4,dtype=int8"), configs["topk"]
+        )
+
+        record = AttentionStoreReader(self.root)[[1]]
+        self.assertEqual(record["float16"].dtype, torch.float16)
+        self.assertTrue(torch.allclose(record["float16"].float(), attn, atol=1e-3))
+        self.assertTrue(torch.allclose(record["int8"], attn, atol=0.5 / 255 + 1e-6))
+        values, indices = attn.topk(4, dim=-1)
+        topk = torch.zeros_like(attn).scatter_(-1, indices, values)
+        self.assertEqual(record["topk"].size(), attn.size())
+        self.assertTrue(torch.allclose(record["topk"], topk, atol=0.5 / 255 + 1e-6))
+
+    def test_generation_capture(self):
+        pad, beam_size = 1, 2
+        src_tokens = torch.LongTensor([[4, 5, 6, 2], [pad, pad, 7, 2], [pad, 8, 9, 2]])
+        encoder_out = {
+            "encoder_out": [torch.rand(4, 3, 8)],
+            "encoder_padding_mask": [src_tokens.eq(pad)],
+            "encoder_states": [],
+            "src_lengths": [torch.LongTensor([[4], [2], [3]])],
+        }
+        encoder_attn = torch.rand(2, 3, 4, 4)
+        steps = [torch.rand(6, 4), torch.rand(4, 4)]
+
+        store = AttentionStore(self.root, capture=CaptureConfig(dtype="float16"))
+        capture = GenerationCapture(store, src_tokens, pad, beam_size)
+        capture.encoder([encoder_out], [[encoder_attn]])
+        capture.decoder_step(steps[0])
+        # the second sentence is done
+        capture.select(torch.LongTensor([0, 2]))
+        capture.decoder_step(steps[1])
+        store.close()
+
+        reader = AttentionStoreReader(self.root)
+        self.assertEqual(len(reader), 3)
+        record = reader[[7, 2]]
+        out = record["encoder_outs"][0]
+        self.assertTrue(
+            torch.equal(out["encoder_out"][0], encoder_out["encoder_out"][0][2:, 1:2])
+        )
+        self.assertEqual(out["encoder_padding_mask"][0].tolist(), [[False, False]])
+        self.assertEqual(out["encoder_states"], [])
+        self.assertEqual(out["src_lengths"][0].tolist(), [[2]])
+        self.assertTrue(
+            torch.allclose(
+                out["encoder_attn"][0].float(),
+                encoder_attn[:, 1:2, 2:, 2:],
+                atol=1e-3,
+            )
+        )
+        self.assertEqual(len(record["decoder_attn"]), 1)
+        self.assertTrue(
+            torch.allclose(
+                record["decoder_attn"][0].float(), steps[0][2:4, 2:], atol=1e-3
+            )
+        )
+
+        record = reader[[8, 9, 2]]
+        self.assertEqual(
+            record["encoder_outs"][0]["encoder_attn"][0].size(), (2, 1, 3, 3)
+        )
+        self.assertEqual([a.size() for a in record["decoder_attn"]], [(2, 3), (2, 3)])
+        self.assertTrue(
+            torch.allclose(
+                record["decoder_attn"][1].float(), steps[1][2:4, 1:], atol=1e-3
+            )
+        )
+
+    def test_generation_capture_topk(self):
+        pad, beam_size = 1, 2
+        src_tokens = torch.LongTensor([[4, 5, 6, 2], [pad, pad, 7, 2], [pad, 8, 9, 2]])
+        step = torch.rand(6, 4)
+        config = CaptureConfig(topk=2, dtype="int8")
+
+        store = AttentionStore(self.root, capture=config)
+        capture = GenerationCapture(store, src_tokens, pad, beam_size)
+        capture.decoder_step(step)
+        store.close()
+
+        # the same as reducing each sentence without its padding
+        reader = AttentionStoreReader(self.root)
+        for i, tokens in enumerate([[4, 5, 6, 2], [7, 2], [8, 9, 2]]):
+            rows = step[i * beam_size : (i + 1) * beam_size, -len(tokens) :]
+            expected = compress_attention(rows, config)
+            if expected.indices is not None:
+                expected = torch.zeros(expected.size).scatter_(
+                    -1, expected.indices.long(), expected.values.float() / 255
+                )
+            else:
+                expected = expected.values.float() / 255
+            (actual,) = reader.get(tokens, "decoder_attn")
+            self.assertEqual(actual.size(), (beam_size, len(tokens)))
+            self.assertTrue(torch.allclose(actual, expected))
+
+    def test_generation_capture_ids(self):
+        pad, beam_size = 1, 1
+        # the same source twice
+        src_tokens = torch.LongTensor([[7, 2], [7, 2]])
+        steps = torch.rand(2, 2)
+
+        store = AttentionStore(self.root)
+        store.id_offset = 10
+        capture = GenerationCapture(
+            store, src_tokens, pad, beam_size, ids=torch.LongTensor([1, 0])
+        )
+        capture.decoder_step(steps)
+        store.close()
+
+        reader = AttentionStoreReader(self.root)
+        self.assertEqual(len(reader), 2)
+        self.assertNotIn([7, 2], reader)
+        self.assertEqual(reader.tokens(id_key(11)), [7, 2])
+        (actual,) = reader.get(id_key(11), "decoder_attn")
+        self.assertTrue(torch.equal(actual, steps[:1]))
+        (actual,) = reader.get(id_key(10), "decoder_attn")
+        self.assertTrue(torch.equal(actual, steps[1:]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,13 +4,21 @@
 # LICENSE file in the root directory of this source tree.
 
 
+import gzip
 import os
 import typing as tp
 import unittest
 from tempfile import TemporaryDirectory
-
-from fairseq.binarizer import BinarizeSummary, FileBinarizer, VocabularyDatasetBinarizer
+from unittest.mock import patch
+
+from fairseq.binarizer import (
+    BinarizeSummary,
+    FileBinarizer,
+    InterimBinarizer,
+    VocabularyDatasetBinarizer,
+)
 from fairseq.data import Dictionary, indexed_dataset
+from fairseq.tokenizer import tokenize_line
 from tests.utils import make_data, sizes
 
 
@@ -58,6 +66,30 @@ class TestBinarizer(unittest.TestCase):
         self.assertEqual(summary.num_tok, len(sentence) + 1)
         self.assertEqual(summary.num_seq, 1)
 
+    def test_binarize_lines_uses_overridden_encode_line(self):
+        class ReversedDictionary(Dictionary):
+            def encode_line(self, line, **kwargs):
+                return super().encode_line(" ".join(reversed(line.split())), **kwargs)
+
+        data = make_data(length=3)
+        vocab = build_vocab(data)
+        reversed_vocab = ReversedDictionary()
+        reversed_vocab.update(vocab)
+        lines = [" ".join(sentence) for sentence in data]
+
+        tokens, offsets = VocabularyDatasetBinarizer(reversed_vocab).binarize_lines(
+            lines, BinarizeSummary()
+        )
+        self.assertEqual(
+            tokens.tolist(),
+            [
+                idx
+                for line in lines
+                for idx in reversed_vocab.encode_line(line, add_if_not_exist=False)
+            ],
+        )
+        self.assertEqual(offsets.tolist()[-1], sum(len(s) + 1 for s in data))
+
     def test_can_binarize_file_chunk(self):
         # test without multiprocess logic
         with TemporaryDirectory() as dirname:
@@ -86,10 +118,14 @@ class TestBinarizer(unittest.TestCase):
             self.compare_ds_data(summary, data, prefix, impl, vocab)
 
     def test_can_multiprocess(self):
+        for impl in ["mmap", "compressed"]:
+            with self.subTest(impl=impl):
+                self._test_can_multiprocess(impl)
+
+    def _test_can_multiprocess(self, impl):
         with TemporaryDirectory() as dirname:
             raw_file = os.path.join(dirname, "raw1")
             prefix = os.path.join(dirname, "test1")
-            impl = "mmap"
             data = make_data(out_file=raw_file)
             vocab = build_vocab(data)
             binarizer = VocabularyDatasetBinarizer(
@@ -120,3 +156,86 @@ class TestBinarizer(unittest.TestCase):
             )
 
             self.compare_ds_data(summary, data, prefix_multi, impl, vocab)
+
+    def test_interim_matches_two_pass(self):
+        for impl in ["mmap", "compressed"]:
+            with self.subTest(impl=impl):
+                self._test_interim_matches_two_pass(impl)
+
+    def _test_interim_matches_two_pass(self, impl):
+        with TemporaryDirectory() as dirname:
+            raw_file = os.path.join(dirname, "raw1")
+            data = make_data(out_file=raw_file)
+
+            for num_workers in [1, 3]:
+                # two passes: build the dictionary, then binarize
+                vocab = Dictionary()
+                Dictionary.add_file_to_dictionary(
+                    raw_file, vocab, tokenize_line, num_workers
+                )
+                vocab.finalize(threshold=2)
+                prefix = os.path.join(dirname, f"two_pass{num_workers}")
+                summary = FileBinarizer.multiprocess_dataset(
+                    raw_file,
+                    impl,
+                    VocabularyDatasetBinarizer(vocab),
+                    output_prefix=prefix,
+                    vocab_size=len(vocab),
+                    num_workers=num_workers,
+                )
+
+                # one pass: interim ids remapped to the finalized dictionary
+                interim_prefix = os.path.join(dirname, "interim")
+                chunks = InterimBinarizer.tokenize(
+                    raw_file,
+                    interim_prefix,
+                    vocab.eos_word,
+                    num_workers=num_workers,
+                )
+                interim_vocab = Dictionary()
+                for chunk in chunks:
+                    chunk.add_counts_to(interim_vocab)
+                interim_vocab.finalize(threshold=2)
+                self.assertEqual(interim_vocab.symbols, vocab.symbols)
+                self.assertEqual(interim_vocab.count, vocab.count)
+
+                prefix_interim = os.path.join(dirname, f"one_pass{num_workers}")
+                interim_summary = InterimBinarizer.remap(
+                    chunks, interim_vocab, prefix_interim, impl
+                )
+                self.assertEqual(interim_summary.num_seq, summary.num_seq)
+                self.assertEqual(interim_summary.num_tok, summary.num_tok)
+                self.assertEqual(interim_summary.replaced, summary.replaced)
+
+                expected = indexed_dataset.make_dataset(prefix, impl)
+                dataset = indexed_dataset.make_dataset(prefix_interim, impl)
+                self.assertEqual(len(dataset), len(expected))
+                for i in range(len(dataset)):
+                    self.assertEqual(dataset[i].tolist(), expected[i].tolist())
+                # the interim files are removed
+                self.assertFalse(
+                    any(f.startswith("interim") for f in os.listdir(dirname))
+                )
+
+    def test_can_stream(self):
+        with TemporaryDirectory() as dirname:
+            raw_file = os.path.join(dirname, "raw1")
+            data = make_data(out_file=raw_file)
+            vocab = build_vocab(data)
+            with open(raw_file, "rb") as f, gzip.open(raw_file + ".gz", "wb") as g:
+                g.write(f.read())
+
+            binarizer = VocabularyDatasetBinarizer(vocab, append_eos=False)
+            for num_workers in [1, 3]:
+                prefix = os.path.join(dirname, f"test{num_workers}")
+                # many small batches, to check that they are written in order
+                with patch("fairseq.binarizer._LINES_PER_BATCH", 7):
+                    summary = FileBinarizer.multiprocess_dataset(
+                        raw_file + ".gz",
+                        "mmap",
+                        binarizer,
+                        output_prefix=prefix,
+                        vocab_size=len(vocab),
+                        num_workers=num_workers,
+                    )
+                self.compare_ds_data(summary, data, prefix, "mmap", vocab)
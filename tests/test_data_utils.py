@@ -7,7 +7,18 @@ import unittest
 
 import numpy as np
 
-from fairseq.data.data_utils_fast import batch_by_size_fn, batch_by_size_vec
+from fairseq.data.data_utils import (
+    batch_by_size_min_padding,
+    batch_by_size_vec_numpy,
+    batch_fixed_shapes_numpy,
+    get_padding_optimal_buckets,
+    padding_efficiency,
+)
+from fairseq.data.data_utils_fast import (
+    batch_by_size_fn,
+    batch_by_size_vec,
+    batch_fixed_shapes_fast,
+)
 
 
 class TestBatchBySize(unittest.TestCase):
@@ -132,5 +143,83 @@ class TestBatchBySizeFn(TestBatchBySize):
         self._run_compare_with_baseline_sweep(batch_by_size_fn_wrapper)
 
 
+class TestBatchBySizeVecNumpy(TestBatchBySize):
+    def test_compare_with_baseline(self):
+        self._run_compare_with_baseline_sweep(batch_by_size_vec_numpy)
+
+    def test_compare_with_cython_long(self):
+        rng = np.random.RandomState(0)
+        num_tokens_vec = rng.randint(1, 200, size=100000)
+        indices = rng.permutation(len(num_tokens_vec))
+        for max_tokens, max_sentences, bsz_mult in [(4096, -1, 8), (2000, 7, 1)]:
+            expected = batch_by_size_vec(
+                indices, num_tokens_vec, max_tokens, max_sentences, bsz_mult
+            )
+            results = batch_by_size_vec_numpy(
+                indices, num_tokens_vec, max_tokens, max_sentences, bsz_mult
+            )
+            self.assertEqual(len(expected), len(results))
+            for first, second in zip(expected, results):
+                self.assertTrue(np.array_equal(first, second))
+
+
+class TestBatchFixedShapesNumpy(unittest.TestCase):
+    def test_compare_with_cython(self):
+        rng = np.random.RandomState(0)
+        for _ in range(500):
+            num_shapes = rng.randint(1, 5)
+            fixed_shapes = np.stack(
+                [rng.randint(1, 8, num_shapes), rng.randint(1, 10, num_shapes)], 1
+            )
+            num_tokens_vec = rng.randint(0, 12, size=rng.randint(0, 40))
+            indices = rng.permutation(len(num_tokens_vec))
+            sizes = dict(zip(indices.tolist(), num_tokens_vec.tolist()))
+            self.assertEqual(
+                batch_fixed_shapes_fast(indices, sizes.__getitem__, fixed_shapes),
+                batch_fixed_shapes_numpy(indices, num_tokens_vec, fixed_shapes),
+            )
+
+
+class TestBatchBySizeMinPadding(unittest.TestCase):
+    def test_padding_optimal_buckets(self):
+        sizes = np.array([1, 2, 2, 3, 10, 10, 11, 50])
+        self.assertEqual(get_padding_optimal_buckets(sizes, 3).tolist(), [3, 11, 50])
+        self.assertEqual(get_padding_optimal_buckets(sizes, 1).tolist(), [50])
+        self.assertEqual(
+            get_padding_optimal_buckets(sizes, 10).tolist(), [1, 2, 3, 10, 11, 50]
+        )
+
+    def test_padding_efficiency(self):
+        sizes = np.array([[2, 4], [4, 4], [3, 1]])
+        efficiency = padding_efficiency([np.array([0, 1]), np.array([2])], sizes)
+        self.assertTrue(np.allclose(efficiency, [9 / 11, 9 / 9]))
+
+    def test_batches(self):
+        rng = np.random.RandomState(0)
+        src = rng.randint(1, 100, size=2000)
+        tgt = np.maximum((src * rng.uniform(0.5, 1.5, size=2000)).astype(int), 1)
+        sizes = np.stack([src, tgt], axis=1)
+        num_tokens = sizes.max(axis=1)
+        indices = np.lexsort((src, tgt))
+        greedy = batch_by_size_vec(indices, num_tokens[indices], 1024, -1, 8)
+        batches = batch_by_size_min_padding(
+            indices,
+            num_tokens[indices],
+            max_tokens=1024,
+            required_batch_size_multiple=8,
+            sizes=sizes[indices],
+        )
+        self.assertEqual(
+            np.sort(np.concatenate(batches)).tolist(), list(range(len(indices)))
+        )
+        for batch in batches:
+            self.assertLessEqual(len(batch) * num_tokens[batch].max(), 1024)
+            self.assertTrue(len(batch) < 8 or len(batch) % 8 == 0)
+        self.assertGreater(
+            padding_efficiency(batches, sizes).min(),
+            padding_efficiency(greedy, sizes).min(),
+        )
+
+
 if __name__ == "__main__":
     unittest.main()
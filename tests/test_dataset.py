@@ -4,10 +4,13 @@
 # LICENSE file in the root directory of this source tree.
 
 import logging
+import os
 import unittest
+from tempfile import TemporaryDirectory
 from typing import Sequence
 
 from fairseq.data import LanguagePairDataset, ListDataset, RoundRobinZipDatasets
+from tests.test_indexed_dataset import make_items, make_mmap_dataset
 from tests.test_train import mock_dict
 
 
@@ -64,3 +67,29 @@ class TestDataset(unittest.TestCase):
         self.assertEqual(dict(dataset[0]), {"a": sample(5, 7), "b": sample(2, 9)})
         self.assertEqual(dict(dataset[2]), {"a": sample(0, 10), "b": sample(2, 9)})
         self.assertEqual(dict(dataset[4]), {"a": sample(6, 12), "b": sample(2, 9)})
+
+    def test_language_pair_dataset_getitems(self):
+        with TemporaryDirectory() as dirname:
+            src_prefix, tgt_prefix = (os.path.join(dirname, n) for n in "st")
+            src = make_mmap_dataset(src_prefix, [i + [2] for i in make_items()])
+            tgt = make_mmap_dataset(tgt_prefix, [[5] + i for i in make_items(seed=1)])
+            dataset = LanguagePairDataset(
+                src,
+                src.sizes,
+                mock_dict(),
+                tgt,
+                tgt.sizes,
+                mock_dict(),
+                remove_eos_from_source=True,
+                append_eos_to_target=True,
+            )
+            indices = [5, 0, 17, 5]
+            # the batched read gives the same samples as reading them one by one
+            samples = dataset.__getitems__(indices)
+            self.assertEqual(len(samples), len(indices))
+            for actual, index in zip(samples, indices):
+                expected = dataset[index]
+                self.assertEqual(actual["id"], index)
+                for key in ["source", "target"]:
+                    self.assertEqual(actual[key].tolist(), expected[key].tolist())
+            del src, tgt, dataset, samples
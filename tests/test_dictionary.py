@@ -8,10 +8,12 @@ import os
 import string
 import tempfile
 import unittest
+from collections import Counter
 
+import numpy as np
 import torch
 from fairseq import tokenizer
-from fairseq.data import Dictionary
+from fairseq.data import Dictionary, data_utils
 
 
 class TestDictionary(unittest.TestCase):
@@ -140,6 +142,130 @@ class TestDictionary(unittest.TestCase):
                     counts[c], count, f"{c} count is {count} but should be {counts[c]}"
                 )
 
+    def test_add_file_to_dict_workers(self):
+        with tempfile.TemporaryDirectory("test_workers") as data_dir:
+            filename = os.path.join(data_dir, "dummy.txt")
+            with open(filename, "w", encoding="utf-8") as data:
+                for i in range(500):
+                    data.write(" ".join(f"w{j}" for j in range(i % 37)) + "\n")
+
+            dicts = []
+            for num_workers, max_symbols in [(1, None), (4, None), (4, 20)]:
+                d = Dictionary()
+                Dictionary.add_file_to_dictionary(
+                    filename, d, tokenizer.tokenize_line, num_workers, max_symbols
+                )
+                dicts.append(d)
+            # special symbols start with a count of 1
+            self.assertEqual(dicts[0].count[dicts[0].eos()], 501)
+            self.assertEqual(dicts[0].count[dicts[0].index("w0")], 486)
+            self.assertEqual(
+                dict(zip(dicts[0].symbols, dicts[0].count)),
+                dict(zip(dicts[1].symbols, dicts[1].count)),
+            )
+            # pruning keeps the most frequent words with exact counts here
+            pruned = dicts[2]
+            self.assertLessEqual(len(pruned), pruned.nspecial + 20)
+            for w in ["w0", "w1", "w2"]:
+                self.assertEqual(
+                    pruned.count[pruned.index(w)], dicts[0].count[dicts[0].index(w)]
+                )
+
+    def test_encode_lines(self):
+        lines = ["a b  c\n", "", "\tc a d e ", "b"]
+        d = Dictionary()
+        for c in "abc":
+            d.add_symbol(c)
+        d.freeze()
+        with self.assertRaises(RuntimeError):
+            d.add_symbol("d")
+        with self.assertRaises(RuntimeError):
+            d.encode_lines(lines)
+
+        for append_eos in [True, False]:
+            for reverse_order in [True, False]:
+                replaced = Counter()
+                tokens, offsets = d.encode_lines(
+                    lines,
+                    add_if_not_exist=False,
+                    append_eos=append_eos,
+                    reverse_order=reverse_order,
+                    replaced=replaced,
+                )
+                self.assertEqual(tokens.dtype, np.int32)
+                self.assertEqual(replaced, Counter({"d": 1, "e": 1}))
+                for i, line in enumerate(lines):
+                    expected = d.encode_line(
+                        line,
+                        add_if_not_exist=False,
+                        append_eos=append_eos,
+                        reverse_order=reverse_order,
+                    )
+                    self.assertEqual(
+                        tokens[offsets[i] : offsets[i + 1]].tolist(),
+                        expected.tolist(),
+                    )
+
+        # adding symbols in order, like encode_line
+        d = Dictionary()
+        tokens, offsets = d.encode_lines(lines, line_tokenizer=tokenizer.tokenize_line)
+        self.assertEqual(d.symbols[d.nspecial :], ["a", "b", "c", "d", "e"])
+        self.assertEqual(offsets.tolist(), [0, 4, 5, 10, 12])
+
+    def test_strings(self):
+        def reference_string(d, tensor, bpe_symbol, unk_string, extra):
+            ignore = set(extra) | {d.eos(), d.bos()}
+            words = [
+                (unk_string or d.unk_string()) if i == d.unk() else d[i]
+                for i in tensor.tolist()
+                if i not in ignore
+            ]
+            return data_utils.post_process(" ".join(words), bpe_symbol)
+
+        d = Dictionary()
+        for sym in ["a", "b@@", "c", "\u2581d", "e"]:
+            d.add_symbol(sym)
+        rng = torch.Generator().manual_seed(0)
+        tokens = torch.randint(0, len(d) + 2, (20, 12), generator=rng)
+        for bpe_symbol in [None, "@@ ", "sentencepiece"]:
+            for unk_string, extra in [(None, []), ("UNK", [d.pad(), 5])]:
+                expected = [
+                    reference_string(d, t, bpe_symbol, unk_string, extra)
+                    for t in tokens
+                ]
+                self.assertEqual(
+                    d.strings(
+                        tokens,
+                        bpe_symbol,
+                        extra_symbols_to_ignore=extra,
+                        unk_string=unk_string,
+                    ),
+                    expected,
+                )
+                rows = [t[: i % 12] for i, t in enumerate(tokens)]
+                self.assertEqual(
+                    d.strings(
+                        rows,
+                        bpe_symbol,
+                        extra_symbols_to_ignore=extra,
+                        unk_string=unk_string,
+                    ),
+                    [
+                        reference_string(d, t, bpe_symbol, unk_string, extra)
+                        for t in rows
+                    ],
+                )
+                self.assertEqual(
+                    d.string(
+                        tokens[0],
+                        bpe_symbol,
+                        extra_symbols_to_ignore=extra,
+                        unk_string=unk_string,
+                    ),
+                    expected[0],
+                )
+        self.assertEqual(d.strings([], "sentencepiece"), [])
+
 
 if __name__ == "__main__":
     unittest.main()
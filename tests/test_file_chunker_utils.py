@@ -61,3 +61,23 @@ class TestFileChunker(unittest.TestCase):
                 self.assertListEqual(
                     all_lines, [self._line_content for _ in range(len(all_lines))]
                 )
+
+    def test_read_compressed(self):
+        import gzip
+        import lzma
+
+        from fairseq.file_chunker_utils import Chunker, find_offsets
+
+        with open(self._tmpfile, "rb") as f:
+            data = f.read()
+        for ext, compress in [(".gz", gzip.compress), (".xz", lzma.compress)]:
+            path = os.path.join(self._tmpdir, "test.txt" + ext)
+            with open(path, "wb") as f:
+                f.write(compress(data))
+            # compressed files are read in a single chunk
+            offsets = find_offsets(path, self._num_splits)
+            self.assertEqual(offsets, [0, -1])
+            with Chunker(path, *offsets) as lines:
+                self.assertListEqual(
+                    list(lines), [self._line_content] * self._num_lines
+                )
@@ -0,0 +1,77 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import json
+import os
+import pickle
+import tempfile
+import unittest
+
+from fairseq.data.encoders.gpt2_bpe import GPT2BPE, GPT2BPEConfig
+from fairseq.data.encoders.gpt2_bpe_utils import bytes_to_unicode, get_encoder
+
+MERGES = [("a", "b"), ("ab", "c"), ("b", "b"), ("a", "a"), ("Ġ", "a")]
+
+
+class TestGPT2BPE(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        symbols = list(bytes_to_unicode().values())
+        symbols += ["".join(merge) for merge in MERGES]
+        self.encoder_json = os.path.join(self.tmpdir.name, "encoder.json")
+        with open(self.encoder_json, "w") as f:
+            json.dump({s: i for i, s in enumerate(symbols)}, f)
+        self.vocab_bpe = os.path.join(self.tmpdir.name, "vocab.bpe")
+        with open(self.vocab_bpe, "w", encoding="utf-8") as f:
+            f.write("#version: 0.2\n")
+            for merge in MERGES:
+                f.write(" ".join(merge) + "\n")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_bpe(self):
+        encoder = get_encoder(self.encoder_json, self.vocab_bpe)
+        self.assertEqual(encoder.bpe("aaab"), "aa ab")
+        self.assertEqual(encoder.bpe("abbb"), "ab bb")
+        self.assertEqual(encoder.bpe("aaaaa"), "aa aa a")
+        self.assertEqual(encoder.bpe("abc"), "abc")
+        self.assertEqual(encoder.bpe("cab"), "c ab")
+        self.assertEqual(encoder.bpe("x"), "x")
+        self.assertEqual(encoder.bpe(""), "")
+        self.assertEqual(encoder.bpe("ab" * 500 + "c"), "ab " * 499 + "abc")
+
+    def test_encode_and_cache(self):
+        encoder = get_encoder(self.encoder_json, self.vocab_bpe)
+        encoder._encode_word.cache_clear()
+        encoder.cache_size = 2
+        encoder = pickle.loads(pickle.dumps(encoder))
+        text = "abc aab, héllo abc\n"
+        ids = encoder.encode(text)
+        self.assertEqual(encoder.decode(ids), text)
+        self.assertEqual(encoder.decoder[ids[0]], "abc")
+        # the cache is bounded
+        info = encoder.cache_info()
+        self.assertEqual(info.maxsize, 2)
+        self.assertEqual(info.currsize, 2)
+        self.assertEqual(
+            info.hits + info.misses, len(encoder.re.findall(encoder.pat, text))
+        )
+
+    def test_encode_batch(self):
+        bpe = GPT2BPE(
+            GPT2BPEConfig(
+                gpt2_encoder_json=self.encoder_json, gpt2_vocab_bpe=self.vocab_bpe
+            )
+        )
+        texts = ["abc aab", "", "héllo", "bbb abab"] * 5
+        expected = [bpe.encode(text) for text in texts]
+        self.assertEqual(bpe.encode_batch(texts), expected)
+        self.assertEqual(bpe.encode_batch(texts, num_workers=2), expected)
+        self.assertEqual([bpe.decode(x) for x in expected], texts)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,192 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+import pickle
+import unittest
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import torch
+
+from fairseq import utils
+from fairseq.data import data_utils, indexed_dataset
+
+
+def make_mmap_dataset(prefix, items, dtype=np.uint16):
+    builder = indexed_dataset.MMapIndexedDatasetBuilder(
+        indexed_dataset.data_file_path(prefix), dtype=dtype
+    )
+    for item in items:
+        builder.add_item(torch.IntTensor(item))
+    builder.finalize(indexed_dataset.index_file_path(prefix))
+    return indexed_dataset.MMapIndexedDataset(prefix)
+
+
+def make_items(num_items=50, max_len=20, seed=0):
+    rng = np.random.RandomState(seed)
+    return [
+        rng.randint(4, 1000, size=rng.randint(0, max_len)).tolist()
+        for _ in range(num_items)
+    ]
+
+
+class TestMMapIndexedDataset(unittest.TestCase):
+    def test_get_many_matches_getitem(self):
+        items = make_items()
+        with TemporaryDirectory() as dirname:
+            dataset = make_mmap_dataset(os.path.join(dirname, "test"), items)
+            indices = np.random.RandomState(1).permutation(len(items))[:17]
+
+            tokens, offsets = dataset.get_many(indices)
+
+            self.assertEqual(tokens.dtype, torch.int64)
+            self.assertEqual(len(offsets), len(indices) + 1)
+            for j, i in enumerate(indices):
+                self.assertEqual(
+                    tokens[offsets[j] : offsets[j + 1]].tolist(), dataset[i].tolist()
+                )
+            del dataset
+
+    def test_getitems(self):
+        items = make_items()
+        with TemporaryDirectory() as dirname:
+            dataset = make_mmap_dataset(os.path.join(dirname, "test"), items)
+            indices = [3, 0, 3, 49, 7]
+
+            self.assertEqual(
+                [t.tolist() for t in dataset.__getitems__(indices)],
+                [items[i] for i in indices],
+            )
+            del dataset
+
+    def test_native_dtype(self):
+        items = make_items()
+        with TemporaryDirectory() as dirname:
+            prefix = os.path.join(dirname, "test")
+            make_mmap_dataset(prefix, items)
+            dataset = indexed_dataset.make_dataset(prefix, "mmap", native_dtype=True)
+
+            self.assertEqual(dataset[1].dtype, torch.uint16)
+            self.assertEqual(dataset[1].tolist(), items[1])
+            tokens, _ = dataset.get_many([0, 1])
+            self.assertEqual(tokens.dtype, torch.uint16)
+
+            batch = data_utils.collate_tokens([dataset[1], dataset[2]], pad_idx=1)
+            self.assertEqual(batch.dtype, torch.uint16)
+            # widened once the batch is on its device
+            sample = utils.widen_native_dtype({"net_input": {"src_tokens": batch}})
+            self.assertEqual(sample["net_input"]["src_tokens"].dtype, torch.int64)
+            self.assertEqual(
+                sample["net_input"]["src_tokens"][0, : len(items[1])].tolist(), items[1]
+            )
+
+            restored = pickle.loads(pickle.dumps(dataset))
+            self.assertEqual(restored[1].dtype, torch.uint16)
+            del dataset, restored
+
+    def test_warmup_modes(self):
+        items = make_items()
+        with TemporaryDirectory() as dirname:
+            prefix = os.path.join(dirname, "test")
+            make_mmap_dataset(prefix, items)
+            for warmup in ["full", "index", "background", "madvise", "none"]:
+                dataset = indexed_dataset.MMapIndexedDataset(prefix, warmup=warmup)
+                self.assertEqual(dataset.supports_prefetch, warmup == "madvise")
+                dataset.prefetch(np.arange(len(items))[::-3])
+                restored = pickle.loads(pickle.dumps(dataset))
+                self.assertEqual(restored._warmup, warmup)
+                self.assertEqual([restored[i].tolist() for i in range(5)], items[:5])
+                del dataset, restored
+
+            with self.assertRaises(ValueError):
+                indexed_dataset.MMapIndexedDataset(prefix, warmup="eager")
+
+    def test_merge_files(self):
+        items = make_items(num_items=100)
+        with TemporaryDirectory() as dirname:
+            parts = []
+            for k, (start, end) in enumerate([(10, 40), (40, 41), (41, 90)]):
+                parts.append(os.path.join(dirname, f"part{k}"))
+                make_mmap_dataset(parts[-1], items[start:end])
+
+            prefix = os.path.join(dirname, "merged")
+            builder = indexed_dataset.MMapIndexedDatasetBuilder(
+                indexed_dataset.data_file_path(prefix), dtype=np.uint16
+            )
+            for item in items[:10]:
+                builder.add_item(torch.IntTensor(item))
+            builder.merge_files_(parts)
+            for item in items[90:]:
+                builder.add_item(torch.IntTensor(item))
+            builder.finalize(indexed_dataset.index_file_path(prefix))
+
+            dataset = indexed_dataset.MMapIndexedDataset(prefix)
+            self.assertEqual(dataset.sizes.tolist(), [len(item) for item in items])
+            self.assertEqual([dataset[i].tolist() for i in range(len(items))], items)
+            del dataset
+
+
+class TestCompressedIndexedDataset(unittest.TestCase):
+    def _build(self, prefix, items, codec, others=()):
+        builder = indexed_dataset.CompressedIndexedDatasetBuilder(
+            indexed_dataset.data_file_path(prefix),
+            dtype=np.uint16,
+            codec=codec,
+            block_size=64,
+        )
+        for item in items:
+            builder.add_item(torch.IntTensor(item))
+        for other in others:
+            builder.merge_file_(other)
+        builder.finalize(indexed_dataset.index_file_path(prefix))
+
+    def _check(self, prefix, items):
+        self.assertEqual(indexed_dataset.infer_dataset_impl(prefix), "compressed")
+        dataset = indexed_dataset.make_dataset(prefix, "compressed")
+        self.assertEqual(len(dataset), len(items))
+        self.assertEqual(dataset.sizes.tolist(), [len(item) for item in items])
+        for i in np.random.RandomState(0).permutation(len(items)):
+            self.assertEqual(dataset[i].tolist(), items[i])
+
+        tokens, offsets = dataset.get_many([4, 2])
+        self.assertEqual(tokens.tolist(), items[4] + items[2])
+        self.assertEqual(offsets.tolist(), [0, len(items[4]), len(items[4] + items[2])])
+        self.assertGreater(dataset.cache_info().hits, 0)
+        del dataset
+
+    def test_can_encode_decode(self):
+        codecs = ["zlib"]
+        try:
+            import zstandard  # noqa: F401
+
+            codecs.append("zstd")
+        except ImportError:
+            pass
+        items = make_items(num_items=200)
+        for codec in codecs:
+            with self.subTest(codec=codec), TemporaryDirectory() as dirname:
+                prefix = os.path.join(dirname, "test")
+                self._build(prefix, items, codec)
+                self._check(prefix, items)
+
+    def test_can_merge(self):
+        items = make_items(num_items=200)
+        with TemporaryDirectory() as dirname:
+            first, second = os.path.join(dirname, "first"), os.path.join(
+                dirname, "second"
+            )
+            self._build(first, items[:90], "zlib")
+            self._build(second, items[90:], "zlib")
+
+            # merge at a block boundary copies blocks, otherwise recompresses
+            for pre_items in [[], items[:10]]:
+                merged = os.path.join(dirname, "merged")
+                self._build(merged, pre_items, "zlib", others=[first, second])
+                self._check(merged, pre_items + items)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,9 +3,14 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import tempfile
 import unittest
+from unittest.mock import patch
 
-from fairseq.data import iterators, ListDataset
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from fairseq.data import iterators, ListDataset, TokenBudgets
 
 
 class TestIterators(unittest.TestCase):
@@ -174,6 +179,239 @@ class TestIterators(unittest.TestCase):
         grouped_itr6 = iterators.GroupedIterator(itr6, 2, False)
         self.assertEqual(len(grouped_itr6), 1)
 
+    def test_persisted_batches(self):
+        batches = [np.array([3, 1]), np.array([], dtype=np.int64), range(4, 7)]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = f"{tmp}/batches.npy"
+            iterators.PersistedBatches.save(batches, path)
+            loaded = iterators.PersistedBatches.load(path)
+            self.assertEqual(len(loaded), 3)
+            self.assertEqual([b.tolist() for b in loaded], [[3, 1], [], [4, 5, 6]])
+            self.assertEqual([b.tolist() for b in loaded[1:]], [[], [4, 5, 6]])
+            self.assertEqual(len(loaded[3:]), 0)
+            self.assertEqual(loaded[-1].dtype, np.int64)
+
+    def test_epoch_batch_iterator_resume_from_persisted_batches(self):
+        reference = list(range(50))
+        with tempfile.TemporaryDirectory() as tmp:
+
+            def make_itr():
+                dataset = ListDataset(reference)
+                return iterators.EpochBatchIterator(
+                    dataset=dataset,
+                    collate_fn=dataset.collater,
+                    batch_sampler=[[i, i + 1, i + 2] for i in range(0, 48, 3)],
+                    num_shards=2,
+                    shard_id=1,
+                    epoch=2,
+                    batches_dir=tmp,
+                )
+
+            itr = make_itr()
+            epoch_itr = itr.next_epoch_itr(shuffle=True)
+            expected = [[int(i) for i in b] for b in epoch_itr]
+
+            itr = make_itr()
+            epoch_itr = itr.next_epoch_itr(shuffle=True)
+            consumed = [[int(i) for i in next(epoch_itr)] for _ in range(3)]
+            self.assertEqual(consumed, expected[:3])
+            state = itr.state_dict()
+            self.assertIn("batches_key", state)
+
+            resumed = make_itr()
+
+            def fail(*args, **kwargs):
+                raise AssertionError("batches should not be rebuilt")
+
+            resumed.ordered_batches = fail
+            resumed.load_state_dict(state)
+            epoch_itr = resumed.next_epoch_itr(shuffle=True)
+            self.assertEqual(epoch_itr.n, 3)
+            self.assertEqual([[int(i) for i in b] for b in epoch_itr], expected[3:])
+
+    def test_process_buffered_iterator(self):
+        data = [torch.arange(i, i + 4 + i % 3, dtype=torch.float) for i in range(40)]
+
+        def collate(samples):
+            return {
+                "x": torch.nn.utils.rnn.pad_sequence(samples, batch_first=True),
+                "mask": torch.ones(len(samples), 2, dtype=torch.bool),
+                "sizes": [len(s) for s in samples],
+                "nsentences": len(samples),
+            }
+
+        def make_itr(**kwargs):
+            return iterators.EpochBatchIterator(
+                dataset=ListDataset(data),
+                collate_fn=collate,
+                batch_sampler=[list(range(i, i + 3)) for i in range(0, 39, 3)],
+                buffer_size=2,
+                **kwargs,
+            ).next_epoch_itr(shuffle=True)
+
+        expected = list(make_itr())
+        # holding on to every batch exhausts the slots, later batches are
+        # sent through the queue
+        held = list(make_itr(buffer_backend="process"))
+        # releasing every batch reuses the slots
+        released = [
+            {"x": b["x"].clone(), "sizes": b["sizes"]}
+            for b in make_itr(buffer_backend="process")
+        ]
+        # small slots also fall back to the queue
+        small = list(make_itr(buffer_backend="process", buffer_slot_bytes=64))
+        for batches in (held, released, small):
+            self.assertEqual(len(batches), len(expected))
+            for batch, ref in zip(batches, expected):
+                self.assertTrue(torch.equal(batch["x"], ref["x"]))
+                self.assertEqual(batch["sizes"], ref["sizes"])
+        self.assertTrue(held[0]["mask"].all())
+        self.assertEqual(held[-1]["nsentences"], 3)
+
+    def test_process_buffered_iterator_cuda_initialized(self):
+        data = [torch.arange(i, i + 4, dtype=torch.float) for i in range(12)]
+        dataset = ListDataset(data)
+
+        def make_itr(**kwargs):
+            return iterators.EpochBatchIterator(
+                dataset=dataset,
+                collate_fn=torch.stack,
+                batch_sampler=[list(range(i, i + 3)) for i in range(0, 12, 3)],
+                buffer_size=2,
+                **kwargs,
+            ).next_epoch_itr(shuffle=True)
+
+        expected = list(make_itr())
+        # the producer must not be forked once CUDA is initialized
+        with patch("torch.cuda.is_initialized", return_value=True), patch(
+            "torch.multiprocessing.get_context", wraps=mp.get_context
+        ) as get_context:
+            batches = list(make_itr(buffer_backend="process"))
+        get_context.assert_called_once_with("forkserver")
+        self.assertEqual(len(batches), len(expected))
+        for batch, ref in zip(batches, expected):
+            self.assertTrue(torch.equal(batch, ref))
+
+    def test_process_buffered_iterator_error(self):
+        def collate(samples):
+            raise ValueError("bad batch")
+
+        itr = iterators.ProcessBufferedIterator(
+            2, ListDataset(list(range(4))), collate, [[0, 1], [2, 3]]
+        )
+        with self.assertRaisesRegex(RuntimeError, "bad batch"):
+            next(itr)
+
+    def test_token_budgets(self):
+        budgets = TokenBudgets(
+            100, min_tokens=50, max_tokens_limit=150, num_buckets=2, min_steps=2
+        )
+        budgets.init_buckets(np.array([10] * 5 + [40] * 5))
+        self.assertEqual(budgets.bounds.tolist(), [10, 40])
+        self.assertEqual(budgets.budgets_for_epoch(1).tolist(), [100, 100])
+
+        # too few steps keep the budget, otherwise grow while it helps
+        budgets.observe(10, 90, 1.0)
+        budgets.observe(40, 80, 1.0)
+        budgets.observe(40, 80, 1.0)
+        self.assertEqual(budgets.budgets_for_epoch(2).tolist(), [100, 110])
+        self.assertEqual(budgets.budgets_for_epoch(2).tolist(), [100, 110])
+
+        # the throughput counts the tokens of the batches, not their budget
+        for _ in range(2):
+            budgets.observe(40, 80, 1.1)
+        self.assertEqual(budgets.budgets_for_epoch(3).tolist(), [100, 100])
+        for _ in range(2):
+            budgets.observe(40, 80, 0.1)
+        self.assertEqual(budgets.budgets_for_epoch(4).tolist(), [100, 100])
+
+        # running out of memory shrinks
+        budgets.observe(8, 80, 1.0, oom=True)
+        self.assertEqual(budgets.budgets_for_epoch(5).tolist(), [80, 100])
+
+        restored = TokenBudgets(100)
+        restored.load_state_dict(budgets.state_dict())
+        self.assertEqual(restored.budgets_for_epoch(5).tolist(), [80, 100])
+
+    def test_token_budgets_memory(self):
+        budgets = TokenBudgets(
+            100,
+            min_tokens=50,
+            max_tokens_limit=1000,
+            num_buckets=1,
+            min_steps=1,
+            total_memory=100,
+        )
+        budgets.init_buckets(np.array([10]))
+        budgets.budgets_for_epoch(1)
+        budgets.observe(10, 100, 1.0, peak_memory=95)
+        self.assertEqual(budgets.budgets_for_epoch(2).tolist(), [80])
+        budgets.observe(10, 80, 1.0, peak_memory=85)
+        self.assertEqual(budgets.budgets_for_epoch(3).tolist(), [80])
+        budgets.observe(10, 80, 1.0, peak_memory=50)
+        self.assertEqual(budgets.budgets_for_epoch(4).tolist(), [88])
+
+    def test_token_budgets_reduce(self):
+        reduced = []
+
+        def reduce_fn(stats):
+            reduced.append(stats.copy())
+            # another worker ran out of memory
+            stats[4] = np.maximum(stats[4], 1)
+            return stats
+
+        budgets = TokenBudgets(100, min_tokens=50, num_buckets=1, min_steps=1)
+        budgets.init_buckets(np.array([10]))
+        budgets.budgets_for_epoch(1)
+        for _ in range(3):
+            budgets.observe(10, 90, 1.0)
+        # building the batches of the next epoch does not communicate
+        self.assertEqual(budgets.budgets_for_epoch(1).tolist(), [100])
+        budgets.reduce_stats(reduce_fn)
+        self.assertEqual(budgets.budgets_for_epoch(2).tolist(), [80])
+        self.assertEqual(len(reduced), 1)
+        self.assertEqual(reduced[0][:, 0].tolist(), [3, 270, 3.0, 0, 0])
+
+    def test_epoch_batch_iterator_token_budgets(self):
+        sizes = np.array([4] * 20 + [16] * 20)
+        dataset = ListDataset(list(range(len(sizes))), sizes=sizes)
+
+        def make_itr(budgets, epoch=1):
+            return iterators.EpochBatchIterator(
+                dataset=dataset,
+                collate_fn=dataset.collater,
+                batch_sampler=[list(range(i, i + 4)) for i in range(0, 40, 4)],
+                epoch=epoch,
+                token_budgets=budgets,
+            )
+
+        budgets = TokenBudgets(32, max_tokens_limit=64, num_buckets=2, min_steps=1)
+        itr = make_itr(budgets)
+        self.assertEqual(len(itr), 13)
+        for batch in itr.next_epoch_itr(shuffle=False):
+            self.assertLessEqual(len(batch) * sizes[batch].max(), 32)
+            budgets.observe(int(sizes[batch].max()), int(sizes[batch].sum()), 1.0)
+
+        itr = make_itr(budgets, epoch=2)
+        epoch_itr = itr.next_epoch_itr(shuffle=True)
+        self.assertEqual(budgets.budgets.tolist(), [35, 35])
+        expected = [[int(i) for i in b] for b in epoch_itr]
+        self.assertEqual(sorted(i for b in expected for i in b), list(range(40)))
+
+        # resuming mid-epoch rebuilds the batches with the budgets of the epoch
+        itr = make_itr(budgets, epoch=2)
+        epoch_itr = itr.next_epoch_itr(shuffle=True)
+        next(epoch_itr)
+        for _ in range(3):
+            budgets.observe(4, 32, 1.0)
+        state = itr.state_dict()
+        restored = TokenBudgets(32, max_tokens_limit=64, num_buckets=2, min_steps=1)
+        itr = make_itr(restored, epoch=2)
+        itr.load_state_dict(state)
+        epoch_itr = itr.next_epoch_itr(shuffle=True)
+        self.assertEqual([[int(i) for i in b] for b in epoch_itr], expected[1:])
+        self.assertEqual(restored.budgets_for_epoch(3).tolist(), [38, 35])
+
 
 def _get_epoch_batch_itr(ref, bsz, skip_remainder_batch):
     dsz = len(ref)
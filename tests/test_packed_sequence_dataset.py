@@ -0,0 +1,194 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import unittest
+
+import numpy as np
+import tests.utils as test_utils
+import torch
+import torch.nn as nn
+from fairseq import utils
+from fairseq.data import (
+    Dictionary,
+    MonolingualDataset,
+    PackedSegmentIdsDataset,
+    PackedSequenceDataset,
+)
+from fairseq.data.packed_sequence_dataset import pack_sequences
+from fairseq.models.transformer import (
+    TransformerConfig,
+    TransformerDecoderBase,
+    TransformerEncoderBase,
+)
+
+
+class TestPackedSequenceDataset(unittest.TestCase):
+    def _build_dataset(self, sizes, max_length):
+        data = [
+            torch.arange(1, n + 1, dtype=torch.long) * 10 + i
+            for i, n in enumerate(sizes)
+        ]
+        return PackedSequenceDataset(test_utils.TestDataset(data), sizes, max_length)
+
+    def test_pack_sequences(self):
+        rng = np.random.RandomState(0)
+        sizes = rng.randint(1, 20, size=500)
+        items, offsets = pack_sequences(sizes, 32)
+        self.assertEqual(sorted(items.tolist()), list(range(len(sizes))))
+        row_sizes = np.add.reduceat(sizes[items], offsets[:-1])
+        self.assertTrue((row_sizes <= 32).all())
+        # best-fit decreasing stays close to the lower bound
+        self.assertLessEqual(len(row_sizes), int(np.ceil(sizes.sum() / 32)) + 2)
+        for i in range(len(offsets) - 1):
+            row = items[offsets[i] : offsets[i + 1]]
+            self.assertTrue((np.diff(row) > 0).all())
+
+    def test_oversize_items_get_their_own_row(self):
+        ds = self._build_dataset([10, 3, 2], max_length=5)
+        self.assertEqual(len(ds), 2)
+        self.assertEqual(sorted(ds.sizes.tolist()), [5, 10])
+
+    def test_getitem_and_segment_ids(self):
+        ds = self._build_dataset([3, 2, 4, 1], max_length=5)
+        self.assertEqual(ds.sizes.sum(), 10)
+        seg = PackedSegmentIdsDataset(ds)
+        for i in range(len(ds)):
+            row_items = ds.row_items(i).tolist()
+            expected = torch.cat([ds.dataset[j] for j in row_items])
+            self.assertEqual(ds[i].tolist(), expected.tolist())
+            self.assertEqual(len(seg[i]), ds.sizes[i])
+            self.assertEqual(
+                torch.unique_consecutive(seg[i], return_counts=True)[1].tolist(),
+                ds.segment_sizes(i).tolist(),
+            )
+
+        batch = seg.collater([seg[i] for i in range(len(ds))])
+        self.assertEqual(batch.shape, (len(ds), ds.sizes.max()))
+        self.assertEqual(batch.eq(-1).sum().item(), batch.numel() - ds.sizes.sum())
+
+    def test_tuple_items(self):
+        data = [
+            (torch.tensor([1, 2]), torch.tensor([2, 3]), None),
+            (torch.tensor([4]), torch.tensor([5]), None),
+        ]
+        ds = PackedSequenceDataset(test_utils.TestDataset(data), [2, 1], 3)
+        source, target, past = ds[0]
+        self.assertEqual(source.tolist(), [1, 2, 4])
+        self.assertEqual(target.tolist(), [2, 3, 5])
+        self.assertIsNone(past)
+
+    def test_monolingual_dataset(self):
+        vocab = Dictionary()
+        for c in "abcdefgh":
+            vocab.add_symbol(c)
+        data = [
+            (torch.tensor([vocab.eos()] + toks[:-1]), torch.tensor(toks), None)
+            for toks in [[5, 6, 2], [7, 2], [8, 9, 10, 2]]
+        ]
+        ds = PackedSequenceDataset(test_utils.TestDataset(data), [3, 2, 4], 5)
+        mono = MonolingualDataset(
+            ds,
+            ds.sizes,
+            vocab,
+            targets=["future"],
+            segment_ids=PackedSegmentIdsDataset(ds),
+        )
+        batch = mono.collater([mono[i] for i in range(len(mono))])
+        segment_ids = batch["net_input"]["segment_ids"]
+        self.assertEqual(segment_ids.shape, batch["net_input"]["src_tokens"].shape)
+        self.assertEqual(
+            segment_ids.ne(-1).sum().item(),
+            batch["net_input"]["src_tokens"].ne(vocab.pad()).sum().item(),
+        )
+
+
+class TestPackedSequenceModels(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.vocab = test_utils.dummy_dictionary(20)
+        self.pad = self.vocab.pad()
+        self.cfg = TransformerConfig()
+        for part in (self.cfg.encoder, self.cfg.decoder):
+            part.embed_dim = 16
+            part.ffn_embed_dim = 32
+            part.attention_heads = 2
+            part.layers = 2
+        self.cfg.dropout = 0.0
+        self.cfg.max_source_positions = self.cfg.max_target_positions = 32
+        # one row packing two sequences, the second row is a single padded one
+        self.lengths = [[3, 4], [5]]
+
+    def _embed_tokens(self):
+        return nn.Embedding(len(self.vocab), 16, self.pad)
+
+    def _sequences(self):
+        return [
+            [torch.randint(self.vocab.nspecial, len(self.vocab), (n,)) for n in row]
+            for row in self.lengths
+        ]
+
+    def _packed_batch(self, sequences):
+        tokens = [torch.cat(row) for row in sequences]
+        segment_ids = [
+            torch.repeat_interleave(torch.arange(len(row)), torch.tensor(lengths))
+            for row, lengths in zip(sequences, self.lengths)
+        ]
+        width = max(len(t) for t in tokens)
+        src_tokens = torch.full((len(tokens), width), self.pad)
+        seg = torch.full((len(tokens), width), -1)
+        for i, (t, s) in enumerate(zip(tokens, segment_ids)):
+            src_tokens[i, : len(t)] = t
+            seg[i, : len(s)] = s
+        return src_tokens, seg
+
+    def test_make_segment_positions(self):
+        segment_ids = torch.tensor([[0, 0, 1, 1, 1, -1], [0, 1, 2, -1, -1, -1]])
+        positions = utils.make_segment_positions(segment_ids, self.pad)
+        p = self.pad
+        self.assertEqual(
+            positions.tolist(),
+            [
+                [p + 1, p + 2, p + 1, p + 2, p + 3, p],
+                [p + 1, p + 1, p + 1, p, p, p],
+            ],
+        )
+
+    def test_encoder(self):
+        encoder = TransformerEncoderBase(self.cfg, self.vocab, self._embed_tokens())
+        encoder.eval()
+        sequences = self._sequences()
+        src_tokens, segment_ids = self._packed_batch(sequences)
+        with torch.no_grad():
+            packed = encoder(src_tokens, segment_ids=segment_ids)["encoder_out"][0]
+            for i, row in enumerate(sequences):
+                start = 0
+                for seq in row:
+                    alone = encoder(seq.unsqueeze(0))["encoder_out"][0]
+                    torch.testing.assert_close(
+                        packed[start : start + len(seq), i], alone[:, 0]
+                    )
+                    start += len(seq)
+
+    def test_decoder(self):
+        decoder = TransformerDecoderBase(
+            self.cfg, self.vocab, self._embed_tokens(), no_encoder_attn=True
+        )
+        decoder.eval()
+        sequences = self._sequences()
+        tokens, segment_ids = self._packed_batch(sequences)
+        with torch.no_grad():
+            packed, _ = decoder(tokens, segment_ids=segment_ids)
+            for i, row in enumerate(sequences):
+                start = 0
+                for seq in row:
+                    alone, _ = decoder(seq.unsqueeze(0))
+                    torch.testing.assert_close(
+                        packed[i, start : start + len(seq)], alone[0]
+                    )
+                    start += len(seq)
+
+
+if __name__ == "__main__":
+    unittest.main()
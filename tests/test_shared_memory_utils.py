@@ -0,0 +1,97 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import contextlib
+import os
+import pickle
+import tempfile
+import unittest
+from io import StringIO
+
+import numpy as np
+
+from fairseq.data.shared_memory_utils import SharedMemoryArray, SharedMemoryView
+from tests.utils import create_dummy_data, preprocess_lm_data, train_language_model
+
+dummy_path = "dummy"
+
+
+class TestSharedMemoryArray(unittest.TestCase):
+    def test_small_arrays_are_pickled(self):
+        data = np.arange(10)
+        arr = pickle.loads(pickle.dumps(SharedMemoryArray(data)))
+        self.assertIsNone(arr.path)
+        np.testing.assert_array_equal(arr.array, data)
+
+    def test_pickle_moves_to_shared_memory(self):
+        with tempfile.TemporaryDirectory() as shm_path:
+            data = np.arange(1000, dtype=np.int64).reshape(500, 2)
+            arr = SharedMemoryArray(data, shm_path=shm_path, min_nbytes=0)
+            restored = pickle.loads(pickle.dumps(arr))
+
+            self.assertTrue(os.path.exists(arr.path))
+            self.assertEqual(restored.path, arr.path)
+            self.assertIsInstance(restored.array, np.memmap)
+            self.assertFalse(restored.array.flags.writeable)
+            np.testing.assert_array_equal(restored.array, data)
+
+            # pickling again reuses the same file
+            self.assertEqual(pickle.loads(pickle.dumps(arr)).path, arr.path)
+
+            path = arr.path
+            del arr, restored
+            self.assertFalse(os.path.exists(path))
+
+
+class TestSharedMemoryView(unittest.TestCase):
+    def test_same_key_shares_file(self):
+        with tempfile.TemporaryDirectory() as shm_path:
+            data = np.array([4, 4, 4])
+            arr1 = SharedMemoryView(data, dummy_path, 1, shm_path=shm_path)
+            arr1b = SharedMemoryView(
+                np.array([5, 5, 5]), dummy_path, 1, shm_path=shm_path
+            )
+            arr1c = SharedMemoryView(None, dummy_path, 1, shm_path=shm_path)
+            arr2 = SharedMemoryView(data, dummy_path, (1, 2), shm_path=shm_path)
+
+            self.assertEqual(arr1.path, arr1b.path)
+            self.assertEqual(arr1.path, arr1c.path)
+            self.assertNotEqual(arr1.path, arr2.path)
+            np.testing.assert_array_equal(arr1b.array, data)
+            np.testing.assert_array_equal(arr1c.array, data)
+            self.assertEqual(len(arr1c), 3)
+
+            restored = pickle.loads(pickle.dumps(arr1))
+            np.testing.assert_array_equal(restored.array, data)
+
+    def test_stale_file_is_replaced(self):
+        with tempfile.TemporaryDirectory() as shm_path:
+            SharedMemoryView(np.array([4, 4, 4]), dummy_path, 1, shm_path=shm_path)
+            data = np.array([5, 5], dtype=np.uint16)
+            arr = SharedMemoryView(data, dummy_path, 1, shm_path=shm_path)
+            self.assertEqual(arr.array.dtype, np.uint16)
+            np.testing.assert_array_equal(arr.array, data)
+
+            # e.g. a file truncated by a crash
+            with open(arr.path, "wb") as f:
+                f.write(b"\x93NUMPY")
+            arr = SharedMemoryView(data, dummy_path, 1, shm_path=shm_path)
+            np.testing.assert_array_equal(arr.array, data)
+
+    def test_training_lm_shared_memory_view(self):
+        with contextlib.redirect_stdout(StringIO()):
+            with tempfile.TemporaryDirectory("test_transformer_lm") as data_dir:
+                create_dummy_data(data_dir)
+                preprocess_lm_data(data_dir)
+                train_language_model(
+                    data_dir,
+                    "transformer_lm",
+                    ["--use-shared-memory-view", "--shared-memory-path", data_dir],
+                    run_validation=True,
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+import tempfile
+import unittest
+
+import torch
+from fairseq.data import FairseqDataset, StreamingFileCache, StreamingIndexedDataset
+from fairseq.data.indexed_dataset import MMapIndexedDatasetBuilder
+from fairseq.data.iterators import StreamingEpochBatchIterator
+from fairseq.data.streaming_dataset import read_index_length
+
+
+class ItemsDataset(FairseqDataset):
+    def __init__(self, items):
+        self.items = items
+
+    def __getitem__(self, index):
+        return {"id": index, "source": self.items[index][0]}
+
+    def __len__(self):
+        return len(self.items)
+
+    def collater(self, samples):
+        return {
+            "id": torch.LongTensor([s["id"] for s in samples]),
+            "first": torch.stack([s["source"][0] for s in samples]),
+        }
+
+
+class TestStreamingIndexedDataset(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.shards = []
+        start = 0
+        for s, size in enumerate([50, 37, 20]):
+            prefix = os.path.join(self.tmpdir.name, f"shard{s}")
+            builder = MMapIndexedDatasetBuilder(prefix + ".bin")
+            for i in range(start, start + size):
+                # the first token is the position of the item in the stream
+                builder.add_item(torch.LongTensor([i] + [7] * (i % 5)))
+            builder.finalize(prefix + ".idx")
+            self.shards.append([prefix])
+            start += size
+        self.num_items = start
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _dataset(self, shuffle_buffer=16):
+        return StreamingIndexedDataset(
+            self.shards,
+            ItemsDataset,
+            max_sample_size=5,
+            cache=StreamingFileCache(os.path.join(self.tmpdir.name, "cache")),
+            shuffle_buffer=shuffle_buffer,
+        )
+
+    def _epoch(self, num_shards=1, shard_id=0, num_workers=0, epoch=1, offset=0):
+        dataset = self._dataset()
+        dataset.set_batching(
+            max_sentences=4,
+            num_shards=num_shards,
+            shard_id=shard_id,
+            num_workers=num_workers,
+        )
+        itr = StreamingEpochBatchIterator(
+            dataset, max_sentences=None, epoch=epoch, num_workers=num_workers
+        )
+        if offset > 0:
+            itr.load_state_dict({"epoch": epoch, "iterations_in_epoch": offset})
+        batches = list(itr.next_epoch_itr())
+        for batch in batches:
+            self.assertEqual(batch["id"].tolist(), batch["first"].tolist())
+        self.assertTrue(itr.end_of_epoch())
+        return [batch["id"].tolist() for batch in batches]
+
+    def test_read_index_length(self):
+        self.assertEqual(read_index_length(self.shards[1][0]), 37)
+
+    def test_shuffled_and_deterministic(self):
+        batches = self._epoch()
+        ids = [i for batch in batches for i in batch]
+        self.assertEqual(len(batches), self.num_items // 4)
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertNotEqual(ids, sorted(ids))
+        self.assertEqual(batches, self._epoch())
+        self.assertNotEqual(batches, self._epoch(epoch=2))
+
+    def test_ranks_and_workers(self):
+        ranks = [self._epoch(3, r, num_workers=2) for r in range(3)]
+        # every rank gets the same number of full batches
+        self.assertEqual(len({len(batches) for batches in ranks}), 1)
+        self.assertTrue(all(len(b) == 4 for batches in ranks for b in batches))
+        ids = [i for batches in ranks for batch in batches for i in batch]
+        self.assertEqual(len(set(ids)), len(ids))
+        # the 6 readers get 17 or 18 items, only their last partial batch is
+        # dropped
+        self.assertEqual(len(ids), 6 * 16)
+
+    def test_resume(self):
+        for num_workers in [0, 2]:
+            batches = self._epoch(2, 1, num_workers=num_workers)
+            for offset in [1, 2, 3]:
+                resumed = self._epoch(2, 1, num_workers=num_workers, offset=offset)
+                self.assertEqual(resumed, batches[offset:])
+
+    def test_state_dict(self):
+        dataset = self._dataset()
+        dataset.set_batching(max_sentences=4)
+        itr = StreamingEpochBatchIterator(dataset, max_sentences=None)
+        epoch_itr = itr.next_epoch_itr()
+        next(epoch_itr)
+        next(epoch_itr)
+        self.assertEqual(itr.state_dict(), {"epoch": 1, "iterations_in_epoch": 2})
+        list(epoch_itr)
+        self.assertEqual(itr.state_dict(), {"epoch": 2, "iterations_in_epoch": 0})
+
+    def test_cache_eviction(self):
+        cache_dir = os.path.join(self.tmpdir.name, "cache")
+        os.makedirs(cache_dir)
+        cache = StreamingFileCache(cache_dir, max_bytes=250)
+        for i in range(4):
+            path = os.path.join(cache_dir, f"file{i}")
+            with open(path, "wb") as f:
+                f.write(b"x" * 100)
+            os.utime(path, (i, i))
+        cache._evict(keep={os.path.join(cache_dir, "file0")})
+        self.assertEqual(sorted(os.listdir(cache_dir)), ["file0", "file3"])
+        # local files are read in place
+        self.assertEqual(
+            cache.get(self.shards[0][0] + ".bin"), self.shards[0][0] + ".bin"
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
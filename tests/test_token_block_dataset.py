@@ -3,11 +3,18 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import glob
+import os
+import pickle
+import socket
+import tempfile
+import time
 import unittest
 
 import tests.utils as test_utils
 import torch
 from fairseq.data import TokenBlockDataset
+from fairseq.data.token_block_dataset import _cache_lock_is_stale, _release_cache_lock
 
 
 class TestTokenBlockDataset(unittest.TestCase):
@@ -87,6 +94,92 @@ class TestTokenBlockDataset(unittest.TestCase):
             end + 1, float
         )  # this would also raise, since np.uint64(1) + 1 => 2.0
 
+    def test_cache_path(self):
+        data = [
+            torch.tensor([5, 4, 3, 2, 1], dtype=torch.long),
+            torch.tensor([8, 7, 6, 1], dtype=torch.long),
+            torch.tensor([9, 1], dtype=torch.long),
+        ]
+        expected = self._build_dataset(
+            data, block_size=3, pad=0, eos=1, break_mode="none"
+        )
+        with tempfile.TemporaryDirectory() as dirname:
+            cache_path = os.path.join(dirname, "train")
+            for _ in range(2):
+                ds = self._build_dataset(
+                    data,
+                    block_size=3,
+                    pad=0,
+                    eos=1,
+                    break_mode="none",
+                    cache_path=cache_path,
+                )
+                self.assertEqual(len(glob.glob(cache_path + ".blocks.*.npy")), 3)
+                self.assertEqual(ds.sizes.tolist(), expected.sizes.tolist())
+                self.assertEqual(
+                    [ds[i].tolist() for i in range(len(ds))],
+                    [expected[i].tolist() for i in range(len(expected))],
+                )
+            ds = pickle.loads(pickle.dumps(ds))
+            self.assertEqual(ds.slice_indices.tolist(), expected.slice_indices.tolist())
+
+            # different block arguments get their own cache files
+            self._build_dataset(
+                data,
+                block_size=4,
+                pad=0,
+                eos=1,
+                break_mode="none",
+                cache_path=cache_path,
+            )
+            self.assertEqual(len(glob.glob(cache_path + ".blocks.*.npy")), 6)
+            self.assertEqual(glob.glob(cache_path + "*.lock"), [])
+
+    def test_cache_path_stale_lock(self):
+        data = [torch.tensor([5, 4, 3, 2, 1], dtype=torch.long)]
+        with tempfile.TemporaryDirectory() as dirname:
+            cache_path = os.path.join(dirname, "train")
+            cache_files = TokenBlockDataset._cache_files(cache_path, [5], "none", 1, 3)
+            # left behind by a writer that was killed
+            with open(cache_files[-1] + ".lock", "w") as f:
+                f.write(f"{socket.gethostname()} {2**22 + 1}\n")
+            start = time.time()
+            self._build_dataset(
+                data,
+                block_size=3,
+                pad=0,
+                eos=1,
+                break_mode="none",
+                cache_path=cache_path,
+            )
+            self.assertLess(time.time() - start, 10)
+            self.assertTrue(all(os.path.exists(path) for path in cache_files))
+            self.assertEqual(glob.glob(cache_path + "*.lock"), [])
+
+    def test_cache_lock_owner(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            lock_file = os.path.join(dirname, "train.lock")
+            owner = f"{socket.gethostname()} {os.getpid()}"
+            with open(lock_file, "w") as f:
+                f.write(f"{owner}\n")
+            # a slow writer of this host keeps its lock
+            old = time.time() - 3600
+            os.utime(lock_file, (old, old))
+            self.assertFalse(_cache_lock_is_stale(lock_file))
+            # unless it is dead
+            with open(lock_file, "w") as f:
+                f.write(f"{socket.gethostname()} {2**22 + 1}\n")
+            self.assertTrue(_cache_lock_is_stale(lock_file))
+
+            # a lock taken over by another writer is left in place
+            _release_cache_lock(lock_file, owner)
+            self.assertTrue(os.path.exists(lock_file))
+            with open(lock_file, "w") as f:
+                f.write(f"{owner}\n")
+            _release_cache_lock(lock_file, owner)
+            self.assertFalse(os.path.exists(lock_file))
+            _release_cache_lock(lock_file, owner)
+
 
 if __name__ == "__main__":
     unittest.main()
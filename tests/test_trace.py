@@ -0,0 +1,46 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import unittest
+from unittest import mock
+
+from fairseq.logging import trace
+
+
+class TestTrace(unittest.TestCase):
+    def tearDown(self):
+        trace.disable()
+
+    def test_disabled(self):
+        trace.disable()
+        self.assertIs(trace.span("x"), trace.span("y"))
+        with mock.patch.object(trace, "logger") as logger:
+            trace.event("not formatted %d", "not a number")
+            with trace.span("x"):
+                pass
+        self.assertEqual(logger.mock_calls, [])
+
+    def test_dump_on_error(self):
+        trace.enable(buffer_size=2)
+        with self.assertLogs("fairseq.trace", level="DEBUG") as logs:
+            trace.event("step %d", 1)
+        self.assertEqual(logs.records[0].getMessage(), "step 1")
+
+        with self.assertLogs("fairseq.trace", level="ERROR") as logs:
+            with self.assertRaises(ValueError):
+                with trace.span("outer"):
+                    with trace.span("inner"):
+                        trace.event("step %d", 2)
+                        raise ValueError("boom")
+        # only the innermost span dumps, the last two events
+        self.assertEqual(len(logs.records), 1)
+        dumped = logs.records[0].getMessage().splitlines()
+        self.assertEqual(dumped[0], "last 2 trace events:")
+        self.assertTrue(dumped[1].endswith("step 2"))
+        self.assertTrue(dumped[2].endswith("error in inner: ValueError('boom')"))
+
+
+if __name__ == "__main__":
+    unittest.main()